@@ -1,6 +1,20 @@
-from expression_tree import ExprTree, construct_from_list
-from expression_tree_puzzle import ExpressionTreePuzzle
-from solver import BfsSolver, DfsSolver
+import itertools
+import math
+from array import array
+from random import Random
+
+import pytest
+
+import expression_tree
+from expression_tree import ExprTree, ExprParseError, FrozenExprTree, \
+    FrozenExprTreeError, PolynomialTooLargeError, build_from_rows, \
+    construct_from_list, from_polynomial, parse_expr, parse_many
+from expression_tree_puzzle import ANY_ORDER, CONSTRAINED_ORDER, \
+    FIXED_ORDER, ExpressionTreePuzzle
+from flat_expression_tree import FlatExprTree
+from puzzle_corpus import CorpusReader, write_corpus
+from solver import AStarSolver, BestFirstSolver, BfsSolver, DfsSolver, \
+    ParallelSolver, ReachableValueSolver
 
 def test_expression_tree_eval_doctest() -> None:
     """Test ExprTree.eval on the provided doctest"""
@@ -241,7 +255,746 @@ def test_expression_tree_puzzle_fail_fast_false() -> None:
     assert puz.fail_fast() is False
 
 
-if __name__ == '__main__':
-    import pytest
+def test_expression_tree_compile_matches_eval() -> None:
+    """Test ExprTree.compile against ExprTree.eval."""
+    exp_t = construct_from_list([['+'], [3, '*', 'a', '+'], ['a', '+'],
+                                 [5, 'c'], [2, 'd']])
+    look_up = {'a': 4, 'c': 7, 'd': 9}
+    evaluate = exp_t.compile()
+    assert evaluate(look_up) == exp_t.eval(look_up) == 63
+    assert exp_t.compile() is evaluate
+
+    assert ExprTree(None, []).compile()({}) == 0
+    assert ExprTree(5, []).compile()({}) == 5
+    assert ExprTree('b', []).compile()({'b': 8}) == 8
+
+
+def test_expression_tree_compile_invalidated_by_mutation() -> None:
+    """Test that mutating an ExprTree discards its compiled evaluator."""
+    exp_t = ExprTree('+', [ExprTree('a', []), ExprTree(3, [])])
+    assert exp_t.compile()({'a': 2}) == 5
+
+    exp_t.append(ExprTree(5, []))
+    assert exp_t.compile()({'a': 2}) == 10
+
+    exp_t.substitute({'+': '*'})
+    assert exp_t.compile()({'a': 2}) == 30
+
+    copied = exp_t.copy()
+    copied.substitute({'a': 1})
+    assert copied.compile()({}) == 15
+    assert exp_t.compile()({'a': 2}) == 30
+
+
+def test_expression_tree_eval_batch_matches_eval() -> None:
+    """Test ExprTree.eval_batch against ExprTree.eval on every row."""
+    exp_t = construct_from_list([['+'], [3, '*', 'a', '+'], ['a', '+'],
+                                 [5, 'c'], [2, 'd']])
+    columns = {'a': array('q', [1, 2, 3, 4]),
+               'c': array('q', [9, 8, 7, 6]),
+               'd': array('q', [0, 1, 0, 1])}
+    results = exp_t.eval_batch(columns)
+    assert len(results) == 4
+    for i in range(4):
+        row = {name: column[i] for name, column in columns.items()}
+        assert results[i] == exp_t.eval(row)
+
+    assert list(ExprTree(7, []).eval_batch({'a': [1, 2]})) == [7, 7]
+    assert list(ExprTree(None, []).eval_batch({})) == [0]
+
+
+def test_expression_tree_eval_batch_overflow(monkeypatch) -> None:
+    """Test that ExprTree.eval_batch is exact when int64 would overflow."""
+    exp_t = ExprTree('*', [ExprTree('x', []), ExprTree('x', []),
+                           ExprTree('+', [ExprTree('x', []),
+                                          ExprTree(9, [])])])
+    columns = {'x': [2 ** 40, 3]}
+    expected = [exp_t.eval({'x': x}) for x in columns['x']]
+    assert expected[0] > expression_tree.INT64_MAX
+    assert [int(v) for v in exp_t.eval_batch(columns)] == expected
+
+    # the same results without NumPy
+    monkeypatch.setattr(expression_tree, 'np', None)
+    assert exp_t.eval_batch(columns) == expected
+    assert exp_t.eval_batch({'x': [1, 2]}) == array('q', [10, 44])
+
+
+def test_expression_tree_hash_and_eq() -> None:
+    """Test that ExprTree.__hash__ is consistent with ExprTree.__eq__."""
+    example = [['+'], [3, '*', 'a', '+'], ['a', '+'], [5, 'c'], [2, 'd']]
+    t1 = construct_from_list([row[:] for row in example])
+    t2 = construct_from_list([row[:] for row in example])
+    assert t1 == t2 and hash(t1) == hash(t2)
+    assert t1 == t1.copy() and hash(t1) == hash(t1.copy())
+    assert t1 != ExprTree('+', [])
+    assert t1 != str(t1)
+    assert ExprTree(5, []) != ExprTree('*', [ExprTree(5, []),
+                                             ExprTree(1, [])])
+
+    trees = {t1: 'first', t2: 'second', ExprTree(5, []): 'leaf'}
+    assert len(trees) == 2
+    assert trees[t1.copy()] == 'second'
+
+
+def test_expression_tree_hash_invalidated_by_mutation() -> None:
+    """Test that mutating an ExprTree updates its hash and equality."""
+    t1 = ExprTree('+', [ExprTree('a', []), ExprTree(3, [])])
+    t2 = t1.copy()
+    old_hash = hash(t1)
+
+    t1.substitute({'a': 4})
+    assert t1 != t2
+    assert hash(t1) == hash(ExprTree('+', [ExprTree(4, []),
+                                           ExprTree(3, [])]))
+    assert hash(t2) == old_hash
+
+    t2.substitute({'a': 4})
+    assert t1 == t2
+
+    t2.append(ExprTree(1, []))
+    assert t1 != t2
+    assert t2 == ExprTree('+', [ExprTree(4, []), ExprTree(3, []),
+                                ExprTree(1, [])])
+
+
+def test_expression_tree_update_variable_matches_eval() -> None:
+    """Test ExprTree.update_variable against ExprTree.eval."""
+    rng = Random(4)
+    example = [['+'], [3, '*', 'a', '+'], ['a', '+', 'b'], [5, 'c'],
+               ['*', 'd'], ['a', 'c', 'b']]
+    exp_t = construct_from_list(example)
+    look_up = {}
+    exp_t.populate_lookup(look_up)
+    assert exp_t.eval_incremental(look_up) == exp_t.eval(look_up)
+    for _ in range(200):
+        variable = rng.choice(sorted(look_up))
+        look_up[variable] = rng.randint(0, 9)
+        assert exp_t.update_variable(variable, look_up[variable]) == \
+            exp_t.eval(look_up)
+
+
+def test_expression_tree_update_variable_after_mutation() -> None:
+    """Test ExprTree.update_variable after substitute, append and copy."""
+    exp_t = ExprTree('+', [ExprTree('a', []),
+                           ExprTree('*', [ExprTree('a', []),
+                                          ExprTree('b', [])])])
+    look_up = {'a': 2, 'b': 3}
+    assert exp_t.eval_incremental(look_up) == 8
+
+    copied = exp_t.copy()
+    assert copied.update_variable('b', 5) == 12
+    assert exp_t.update_variable('a', 1) == 4
+
+    exp_t.substitute({'b': 4})
+    assert exp_t.update_variable('a', 3) == 15
+
+    inner = exp_t._subtrees[1]
+    inner.append(ExprTree('c', []))
+    assert exp_t.update_variable('c', 2) == 27
+    assert copied.update_variable('a', 1) == 6
+
+    with pytest.raises(ValueError):
+        ExprTree('a', []).update_variable('a', 1)
+
+
+def test_expression_tree_freeze() -> None:
+    """Test that a FrozenExprTree is immutable and shares its nodes."""
+    exp_t = construct_from_list([['+'], [3, '*', 'a'], ['a', 'b']])
+    frozen = exp_t.freeze()
+    assert frozen == exp_t and hash(frozen) == hash(exp_t)
+    assert frozen.copy() is frozen and frozen.freeze() is frozen
+    assert frozen.eval({'a': 2, 'b': 5}) == exp_t.eval({'a': 2, 'b': 5})
+
+    for mutate in [lambda: frozen.substitute({'a': 1}),
+                   lambda: frozen.append(ExprTree(1, [])),
+                   lambda: frozen.eval_incremental({'a': 1, 'b': 1})]:
+        with pytest.raises(FrozenExprTreeError):
+            mutate()
+
+    changed = frozen.substituted({'b': 4})
+    assert str(changed) == '(3 + (a * 4) + a)'
+    assert str(frozen) == '(3 + (a * b) + a)'
+    assert changed._subtrees[0] is frozen._subtrees[0]
+
+    thawed = frozen.thaw()
+    thawed.substitute({'a': 1})
+    assert str(thawed) == '(3 + (1 * b) + 1)'
+    assert str(frozen) == '(3 + (a * b) + a)'
+
+
+def test_expression_tree_puzzle_extensions_share_tree() -> None:
+    """Test that ExpressionTreePuzzle.extensions does not copy the tree."""
+    exp_t = construct_from_list([['+'], [3, '*', 'a'], ['a', 'b']])
+    puz = ExpressionTreePuzzle(exp_t, 23)
+    exts_of_puz = puz.extensions()
+    assert len(exts_of_puz) == 18
+    assert all(ext._tree is exts_of_puz[0]._tree for ext in exts_of_puz)
+    assert exts_of_puz[0].extensions()[0]._tree is exts_of_puz[0]._tree
+
+    # mutating the original tree does not affect earlier extensions
+    exp_t.substitute({'b': 2})
+    assert str(exts_of_puz[0]._tree) == '(3 + (a * b) + a)'
+    assert str(puz.extensions()[0]._tree) == '(3 + (a * 2) + a)'
+
+    solution = BfsSolver().solve(ExpressionTreePuzzle(exp_t.copy(), 18))
+    assert solution[-1].is_solved()
+    assert solution[-1].variables == {'a': 5}
+
+
+def test_flat_expression_tree_matches_expr_tree() -> None:
+    """Test FlatExprTree against the ExprTree it was converted from."""
+    example = [['+'], [3, '*', 'a', '+'], ['a', '+'], [5, 'c'], [2, 'd']]
+    exp_t = construct_from_list(example)
+    flat = FlatExprTree.from_expr_tree(exp_t)
+    assert len(flat) == 11
+    assert flat.to_expr_tree() == exp_t
+    assert str(flat) == str(exp_t) == '(3 + (a * (2 + d)) + a + (5 + c))'
+
+    look_up = {}
+    flat.populate_lookup(look_up)
+    assert look_up == {'a': 0, 'd': 0, 'c': 0}
+    look_up.update({'a': 4, 'c': 7, 'd': 9})
+    assert flat.eval(look_up) == exp_t.eval(look_up)
+
+    flat.substitute({'a': 'b', '+': '*', 2: 'e'})
+    exp_t.substitute({'a': 'b', '+': '*', 2: 'e'})
+    assert str(flat) == str(exp_t) == '(3 * (b * (e * d)) * b * (5 * c))'
+    assert flat.to_expr_tree() == exp_t
+
+    empty = FlatExprTree.from_expr_tree(ExprTree(None, []))
+    assert str(empty) == '()' and empty.eval({}) == 0
+    assert empty.to_expr_tree().is_empty()
+
+
+def test_expression_tree_deep_tree() -> None:
+    """Test ExprTree methods on a tree deeper than the recursion limit."""
+    exp_t = ExprTree('a', [])
+    for i in range(5000):
+        exp_t = ExprTree(['+', '*'][i % 2], [exp_t, ExprTree(1, [])])
+    look_up = {}
+    exp_t.populate_lookup(look_up)
+    assert look_up == {'a': 0}
+    assert exp_t.eval({'a': 3}) == exp_t.compile()({'a': 3}) == 2503
+    assert str(exp_t).startswith('(' * 5000 + 'a + 1) * 1) + 1)')
+    assert exp_t.copy() == exp_t
+    assert exp_t.freeze().thaw() == exp_t
+
+    exp_t.substitute({'a': 2, '*': '+'})
+    assert exp_t.eval({}) == 5002
+    assert [node._root for node in exp_t.preorder()][4999:5002] == \
+        ['+', 2, 1]
+    assert [node._root for node in exp_t.postorder()][:3] == [2, 1, '+']
+
 
+def test_construct_from_list_streaming() -> None:
+    """Test that construct_from_list keeps its input and that
+    build_from_rows reads rows from any iterable."""
+    example = [['+'], [3, '*', 'a', '+'], ['a', '+'], [5, 'c'], [2, 'd']]
+    rows = [row.copy() for row in example]
+    exp_t = construct_from_list(rows)
+    assert rows == example
+    assert str(exp_t) == '(3 + (a * (2 + d)) + a + (5 + c))'
+    assert build_from_rows(row for row in example) == exp_t
+    assert exp_t._subtrees[1]._parent is exp_t
+    with pytest.raises(ValueError):
+        build_from_rows(example + [[1, 2]])
+
+
+def test_parse_expr_round_trip() -> None:
+    """Test that parse_expr reads back the output of ExprTree.__str__."""
+    example = [['+'], [3, '*', 'a', '+'], ['a', '+'], [5, 'c'], [2, 'd']]
+    exp_t = construct_from_list(example)
+    assert parse_expr(str(exp_t)) == exp_t
+    chain = ExprTree('a', [])
+    for i in range(5000):
+        chain = ExprTree(['+', '*'][i % 2], [chain, ExprTree(i, [])])
+    assert parse_expr(str(chain)) == chain
+
+    with pytest.raises(ExprParseError) as info:
+        parse_expr('(3 + (a * 2) * 1)')
+    assert info.value.position == 13
+    trees = parse_many(['(a + 1)\n', '\n', '(b * 2\n'])
+    assert str(next(trees)) == '(a + 1)'
+    with pytest.raises(ExprParseError) as info:
+        next(trees)
+    assert (info.value.line, info.value.position) == (3, 7)
+
+
+def test_parse_expr_rejects_operators_out_of_place() -> None:
+    """Test that parse_expr only reads OPERATORS as operators, and never
+    as values."""
+    for text, position in [('(a b c)', 3), ('(1 - 2)', 3), ('(a + +)', 5),
+                           ('(* + a)', 1), ('+', 0)]:
+        with pytest.raises(ExprParseError) as info:
+            parse_expr(text)
+        assert info.value.position == position
+
+
+def test_corpus_round_trip(tmp_path) -> None:
+    """Test writing trees and puzzles to a corpus file and reading them
+    back in any order."""
+    example = [['+'], [3, '*', 'a', '+'], ['a', '+'], [5, 'c'], [2, 'd']]
+    exp_t = construct_from_list(example)
+    puz = ExpressionTreePuzzle(exp_t, 61)
+    puz.variables['c'] = 4
+    big = ExprTree('*', [ExprTree('x', []), ExprTree(2 ** 40, [])])
+    path = str(tmp_path / 'corpus.bin')
+    assert write_corpus(path, [exp_t, puz, big, ExprTree(None, [])]) == 4
+
+    with CorpusReader(path) as corpus:
+        assert len(corpus) == 4
+        assert corpus[2] == big and corpus[0] == exp_t
+        assert str(corpus[1]) == str(puz)
+        assert corpus[-1].is_empty()
+        with pytest.raises(IndexError):
+            corpus[4]
+        assert [str(record) for record in corpus][0] == str(exp_t)
+
+
+def test_expression_tree_puzzle_interval_pruning() -> None:
+    """Test that fail_fast rejects states whose target is out of range of
+    the unassigned variables, while DfsSolver still finds a solution."""
+    exp_t = ExprTree('+', [ExprTree('*', [ExprTree('a', []),
+                                          ExprTree('b', []),
+                                          ExprTree('c', [])]),
+                           ExprTree('*', [ExprTree('d', []),
+                                          ExprTree('e', [])])])
+    puz = ExpressionTreePuzzle(exp_t, 731)
+    assert puz.variable_domains() == {'a': (9, 9), 'b': (9, 9), 'c': (9, 9),
+                                      'd': (1, 2), 'e': (1, 2)}
+    puz.variables['a'] = 8
+    assert puz.fail_fast()
+    puz.variables['a'] = 9
+    assert not puz.fail_fast()
+
+    seen = set()
+    solution = DfsSolver().solve(ExpressionTreePuzzle(exp_t, 731), seen)
+    assert solution[-1].is_solved()
+    assert len(seen) < 100
+
+
+def test_expression_tree_puzzle_fail_fast_caches() -> None:
+    """Test that the facts fail_fast keeps between calls follow changes to
+    the variables and to the tree."""
+    exp_t = ExprTree('*', [ExprTree('a', []), ExprTree('b', [])])
+    puz = ExpressionTreePuzzle(exp_t, 12)
+    assert not puz.fail_fast()
+    extension = puz.extensions()[0]
+    assert extension.variables == {'a': 1, 'b': 0}
+    assert extension.fail_fast()
+    extension.variables['a'] = 0
+    assert not extension.fail_fast()
+    extension.variables['a'] = 3
+    assert not extension.fail_fast()
+    assert extension.variable_domains() == {'a': (3, 3), 'b': (4, 4)}
+
+    extension.target = 13
+    assert extension.fail_fast()
+    exp_t.substitute({'*': '+'})
+    assert not puz.fail_fast()
+    puz.target = 19
+    assert puz.fail_fast()
+    exp_t.substitute({'b': '-'})
+    puz.variables = {'a': 0}
+    assert puz.fail_fast()
+
+
+def test_expression_tree_puzzle_state_key() -> None:
+    """Test that state keys tell apart the states met while solving, and
+    that the solvers keep them in seen."""
+    exp_t = ExprTree('+', [ExprTree('a', []), ExprTree('b', [])])
+    puz = ExpressionTreePuzzle(exp_t, 8)
+    states = [puz] + puz.extensions()
+    states += [ext2 for ext in puz.extensions() for ext2 in ext.extensions()]
+    keys = {state.state_key() for state in states}
+    assert len(keys) == len({str(state) for state in states}) == 100
+
+    seen = set()
+    assert BfsSolver().solve(puz, seen)[-1].is_solved()
+    assert puz.state_key() in seen
+    assert all(isinstance(key, int) for key in seen)
+
+
+def test_bfs_solver_path_is_consecutive() -> None:
+    """Test that the path BfsSolver rebuilds from its frontier starts at the
+    puzzle and steps from each state to one of its extensions."""
+    exp_t = ExprTree('*', [ExprTree('+', [ExprTree('a', []),
+                                          ExprTree('b', [])]),
+                           ExprTree('c', [])])
+    puz = ExpressionTreePuzzle(exp_t, 24)
+    path = BfsSolver().solve(puz)
+    assert path[0] is puz
+    assert len(path) == 4
+    for state, next_state in zip(path, path[1:]):
+        assert str(next_state) in {str(ext) for ext in state.extensions()}
+    assert path[-1].is_solved()
+
+
+def test_dfs_solver_first_solution_and_limits() -> None:
+    """Test that DfsSolver stops at its first solution with a single path,
+    and gives up when its depth or node limit is reached."""
+    exp_t = ExprTree('*', [ExprTree('+', [ExprTree('a', []),
+                                          ExprTree('b', [])]),
+                           ExprTree('c', [])])
+    puz = ExpressionTreePuzzle(exp_t, 24)
+    seen = set()
+    path = DfsSolver().solve(puz, seen)
+    assert path[0] is puz
+    assert len(path) == 4
+    for state, next_state in zip(path, path[1:]):
+        assert str(next_state) in {str(ext) for ext in state.extensions()}
+    assert path[-1].is_solved()
+    assert len(seen) < 20
+
+    limited = DfsSolver(max_depth=3).solve(puz)
+    assert [str(state) for state in limited] == [str(state) for state in path]
+    assert DfsSolver(max_depth=2).solve(puz) == []
+    assert DfsSolver(max_nodes=1).solve(puz) == []
+
+
+def test_expression_tree_puzzle_extension_orders() -> None:
+    """Test that the fixed and most-constrained orders of extensions reach
+    each assignment along one path, and that the solvers still solve with
+    them."""
+    exp_t = ExprTree('+', [ExprTree('a', []),
+                           ExprTree('*', [ExprTree('b', []),
+                                          ExprTree('c', [])])])
+    for order in [FIXED_ORDER, CONSTRAINED_ORDER]:
+        puz = ExpressionTreePuzzle(exp_t, 50, order)
+        states = [puz]
+        for state in states:
+            states.extend(state.extensions())
+        keys = [state.state_key() for state in states]
+        assert len(keys) == len(set(keys))
+        assert all(state.order == order for state in states)
+        for solver in [DfsSolver(), BfsSolver()]:
+            path = solver.solve(ExpressionTreePuzzle(exp_t, 50, order))
+            assert len(path) == 4 and path[-1].is_solved()
+    assert len(ExpressionTreePuzzle(exp_t, 50).extensions()) == 27
+    with pytest.raises(ValueError):
+        ExpressionTreePuzzle(exp_t, 50, 'random')
+
+
+def test_best_first_solvers() -> None:
+    """Test that the best-first and A* solvers find a solution guided by
+    the default heuristic of ExpressionTreePuzzle or by one passed in, and
+    extend fewer states than BfsSolver."""
+    exp_t = ExprTree('+', [ExprTree('a', []),
+                           ExprTree('*', [ExprTree('b', []),
+                                          ExprTree('c', [])])])
+    n_extended = []
+    for solver in [BfsSolver(), BestFirstSolver(lambda puzzle: 0),
+                   AStarSolver(), BestFirstSolver()]:
+        seen = set()
+        path = solver.solve(ExpressionTreePuzzle(exp_t, 50), seen)
+        assert len(path) == 4 and path[-1].is_solved()
+        for state, next_state in zip(path, path[1:]):
+            assert str(next_state) in {str(ext) for ext in state.extensions()}
+        n_extended.append(len(seen))
+    assert n_extended == sorted(n_extended, reverse=True)
+    assert n_extended[-1] == 3
+    assert BestFirstSolver().solve(ExpressionTreePuzzle(exp_t, 300)) == []
+    # the default heuristic never overestimates the moves left, one for
+    # each unassigned variable, and is 0 only at a solution
+    states = [ExpressionTreePuzzle(exp_t, 50)]
+    while states:
+        state = states.pop()
+        moves_left = sum(1 for value in state.variables.values() if not value)
+        estimate = state.heuristic()
+        assert estimate == math.inf or estimate <= moves_left
+        assert (estimate == 0) == state.is_solved()
+        states.extend(state.extensions())
+
+
+def test_parallel_solver() -> None:
+    """Test that ParallelSolver puts together a path through the states it
+    split the puzzle into and the states a worker process sent back."""
+    exp_t = ExprTree('+', [ExprTree('a', []),
+                           ExprTree('*', [ExprTree('b', []),
+                                          ExprTree('c', [])])])
+    for split_depth in [0, 1, 2]:
+        puz = ExpressionTreePuzzle(exp_t, 50, FIXED_ORDER)
+        seen = set()
+        path = ParallelSolver(workers=2, split_depth=split_depth).solve(puz,
+                                                                        seen)
+        assert path[0] is puz
+        assert len(path) == 4 and path[-1].is_solved()
+        for state, next_state in zip(path, path[1:]):
+            assert str(next_state) in {str(ext) for ext in state.extensions()}
+            assert next_state.order == FIXED_ORDER
+        assert puz.state_key() in seen
+    # a * b * c can not make 11, but that is only found by trying values
+    exp_t = ExprTree('*', [ExprTree('a', []), ExprTree('b', []),
+                           ExprTree('c', [])])
+    assert ParallelSolver(workers=2).solve(ExpressionTreePuzzle(exp_t, 11)) \
+        == []
+
+
+def test_parallel_solver_seen() -> None:
+    """Test that the workers of ParallelSolver do not go through the states
+    in the seen set passed to solve, so that the default iter_solutions
+    yields each solution once."""
+    exp_t = ExprTree('+', [ExprTree('a', []), ExprTree('b', [])])
+    puz = ExpressionTreePuzzle(exp_t, 4, FIXED_ORDER)
+    path = ParallelSolver(workers=1).solve(puz)
+    solved = path[-1]
+    seen = {solved.state_key()}
+    path = ParallelSolver(workers=1).solve(puz, seen)
+    assert path[-1].is_solved()
+    assert path[-1].state_key() != solved.state_key()
+    assert solved.state_key() in seen
+    paths = list(itertools.islice(
+        ParallelSolver(workers=2).iter_solutions(puz), 4))
+    assert sorted(tuple(path[-1].variables.values()) for path in paths) \
+        == [(1, 3), (2, 2), (3, 1)]
+
+
+def test_reachable_value_solver() -> None:
+    """Test that ReachableValueSolver finds a path of extensions to a
+    solution whether or not subtrees share variables, and in any order."""
+    distinct = ExprTree('*', [ExprTree('+', [ExprTree('a', []),
+                                             ExprTree('b', [])]),
+                              ExprTree('c', [])])
+    shared = ExprTree('+', [ExprTree('*', [ExprTree('a', []),
+                                           ExprTree('b', [])]),
+                            ExprTree('*', [ExprTree('a', []),
+                                           ExprTree(7, [])])])
+    for exp_t, target in [(distinct, 40), (shared, 45)]:
+        for order in [ANY_ORDER, FIXED_ORDER, CONSTRAINED_ORDER]:
+            puz = ExpressionTreePuzzle(exp_t, target, order)
+            seen = set()
+            path = ReachableValueSolver().solve(puz, seen)
+            assert path[0] is puz and path[-1].is_solved()
+            assert len(path) == len(puz.variables) + 1
+            for state, next_state in zip(path, path[1:]):
+                assert str(next_state) in {str(ext)
+                                           for ext in state.extensions()}
+            assert {state.state_key() for state in path} <= seen
+    assert ReachableValueSolver().solve(ExpressionTreePuzzle(shared, 46)) \
+        == []
+    # a state of the path in seen leaves the search to DfsSolver
+    puz = ExpressionTreePuzzle(distinct, 40)
+    assert ReachableValueSolver().solve(puz, {puz.state_key()}) == []
+
+
+def test_find_assignment_multi_character_variables() -> None:
+    """Test that find_assignment treats a variable named by several
+    characters as one variable."""
+    exp_t = parse_expr('((ab * 2) + (ab * cd))')
+    domains = {'ab': (1, 9), 'cd': (1, 9)}
+    assignment = exp_t.find_assignment(domains, 18)
+    assert assignment is not None and exp_t.eval(assignment) == 18
+    assert exp_t.find_assignment({'ab': (1, 9), 'cd': (9, 9)}, 18) is None
+
+
+def test_iter_solutions() -> None:
+    """Test that the solvers yield each solution once, as a valid path, and
+    can be stopped early."""
+    exp_t = ExprTree('+', [ExprTree('a', []), ExprTree('b', [])])
+    for solver in [DfsSolver(), BfsSolver(), BestFirstSolver()]:
+        puz = ExpressionTreePuzzle(exp_t, 4)
+        paths = list(solver.iter_solutions(puz))
+        assert sorted(tuple(path[-1].variables.values()) for path in paths) \
+            == [(1, 3), (2, 2), (3, 1)]
+        for path in paths:
+            assert path[0] is puz and path[-1].is_solved()
+            for state, next_state in zip(path, path[1:]):
+                assert str(next_state) in {str(ext)
+                                           for ext in state.extensions()}
+        # a check for a unique solution only needs the first two
+        assert len(list(itertools.islice(solver.iter_solutions(puz), 2))) \
+            == 2
+    assert list(DfsSolver().iter_solutions(ExpressionTreePuzzle(exp_t, 19))) \
+        == []
+
+
+def test_count_solutions() -> None:
+    """Test that count_solutions counts the same solutions as listing every
+    assignment does, whether or not subtrees share variables."""
+    shared = ExprTree('+', [ExprTree('*', [ExprTree('a', []),
+                                           ExprTree('b', [])]),
+                            ExprTree('*', [ExprTree('a', []),
+                                           ExprTree('+', [ExprTree('c', []),
+                                                          ExprTree(2, [])])]),
+                            ExprTree('c', [])])
+    for target in [20, 45, 46, 200]:
+        puz = ExpressionTreePuzzle(shared, target)
+        expected = sum(1 for a, b, c in itertools.product(range(1, 10),
+                                                          repeat=3)
+                       if a * b + a * (c + 2) + c == target)
+        assert puz.count_solutions() == expected
+        assert puz.count_solutions() == \
+            len(list(DfsSolver().iter_solutions(
+                ExpressionTreePuzzle(shared, target, FIXED_ORDER))))
+    puz = ExpressionTreePuzzle(shared, 45)
+    puz.variables['a'] = 3
+    assert puz.count_solutions() == sum(
+        1 for b, c in itertools.product(range(1, 10), repeat=2)
+        if 3 * b + 3 * (c + 2) + c == 45)
+    puz.variables['a'] = 0
+    puz.target = 2
+    assert puz.count_solutions() == 0
+    # a variable named by several characters is still one variable
+    exp_t = parse_expr('((ab * 2) + (ab * cd))')
+    assert ExpressionTreePuzzle(exp_t, 18).count_solutions() == \
+        exp_t.count_assignments({'ab': (1, 9), 'cd': (1, 9)}, 18) == \
+        sum(1 for ab, cd in itertools.product(range(1, 10), repeat=2)
+            if ab * 2 + ab * cd == 18)
+
+
+def test_expression_tree_leaf_index() -> None:
+    """Test that the leaves cached for populate_lookup and substitute stay
+    up to date as the tree is substituted into, appended to and copied."""
+    exp_t = ExprTree('+', [ExprTree('a', []),
+                           ExprTree('*', [ExprTree('b', []),
+                                          ExprTree('a', []),
+                                          ExprTree(3, [])])])
+    look_up = {}
+    exp_t.populate_lookup(look_up)
+    assert look_up == {'a': 0, 'b': 0}
+    exp_t.substitute({'a': 'c', 3: 'a'})
+    exp_t.append(ExprTree('*', [ExprTree('d', []), ExprTree('c', [])]))
+    copied = exp_t.copy()
+    copied.substitute({'c': 2})
+    for tree, expected in [(exp_t, '(c + (b * c * a) + (d * c))'),
+                           (copied, '(2 + (b * 2 * a) + (d * 2))')]:
+        assert str(tree) == expected
+        look_up = {}
+        tree.populate_lookup(look_up)
+        assert list(look_up) == [name for name in 'cbad' if name in expected]
+    assert exp_t.eval_incremental({'a': 1, 'b': 2, 'c': 3, 'd': 4}) == 21
+    assert exp_t.update_variable('c', 1) == 7
+    exp_t.substitute({'*': '+'})
+    assert str(exp_t) == '(c + (b + c + a) + (d + c))'
+    assert exp_t.update_variable('c', 2) == 13
+
+
+def test_expression_tree_simplify() -> None:
+    """Test that simplify folds constants and flattens operators into a
+    smaller tree with the same value, leaving the tree itself unchanged."""
+    exp_t = construct_from_list([['+'], [3, '*', 'a', '+'], ['+', 'b', 1],
+                                 [5, 'c'], [4, 6]])
+    text = str(exp_t)
+    simplified = exp_t.simplify()
+    assert str(simplified) == '(a + c + (b * 10) + 8)'
+    assert str(exp_t) == text
+    for a, b, c in itertools.product([1, 4, 9], repeat=3):
+        look_up = {'a': a, 'b': b, 'c': c}
+        assert simplified.eval(look_up) == exp_t.eval(look_up) \
+            == exp_t.compile()(look_up)
+    # the grouping and order of operands does not matter
+    regrouped = construct_from_list([['+'], ['+', 3, 'a'], ['*', 'c', 5],
+                                     ['+', 'b', 1], [4, 6]])
+    assert regrouped.simplify() == simplified
+    assert ExprTree('*', [ExprTree(3, []), ExprTree(3, [])]).simplify() \
+        == ExprTree(9, [])
+    assert ExprTree(None, []).simplify().is_empty()
+
+
+def test_frozen_expression_tree_shares_subtrees() -> None:
+    """Test that freeze makes identical subtrees one node, and that eval,
+    compile and eval_batch on the frozen tree agree with the tree."""
+    exp_t = ExprTree('*', [ExprTree('a', []),
+                           ExprTree('+', [ExprTree('b', []),
+                                          ExprTree(6, [])])])
+    for level in range(10):
+        exp_t = ExprTree('+' if level % 2 else '*',
+                         [exp_t, exp_t.copy(), ExprTree('c', [])])
+    frozen = exp_t.freeze()
+    nodes = {}
+    to_visit = [frozen]
+    while to_visit:
+        node = to_visit.pop()
+        if id(node) not in nodes:
+            nodes[id(node)] = node
+            to_visit.extend(node._subtrees)
+    # one node for each of a, b, c, 6, (b + 6), (a * (b + 6)) and the levels
+    assert len(nodes) == 16
+    assert frozen == exp_t and str(frozen) == str(exp_t)
+    for look_up in [{'a': 1, 'b': 1, 'c': 1}, {'a': 2, 'b': 3, 'c': 4}]:
+        assert frozen.eval(look_up) == exp_t.eval(look_up) \
+            == frozen.compile()(look_up) == exp_t.compile()(look_up)
+    columns = {'a': [1, 2], 'b': [1, 3], 'c': [1, 4]}
+    assert [int(v) for v in frozen.eval_batch(columns)] == \
+        [int(v) for v in exp_t.eval_batch(columns)]
+    thawed = frozen.thaw()
+    assert thawed == exp_t
+    assert len({id(node) for node in thawed.preorder()}) == \
+        len(list(exp_t.preorder()))
+
+
+def test_frozen_expression_tree_walks_distinct_nodes() -> None:
+    """Test that the methods of a FrozenExprTree that walk it visit each
+    distinct node once, on a tree far too large to expand, and that
+    narrow_domains bounds a shared subtree as the thawed tree does."""
+    frozen = ExprTree('+', [ExprTree('a', []), ExprTree(2, [])]).freeze()
+    for level in range(60):
+        frozen = FrozenExprTree('*+'[level % 2], [frozen, frozen])
+    assert len(list(frozen.preorder())) == len(list(frozen.postorder())) \
+        == 63
+    look_up = {}
+    frozen.populate_lookup(look_up)
+    assert look_up == {'a': 0}
+    assert [len(leaves) for leaves in frozen._leaf_index().values()] == [1, 1]
+    shared = parse_expr('(a + b)').freeze()
+    small = FrozenExprTree('+', [FrozenExprTree('*', [shared,
+                                                      FrozenExprTree(3, [])]),
+                                 shared, FrozenExprTree('c', [])])
+    assert str(small) == str(small.thaw()) == '(((a + b) * 3) + (a + b) + c)'
+    domains = {'a': (1, 9), 'b': (1, 9), 'c': (1, 9)}
+    assert small.narrow_domains(domains, 70) == \
+        {'a': (6, 9), 'b': (6, 9), 'c': (1, 9)}
+    for target in [9, 70, 74, 5]:
+        assert small.narrow_domains(domains, target) == \
+            small.thaw().narrow_domains(domains, target)
+
+
+def test_frozen_subtree_in_mutable_tree() -> None:
+    """Test that a frozen tree given to a mutable ExprTree is thawed, so
+    mutating the ExprTree leaves the frozen tree as it was."""
+    frozen = parse_expr('(b + 4)').freeze()
+    exp_t = ExprTree('*', [frozen, ExprTree(2, [])])
+    exp_t.substitute({'+': '*'})
+    assert str(frozen) == '(b + 4)'
+    assert str(exp_t) == '((b * 4) * 2)'
+    exp_t.substitute({'b': 5})
+    assert str(frozen) == '(b + 4)'
+    assert exp_t.eval({}) == 40
+    exp_t.append(frozen)
+    exp_t.substitute({'b': 3})
+    assert str(exp_t) == '((5 * 4) * 2 * (3 + 4))'
+    assert str(frozen) == '(b + 4)'
+    assert not any(isinstance(node, FrozenExprTree)
+                   for node in exp_t.preorder())
+
+
+def test_expression_tree_to_polynomial() -> None:
+    """Test that to_polynomial decides equivalence, that from_polynomial
+    gives back trees with the same values, and that expansions larger than
+    the tree are refused."""
+    exp_t = parse_expr('((a + 2) * (a + b) * 3)')
+    polynomial = exp_t.to_polynomial()
+    assert polynomial == {(('a', 1),): 6, (('a', 1), ('b', 1)): 3,
+                          (('a', 2),): 3, (('b', 1),): 6}
+    assert exp_t.is_equivalent(parse_expr('((((a * a) + (a * b)) * 3) + '
+                                          '((a + b) * 6))'))
+    assert not exp_t.is_equivalent(parse_expr('((a + 2) * (a + b))'))
+    assert str(from_polynomial(polynomial)) == \
+        '((a * 6) + (a * b * 3) + (a * a * 3) + (b * 6))'
+    rng = Random(30)
+    for horner in [False, True]:
+        tree = from_polynomial(polynomial, horner)
+        assert tree.to_polynomial() == polynomial
+        for _ in range(5):
+            look_up = {'a': rng.randint(1, 9), 'b': rng.randint(1, 9)}
+            assert tree.eval(look_up) == exp_t.eval(look_up)
+    assert from_polynomial({}).eval({}) == 0
+    # (a + b) * (c + d) * (e + f) * (g + h) has 16 terms but 15 nodes
+    product = parse_expr('((a + b) * (c + d) * (e + f) * (g + h))')
+    with pytest.raises(PolynomialTooLargeError):
+        product.to_polynomial()
+    assert len(product.to_polynomial(16)) == 16
+
+
+if __name__ == '__main__':
     pytest.main(['a2_starter_tests.py'])
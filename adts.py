@@ -1,3 +1,4 @@
+from collections import deque
 from typing import List, Optional, Any
 
 
@@ -71,12 +72,13 @@ class Queue:
     queue, the most recently-added item is the one that is removed.
     """
     # === Private attributes ===
-    # _items: a list of the items in this queue
-    _items: List
+    # _items: a deque of the items in this queue, with the front of the
+    #     queue at its left, so that both ends take O(1) time
+    _items: deque
 
     def __init__(self) -> None:
         """Initialize a new empty queue."""
-        self._items = []
+        self._items = deque()
 
     def is_empty(self) -> bool:
         """Return whether this queue contains no items.
@@ -88,7 +90,7 @@ class Queue:
         >>> q.is_empty()
         False
         """
-        return self._items == []
+        return not self._items
 
     def enqueue(self, item: Any) -> None:
         """Add <item> to the back of this queue.
@@ -110,4 +112,4 @@ class Queue:
         if self.is_empty():
             return None
         else:
-            return self._items.pop(0)
+            return self._items.popleft()
@@ -0,0 +1,926 @@
+"""
+Benchmarks for the expression tree code.
+
+Run this module to print timings for every benchmark, or pass the names of
+the benchmarks to run, e.g.
+
+    python benchmarks.py compile
+"""
+from __future__ import annotations
+
+import gc
+import os
+import pickle
+import sys
+import tempfile
+import tracemalloc
+from array import array
+from random import Random
+from time import perf_counter
+from collections import deque
+from itertools import islice
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+from unittest import mock
+
+from expression_tree import ExprTree, FrozenExprTree, OPERATORS, \
+    _generate_evaluator, _rebuild, _share, build_from_rows, from_polynomial, \
+    parse_expr, parse_many
+from expression_tree_puzzle import ANY_ORDER, CONSTRAINED_ORDER, \
+    FIXED_ORDER, ExpressionTreePuzzle
+from flat_expression_tree import FlatExprTree
+from puzzle_corpus import CorpusReader, write_corpus
+from solver import AStarSolver, BestFirstSolver, BfsSolver, DfsSolver, \
+    ParallelSolver, ReachableValueSolver, Solver
+
+VARIABLE_NAMES = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def random_tree(n_nodes: int, n_variables: int, rng: Random,
+                variable_ratio: float = 0.5) \
+        -> Tuple[ExprTree, Dict[str, int]]:
+    """
+    Return a random expression tree with roughly <n_nodes> nodes over the
+    first <n_variables> variable names, and a lookup assigning each of its
+    variables a value in the range 1-9. Each leaf is a variable with
+    probability <variable_ratio>, and a constant otherwise.
+
+    Like generate_random_expression_tree in play_expression_tree_puzzle.py,
+    the tree is formed by repeatedly joining 2 or 3 subtrees under a random
+    operator, which keeps its depth logarithmic in its size.
+    """
+    # an operator node joins 2.5 subtrees on average, so about 60% of the
+    # nodes are leaves
+    n_leaves = max(1, (n_nodes * 3) // 5)
+    variables = VARIABLE_NAMES[:n_variables]
+    subtrees = []
+    for _ in range(n_leaves):
+        if variables and rng.random() < variable_ratio:
+            subtrees.append(ExprTree(rng.choice(variables), []))
+        else:
+            subtrees.append(ExprTree(rng.randint(1, 9), []))
+    while len(subtrees) > 1:
+        num_children = rng.randint(2, min(3, len(subtrees)))
+        node = ExprTree(rng.choice(OPERATORS), subtrees[-num_children:])
+        del subtrees[-num_children:]
+        # move the new node to a random position, in O(1) time
+        subtrees.append(node)
+        i = rng.randint(0, len(subtrees) - 1)
+        subtrees[i], subtrees[-1] = subtrees[-1], subtrees[i]
+
+    lookup = {}
+    subtrees[0].populate_lookup(lookup)
+    for variable in lookup:
+        lookup[variable] = rng.randint(1, 9)
+    return subtrees[0], lookup
+
+
+def count_nodes(tree: ExprTree) -> int:
+    """
+    Return the number of nodes in <tree>.
+    """
+    total = 0
+    to_visit = [tree]
+    while to_visit:
+        node = to_visit.pop()
+        total += 1
+        to_visit.extend(node._subtrees)
+    return total
+
+
+def level_order_rows(tree: ExprTree) -> Iterator[List[Union[str, int]]]:
+    """
+    Yield the rows of the construct_from_list encoding of <tree>.
+    """
+    yield [tree._root]
+    waiting = deque([tree])
+    while waiting:
+        node = waiting.popleft()
+        if node._subtrees:
+            yield [child._root for child in node._subtrees]
+            waiting.extend(node._subtrees)
+
+
+def best_time(func: Callable[[], object], repeat: int = 5,
+              number: int = 1) -> float:
+    """
+    Return the best time, in seconds, of <repeat> rounds of calling <func>
+    <number> times, divided by <number>.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (perf_counter() - start) / number)
+    return best
+
+
+def peak_memory(func: Callable[[], object]) -> int:
+    """
+    Return the peak number of bytes allocated while calling <func>, not
+    counting memory that was allocated before the call.
+    """
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def retained_memory(func: Callable[[], object]) -> int:
+    """
+    Return the number of bytes allocated by calling <func> that are still
+    allocated while its result is kept.
+    """
+    tracemalloc.start()
+    result = func()
+    # a full collection also empties the free lists of freed objects
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return retained
+
+
+def bench_compile() -> None:
+    """
+    Compare ExprTree.eval with the evaluator returned by ExprTree.compile.
+    """
+    rng = Random(1)
+    print(f'{"nodes":>8} {"eval":>12} {"compiled":>12} {"speedup":>8} '
+          f'{"compile":>12}')
+    for n_nodes, number in [(10, 20000), (1000, 200), (100000, 2)]:
+        tree, lookup = random_tree(n_nodes, 6, rng)
+        start = perf_counter()
+        evaluate = tree.compile()
+        compile_time = perf_counter() - start
+        assert evaluate(lookup) == tree.eval(lookup)
+        eval_time = best_time(lambda: tree.eval(lookup), number=number)
+        compiled_time = best_time(lambda: evaluate(lookup), number=number)
+        print(f'{count_nodes(tree):>8} {eval_time * 1e6:>10.2f}us '
+              f'{compiled_time * 1e6:>10.2f}us '
+              f'{eval_time / compiled_time:>7.1f}x '
+              f'{compile_time * 1e3:>10.2f}ms')
+
+
+def bench_eval_batch() -> None:
+    """
+    Compare evaluating a tree row by row with ExprTree.eval_batch.
+    """
+    rng = Random(2)
+    print(f'{"nodes":>6} {"rows":>8} {"eval":>12} {"compiled":>12} '
+          f'{"eval_batch":>12} dtype')
+    for n_nodes, n_rows in [(100, 1000), (100, 100000), (200, 100000)]:
+        tree, variables = random_tree(n_nodes, 6, rng)
+        columns = {name: array('q', [rng.randint(1, 9)
+                                     for _ in range(n_rows)])
+                   for name in variables}
+        rows = [{name: columns[name][i] for name in columns}
+                for i in range(n_rows)]
+        evaluate = tree.compile()
+        eval_time = best_time(lambda: [tree.eval(row) for row in rows],
+                              repeat=1)
+        compiled_time = best_time(lambda: [evaluate(row) for row in rows],
+                                  repeat=3)
+        batch_time = best_time(lambda: tree.eval_batch(columns), repeat=3)
+        # large products fall back to exact object arrays, like eval
+        dtype = getattr(tree.eval_batch(columns), 'dtype', 'python')
+        print(f'{count_nodes(tree):>6} {n_rows:>8} '
+              f'{eval_time * 1e3:>10.1f}ms {compiled_time * 1e3:>10.1f}ms '
+              f'{batch_time * 1e3:>10.1f}ms {dtype}')
+
+
+def bench_eq() -> None:
+    """
+    Compare ExprTree equality with comparing the trees' string forms.
+    """
+    rng = Random(3)
+    tree, _ = random_tree(10000, 6, rng)
+    same = tree.copy()
+    same._hash = None
+    other, _ = random_tree(10000, 6, rng)
+    print(f'{"case":>12} {"str ==":>12} {"ExprTree ==":>12}')
+    for case, t2 in [('equal', same), ('different', other)]:
+        str_time = best_time(lambda: str(tree) == str(t2), number=10)
+        eq_time = best_time(lambda: tree == t2, number=10)
+        print(f'{case:>12} {str_time * 1e3:>10.3f}ms {eq_time * 1e3:>10.3f}ms')
+
+    trees = [random_tree(50, 3, rng)[0] for _ in range(2000)]
+    trees += [t.copy() for t in trees]
+    dedup_time = best_time(lambda: len(set(trees)), repeat=1)
+    print(f'deduplicated {len(trees)} trees to {len(set(trees))} '
+          f'in {dedup_time * 1e3:.2f}ms')
+
+
+def bench_incremental() -> None:
+    """
+    Compare re-evaluating a tree after changing one variable with
+    ExprTree.eval and with ExprTree.update_variable.
+    """
+    rng = Random(5)
+    print(f'{"nodes":>8} {"eval":>12} {"compiled":>12} {"update":>12}')
+    for n_nodes in [100, 10000, 100000]:
+        # about 3 occurrences of each of the 20 variables
+        tree, lookup = random_tree(n_nodes, 20, rng, 100 / n_nodes)
+        tree.eval_incremental(lookup)
+        evaluate = tree.compile()
+        names = sorted(lookup)
+
+        def change_and_eval() -> None:
+            lookup[rng.choice(names)] = rng.randint(1, 9)
+            tree.eval(lookup)
+
+        def change_and_compiled() -> None:
+            lookup[rng.choice(names)] = rng.randint(1, 9)
+            evaluate(lookup)
+
+        def change_and_update() -> None:
+            tree.update_variable(rng.choice(names), rng.randint(1, 9))
+
+        number = max(1, 100000 // n_nodes)
+        eval_time = best_time(change_and_eval, number=number)
+        compiled_time = best_time(change_and_compiled, number=number)
+        update_time = best_time(change_and_update, number=number)
+        print(f'{count_nodes(tree):>8} {eval_time * 1e6:>10.1f}us '
+              f'{compiled_time * 1e6:>10.1f}us {update_time * 1e6:>10.1f}us')
+
+
+def bench_extensions() -> None:
+    """
+    Measure the time and memory used by ExpressionTreePuzzle.extensions,
+    compared with copying the tree once per extension.
+    """
+    rng = Random(6)
+    print(f'{"nodes":>6} {"copying":>10} {"extensions":>12} '
+          f'{"copy memory":>12} {"ext memory":>12}')
+    for n_nodes in [100, 1000, 10000]:
+        tree, _ = random_tree(n_nodes, 5, rng)
+        puzzle = ExpressionTreePuzzle(tree, 0)
+        n_extensions = len(puzzle.extensions())
+        copy_time = best_time(
+            lambda: [tree.copy() for _ in range(n_extensions)], repeat=3)
+        extensions_time = best_time(puzzle.extensions, repeat=3)
+        copy_memory = peak_memory(
+            lambda: [tree.copy() for _ in range(n_extensions)])
+        extensions_memory = peak_memory(puzzle.extensions)
+        print(f'{count_nodes(tree):>6} {copy_time * 1e3:>8.2f}ms '
+              f'{extensions_time * 1e3:>10.2f}ms '
+              f'{copy_memory / n_extensions:>10.0f}B '
+              f'{extensions_memory / n_extensions:>10.0f}B')
+
+
+def bench_simplify() -> None:
+    """
+    Measure how much ExprTree.simplify shrinks a corpus of random trees, of
+    the sizes the GUI makes and larger, and how much faster eval and the
+    evaluator built from the postfix program run on the simplified trees.
+    """
+    rng = Random(27)
+    print(f'{"nodes":>8} {"simplified":>10} {"eval":>10} {"simplified":>10} '
+          f'{"compiled":>10} {"simplified":>10}')
+    for n_nodes, n_trees in [(10, 2000), (100, 200), (1000, 20)]:
+        corpus = [random_tree(n_nodes, 3, rng) for _ in range(n_trees)]
+        simplified = [tree.simplify() for tree, _ in corpus]
+        before = sum(count_nodes(tree) for tree, _ in corpus)
+        after = sum(count_nodes(tree) for tree in simplified)
+        pairs = list(zip([tree for tree, _ in corpus], simplified,
+                         [lookup for _, lookup in corpus]))
+        evaluators = [(_generate_evaluator(*tree._postfix_program()),
+                       _generate_evaluator(*short._postfix_program()), lookup)
+                      for tree, short, lookup in pairs]
+        times = [best_time(lambda: [tree.eval(lookup)
+                                    for tree, _, lookup in pairs]),
+                 best_time(lambda: [short.eval(lookup)
+                                    for _, short, lookup in pairs]),
+                 best_time(lambda: [evaluate(lookup)
+                                    for evaluate, _, lookup in evaluators]),
+                 best_time(lambda: [evaluate(lookup)
+                                    for _, evaluate, lookup in evaluators])]
+        print(f'{before / n_trees:>8.1f} {after / n_trees:>10.1f} ' +
+              ' '.join(f'{t / n_trees * 1e6:>8.2f}us' for t in times))
+
+
+def repeated_tree(levels: int) -> ExprTree:
+    """
+    Return a tree made of <levels> levels, each of which joins two copies of
+    the level below and a variable under an operator, starting from
+    (a * (b + 6)). The operators alternate, so simplify can not merge the
+    levels, and the tree has about 2 ** <levels> times as many nodes as
+    distinct subtrees.
+    """
+    tree = ExprTree('*', [ExprTree('a', []),
+                          ExprTree('+', [ExprTree('b', []), ExprTree(6, [])])])
+    for level in range(levels):
+        operator = OPERATORS[level % 2]
+        tree = ExprTree(operator, [tree, tree.copy(), ExprTree('c', [])])
+    return tree
+
+
+def bench_dag() -> None:
+    """
+    Compare the memory and evaluation time of trees with many repeated
+    subtrees and of their frozen copies, in which identical subtrees are
+    one shared node. The compiled evaluators are built from the postfix
+    program of the whole tree, and from the shared program.
+    """
+    lookup = {'a': 2, 'b': 3, 'c': 4}
+    print(f'{"nodes":>8} {"distinct":>8} {"tree":>10} {"frozen":>10} '
+          f'{"eval":>9} {"frozen":>9} {"compiled":>9} {"shared":>9}')
+    for levels in [8, 11, 14]:
+        tree = repeated_tree(levels)
+        frozen = tree.freeze()
+        unshared = _generate_evaluator(*tree._postfix_program())
+        shared = tree.compile()
+        times = [best_time(lambda: tree.eval(lookup), repeat=3),
+                 best_time(lambda: frozen.eval(lookup), repeat=3),
+                 best_time(lambda: unshared(lookup), repeat=3),
+                 best_time(lambda: shared(lookup), repeat=3)]
+        print(f'{count_nodes(tree):>8} {len(frozen._distinct_nodes()):>8} '
+              f'{retained_memory(tree.copy):>9}B '
+              f'{retained_memory(lambda: _share(tree)):>9}B ' +
+              ' '.join(f'{t * 1e3:>7.3f}ms' for t in times))
+    # freezing a tree with few repeated subtrees pays for the hash-consing
+    rng = Random(28)
+    tree, _ = random_tree(100000, 10, rng)
+    unshared_time = best_time(lambda: _rebuild(tree, FrozenExprTree), 3)
+    shared_time = best_time(lambda: _share(tree), 3)
+    print(f'freezing {count_nodes(tree)} random nodes: '
+          f'{unshared_time * 1e3:.1f}ms unshared, '
+          f'{shared_time * 1e3:.1f}ms shared, '
+          f'{len(_share(tree)._distinct_nodes())} distinct')
+
+
+def bench_polynomial() -> None:
+    """
+    Compare evaluating large trees over few variables, directly and
+    compiled, with evaluating the Horner form of their polynomials, which
+    are much smaller, and time the expansion into the polynomial.
+    """
+    rng = Random(29)
+    print(f'{"nodes":>7} {"vars":>4} {"terms":>6} {"horner":>7} '
+          f'{"expand":>9} {"eval":>9} {"horner":>9} {"compiled":>9} '
+          f'{"horner":>9}')
+    for n_nodes, n_variables, variable_ratio in [(10000, 2, 0.02),
+                                                  (10000, 3, 0.02),
+                                                  (100000, 1, 0.1),
+                                                  (100000, 1, 0.02)]:
+        tree, lookup = random_tree(n_nodes, n_variables, rng, variable_ratio)
+        polynomial = tree.to_polynomial()
+        horner = from_polynomial(polynomial, True)
+        assert horner.eval(lookup) == tree.eval(lookup)
+        compiled = tree.compile()
+        compiled_horner = horner.compile()
+        times = [best_time(tree.to_polynomial, repeat=1),
+                 best_time(lambda: tree.eval(lookup), repeat=3),
+                 best_time(lambda: horner.eval(lookup), repeat=3),
+                 best_time(lambda: compiled(lookup), repeat=3),
+                 best_time(lambda: compiled_horner(lookup), repeat=3)]
+        print(f'{count_nodes(tree):>7} {len(lookup):>4} '
+              f'{len(polynomial):>6} {count_nodes(horner):>7} ' +
+              ' '.join(f'{t * 1e3:>7.2f}ms' for t in times))
+
+
+def bench_flat() -> None:
+    """
+    Compare the memory use and speed of ExprTree and FlatExprTree.
+    """
+    rng = Random(7)
+    print(f'{"nodes":>8} {"tree memory":>12} {"flat memory":>12} '
+          f'{"tree eval":>10} {"flat eval":>10} {"tree str":>10} '
+          f'{"flat str":>10}')
+    for n_nodes in [1000, 100000, 1000000]:
+        tree, lookup = random_tree(n_nodes, 10, rng)
+        tree_memory = peak_memory(tree.copy)
+        flat_memory = peak_memory(lambda: FlatExprTree.from_expr_tree(tree))
+        flat = FlatExprTree.from_expr_tree(tree)
+        assert flat.eval(lookup) == tree.eval(lookup)
+        times = [best_time(func, repeat=3) for func in
+                 [lambda: tree.eval(lookup), lambda: flat.eval(lookup),
+                  lambda: str(tree), lambda: str(flat)]]
+        print(f'{len(flat):>8} {tree_memory / len(flat):>10.0f}B '
+              f'{flat_memory / len(flat):>10.0f}B ' +
+              ' '.join(f'{t * 1e3:>8.1f}ms' for t in times))
+
+
+def recursive_eval(tree: ExprTree, lookup: Dict[str, int]) -> int:
+    """
+    Return the value of <tree> for <lookup>, computed recursively as
+    ExprTree.eval was before it ran the cached postfix program.
+    """
+    if tree.is_empty():
+        return 0
+    elif tree._root == OPERATORS[0]:
+        value = 0
+        for subtree in tree._subtrees:
+            value += recursive_eval(subtree, lookup)
+        return value
+    elif tree._root == OPERATORS[1]:
+        value = 1
+        for subtree in tree._subtrees:
+            value *= recursive_eval(subtree, lookup)
+        return value
+    elif isinstance(tree._root, str):
+        return lookup.get(tree._root)
+    return tree._root
+
+
+def bench_eval() -> None:
+    """
+    Compare ExprTree.eval with the recursive evaluation it replaced, the
+    first time a tree is evaluated, which builds its postfix program, and
+    when it is evaluated again.
+    """
+    rng = Random(31)
+    print(f'{"nodes":>8} {"recursive":>10} {"first":>10} {"again":>10}')
+    for n_nodes in [1000, 10000, 100000]:
+        tree, lookup = random_tree(n_nodes, 10, rng)
+        assert tree.eval(lookup) == recursive_eval(tree, lookup)
+
+        def first() -> int:
+            # as after a mutation, which clears the cached program
+            tree._clear_caches()
+            return tree.eval(lookup)
+
+        times = [best_time(lambda: recursive_eval(tree, lookup)),
+                 best_time(first),
+                 best_time(lambda: tree.eval(lookup))]
+        print(f'{count_nodes(tree):>8} ' + ' '.join(f'{t * 1e3:>8.2f}ms'
+                                                   for t in times))
+
+
+def bench_traversal() -> None:
+    """
+    Time the ExprTree methods built on the non-recursive traversals, on a
+    balanced tree and on a left-deep chain that is far deeper than the
+    recursion limit.
+    """
+    rng = Random(9)
+    balanced, lookup = random_tree(100000, 10, rng)
+    chain = ExprTree('a', [])
+    for _ in range(50000):
+        chain = ExprTree('+', [chain, ExprTree(rng.randint(1, 9), [])])
+    print(f'{"tree":>9} {"eval":>10} {"str":>10} {"copy":>10} '
+          f'{"substitute":>10} {"lookup":>10}')
+    for name, tree in [('balanced', balanced), ('chain', chain)]:
+        times = [best_time(func, repeat=3) for func in
+                 [lambda: tree.eval(lookup), lambda: str(tree), tree.copy,
+                  lambda: tree.substitute({'z': 'z'}),
+                  lambda: tree.populate_lookup({})]]
+        print(f'{name:>9} ' + ' '.join(f'{t * 1e3:>8.1f}ms' for t in times))
+
+
+def bench_index() -> None:
+    """
+    Time populate_lookup and a substitute of one variable, like a hint in
+    the GUI, with the cached leaves of the tree, and with the walk over
+    every node that a substitute of an operator still takes.
+    """
+    rng = Random(26)
+    print(f'{"nodes":>8} {"walk lookup":>12} {"lookup":>12} '
+          f'{"walk subst":>12} {"substitute":>12}')
+    for n_nodes in [1000, 10000, 100000]:
+        tree, _ = random_tree(n_nodes, 10, rng)
+        # a pair of substitutes leaves the tree as it was
+        walk = [{'a': 'z', '+': '+'}, {'z': 'a', '+': '+'}]
+        indexed = [{'a': 'z'}, {'z': 'a'}]
+        times = [best_time(lambda: [node for node in tree.preorder()
+                                    if str(node._root).isalpha()]),
+                 best_time(lambda: tree.populate_lookup({})),
+                 best_time(lambda: [tree.substitute(from_to)
+                                    for from_to in walk]) / 2,
+                 best_time(lambda: [tree.substitute(from_to)
+                                    for from_to in indexed]) / 2]
+        print(f'{n_nodes:>8} ' + ' '.join(f'{t * 1e3:>10.3f}ms'
+                                         for t in times))
+
+
+def bench_build() -> None:
+    """
+    Measure the time and peak memory, per node, that build_from_rows takes
+    to build trees from their rows. The peak includes the tree itself.
+    """
+    rng = Random(10)
+    print(f'{"nodes":>8} {"build":>10} {"per node":>10} {"tree memory":>12}')
+    for n_nodes in [10000, 100000, 1000000]:
+        tree, _ = random_tree(n_nodes, 10, rng)
+        rows = list(level_order_rows(tree))
+        n = count_nodes(tree)
+        assert build_from_rows(rows) == tree
+        build_time = best_time(lambda: build_from_rows(rows), repeat=3)
+        memory = peak_memory(lambda: build_from_rows(rows))
+        print(f'{n:>8} {build_time * 1e3:>8.1f}ms '
+              f'{build_time / n * 1e9:>8.0f}ns {memory / n:>10.0f}B')
+
+
+def bench_parse() -> None:
+    """
+    Measure the throughput of parse_expr on large trees, and of parse_many on
+    many small ones.
+    """
+    rng = Random(11)
+    print(f'{"trees":>6} {"nodes":>8} {"text":>10} {"parse":>10} '
+          f'{"throughput":>12}')
+    for n_trees, n_nodes in [(1, 100000), (1, 1000000), (20000, 50)]:
+        lines = [str(random_tree(n_nodes, 10, rng)[0]) + '\n'
+                 for _ in range(n_trees)]
+        size = sum(len(line) for line in lines)
+        if n_trees == 1:
+            parse_time = best_time(lambda: parse_expr(lines[0]), repeat=3)
+        else:
+            # consume the trees one at a time, as a streaming reader would
+            parse_time = best_time(
+                lambda: sum(1 for _ in parse_many(lines)), repeat=3)
+        print(f'{n_trees:>6} {n_nodes:>8} {size / 1e6:>8.2f}MB '
+              f'{parse_time * 1e3:>8.1f}ms '
+              f'{size / parse_time / 1e6:>8.1f}MB/s')
+
+
+def bench_corpus() -> None:
+    """
+    Compare storing a corpus of puzzles with pickle and with puzzle_corpus,
+    by file size, time to write, time to load every puzzle and time to load
+    a few puzzles picked at random.
+    """
+    rng = Random(12)
+    print(f'{"puzzles":>8} {"format":>7} {"size":>9} {"write":>9} '
+          f'{"read all":>9} {"read 100":>9}')
+    with tempfile.TemporaryDirectory() as directory:
+        pickle_path = os.path.join(directory, 'corpus.pickle')
+        corpus_path = os.path.join(directory, 'corpus.bin')
+        for n_puzzles, n_nodes in [(10000, 30), (30000, 30), (300, 3000)]:
+            puzzles = [ExpressionTreePuzzle(random_tree(n_nodes, 6, rng)[0],
+                                            rng.randint(10, 1000))
+                       for _ in range(n_puzzles)]
+            picks = [rng.randrange(n_puzzles) for _ in range(100)]
+            # keep the collector from rescanning the puzzles while the
+            # loaded copies are timed
+            gc.collect()
+            gc.freeze()
+
+            def write_pickle() -> None:
+                with open(pickle_path, 'wb') as file:
+                    pickle.dump(puzzles, file, pickle.HIGHEST_PROTOCOL)
+
+            def read_pickle() -> list:
+                with open(pickle_path, 'rb') as file:
+                    return pickle.load(file)
+
+            def read_corpus() -> list:
+                with CorpusReader(corpus_path) as corpus:
+                    return list(corpus)
+
+            def pick_corpus() -> list:
+                with CorpusReader(corpus_path) as corpus:
+                    return [corpus[i] for i in picks]
+
+            for name, write, read_all, read_some, path in [
+                    ('pickle', write_pickle, read_pickle,
+                     lambda: [read_pickle()[i] for i in picks[:1]],
+                     pickle_path),
+                    ('corpus', lambda: write_corpus(corpus_path, puzzles),
+                     read_corpus, pick_corpus, corpus_path)]:
+                write_time = best_time(write, repeat=1)
+                read_time = best_time(read_all, repeat=1)
+                # pickle has to load the whole corpus to get any puzzle
+                pick_time = best_time(read_some, repeat=1)
+                print(f'{n_puzzles:>8} {name:>7} '
+                      f'{os.path.getsize(path) / 1e6:>7.2f}MB '
+                      f'{write_time:>8.2f}s {read_time:>8.2f}s '
+                      f'{pick_time * 1e3:>7.1f}ms')
+            assert str(read_corpus()[picks[0]]) == str(puzzles[picks[0]])
+            gc.unfreeze()
+            del puzzles
+            gc.collect()
+
+
+def random_puzzle(n_nodes: int, n_variables: int,
+                  rng: Random) -> ExpressionTreePuzzle:
+    """
+    Return a random puzzle with exactly <n_variables> variables and a tree of
+    roughly <n_nodes> nodes, whose target is reached by some assignment.
+    """
+    while True:
+        tree, lookup = random_tree(n_nodes, n_variables, rng)
+        if len(lookup) == n_variables:
+            return ExpressionTreePuzzle(tree, tree.eval(lookup))
+
+
+def solve_all(solver: object, puzzles: List[ExpressionTreePuzzle]) \
+        -> Tuple[float, float]:
+    """
+    Solve each of <puzzles> with <solver>, and return the average number of
+    states it visited and the average time it took.
+    """
+    n_states = 0
+    start = perf_counter()
+    for puzzle in puzzles:
+        seen = set()
+        assert solver.solve(puzzle, seen)[-1].is_solved()
+        n_states += len(seen)
+    elapsed = perf_counter() - start
+    return n_states / len(puzzles), elapsed / len(puzzles)
+
+
+def bench_pruning() -> None:
+    """
+    Compare the number of states the solvers visit, and their time, with
+    and without the interval propagation in ExpressionTreePuzzle.fail_fast.
+    """
+    rng = Random(13)
+    puzzles = [random_puzzle(14, 5, rng) for _ in range(3)]
+    # without propagation, every variable keeps the range it starts with
+    unpruned = mock.patch.object(ExpressionTreePuzzle, 'variable_domains',
+                                 lambda puzzle: {})
+    print(f'{"solver":>10} {"pruning":>8} {"states":>8} {"time":>8}')
+    for solver in [DfsSolver(), BfsSolver()]:
+        with unpruned:
+            results = [('off', solve_all(solver, puzzles))]
+        results.append(('on', solve_all(solver, puzzles)))
+        for pruning, (n_states, elapsed) in results:
+            print(f'{type(solver).__name__:>10} {pruning:>8} '
+                  f'{n_states:>8.0f} {elapsed:>7.2f}s')
+
+
+def bench_fail_fast() -> None:
+    """
+    Measure the cost of one call of ExpressionTreePuzzle.fail_fast on the
+    extensions of a puzzle, as the solvers make it, and the memory one
+    call allocates at its peak.
+    """
+    rng = Random(14)
+    print(f'{"nodes":>6} {"calls":>6} {"per call":>10} {"peak memory":>12}')
+    for n_nodes in [15, 100, 1000]:
+        puzzle = random_puzzle(n_nodes, 5, rng)
+        puzzle.fail_fast()
+        extensions = puzzle.extensions()
+        call_time = best_time(lambda: [e.fail_fast() for e in extensions],
+                              repeat=3) / len(extensions)
+        memory = max(peak_memory(e.fail_fast) for e in extensions[:9])
+        print(f'{count_nodes(puzzle._tree):>6} {len(extensions):>6} '
+              f'{call_time * 1e6:>8.1f}us {memory:>10}B')
+
+
+def bench_state_key() -> None:
+    """
+    Compare the solvers' seen sets, and their time, with the packed state
+    keys of ExpressionTreePuzzle and with the string keys they replaced.
+    """
+    rng = Random(15)
+    puzzles = [random_puzzle(30, 5, rng) for _ in range(3)]
+    string_keys = mock.patch.object(ExpressionTreePuzzle, 'state_key',
+                                    lambda puzzle: str(puzzle))
+    print(f'{"keys":>7} {"states":>8} {"seen memory":>12} {"per state":>10} '
+          f'{"time":>8}')
+    for name in ['string', 'packed']:
+        n_states = memory = 0
+        start = perf_counter()
+        with string_keys if name == 'string' else nullcontext():
+            for puzzle in puzzles:
+                seen = set()
+                BfsSolver().solve(puzzle, seen)
+                n_states += len(seen)
+                memory += sys.getsizeof(seen) + \
+                    sum(sys.getsizeof(key) for key in seen)
+        elapsed = perf_counter() - start
+        print(f'{name:>7} {n_states:>8} {memory / 1e6:>10.2f}MB '
+              f'{memory / n_states:>8.0f}B {elapsed:>7.2f}s')
+
+
+def bench_bfs() -> None:
+    """
+    Measure the states per second that BfsSolver visits, and its peak
+    memory, on puzzles with 4 to 6 variables.
+    """
+    rng = Random(17)
+    print(f'{"variables":>9} {"states":>8} {"time":>8} {"states/s":>9} '
+          f'{"peak memory":>12}')
+    for n_variables in [4, 5, 6]:
+        puzzle = random_puzzle(20, n_variables, rng)
+        seen = set()
+        start = perf_counter()
+        BfsSolver().solve(puzzle, seen)
+        elapsed = perf_counter() - start
+        memory = peak_memory(lambda: BfsSolver().solve(puzzle))
+        print(f'{n_variables:>9} {len(seen):>8} {elapsed:>7.2f}s '
+              f'{len(seen) / elapsed:>9.0f} {memory / 1e6:>10.2f}MB')
+
+
+def bench_dfs() -> None:
+    """
+    Measure the states DfsSolver visits, and its time, to find a solution of
+    puzzles with 4 to 6 variables.
+    """
+    rng = Random(18)
+    puzzles = [random_puzzle(40, n_variables, rng) for n_variables in [4, 5, 6]]
+    print(f'{"variables":>9} {"states":>8} {"path":>5} {"time":>8}')
+    for puzzle in puzzles:
+        seen = set()
+        start = perf_counter()
+        path = DfsSolver().solve(puzzle, seen)
+        elapsed = perf_counter() - start
+        print(f'{len(puzzle.variables):>9} {len(seen):>8} {len(path):>5} '
+              f'{elapsed:>7.3f}s')
+
+
+def bench_order() -> None:
+    """
+    Compare the number of states the solvers visit, and their time, with
+    each order in which ExpressionTreePuzzle.extensions assigns variables.
+    """
+    rng = Random(19)
+    print(f'{"variables":>9} {"solver":>10} {"order":>12} {"states":>8} '
+          f'{"time":>8}')
+    for n_variables in [4, 5]:
+        puzzles = [random_puzzle(20, n_variables, rng) for _ in range(2)]
+        for solver in [DfsSolver(), BfsSolver()]:
+            for order in [ANY_ORDER, FIXED_ORDER, CONSTRAINED_ORDER]:
+                for puzzle in puzzles:
+                    puzzle.order = order
+                n_states, elapsed = solve_all(solver, puzzles)
+                print(f'{n_variables:>9} {type(solver).__name__:>10} '
+                      f'{order:>12} {n_states:>8.0f} {elapsed:>7.3f}s')
+
+
+def bench_best_first() -> None:
+    """
+    Compare the number of states each solver extends, and its time, on
+    puzzles with 4 to 6 variables.
+    """
+    rng = Random(20)
+    print(f'{"variables":>9} {"solver":>16} {"states":>8} {"time":>8}')
+    for n_variables in [4, 5, 6]:
+        puzzles = [random_puzzle(20, n_variables, rng) for _ in range(3)]
+        solvers = [DfsSolver(), BestFirstSolver(), AStarSolver()]
+        if n_variables < 6:
+            solvers.insert(1, BfsSolver())
+        for solver in solvers:
+            n_states, elapsed = solve_all(solver, puzzles)
+            print(f'{n_variables:>9} {type(solver).__name__:>16} '
+                  f'{n_states:>8.0f} {elapsed:>7.3f}s')
+
+
+def bench_parallel() -> None:
+    """
+    Measure the time ParallelSolver takes to solve puzzles with 1, 2, 4 and
+    8 worker processes, against DfsSolver on its own.
+    """
+    rng = Random(22)
+    puzzles = []
+    solved = []
+    serial = 0.0
+    # puzzles with 7 variables whose targets are moved, so that most have
+    # no solution, and which DfsSolver solves in under 3000 states
+    while len(puzzles) < 6:
+        puzzle = random_puzzle(40, 7, rng)
+        puzzle.target += 1
+        puzzle.order = FIXED_ORDER
+        seen = set()
+        start = perf_counter()
+        path = DfsSolver(max_nodes=3000).solve(puzzle, seen)
+        if len(seen) < 3000:
+            serial += perf_counter() - start
+            puzzles.append(puzzle)
+            solved.append(bool(path))
+    print(f'{len(puzzles)} puzzles, {sum(solved)} solvable, '
+          f'{os.cpu_count()} CPUs')
+    print(f'{"workers":>7} {"time":>8} {"speedup":>8}')
+    print(f'{"serial":>7} {serial:>7.2f}s {1:>8.2f}')
+    for workers in [1, 2, 4, 8]:
+        solver = ParallelSolver(workers=workers)
+        start = perf_counter()
+        paths = [solver.solve(puzzle) for puzzle in puzzles]
+        elapsed = perf_counter() - start
+        assert [bool(path) for path in paths] == solved
+        print(f'{workers:>7} {elapsed:>7.2f}s {serial / elapsed:>8.2f}')
+
+
+def bench_values() -> None:
+    """
+    Compare the time DfsSolver, with the fixed order of variables, and
+    ReachableValueSolver take on puzzles with 4 to 10 variables, whose
+    targets are moved so that most have no solution.
+    """
+    rng = Random(23)
+    print(f'{"variables":>9} {"solvable":>9} {"DfsSolver":>10} '
+          f'{"ReachableValueSolver":>21}')
+    for n_variables in [4, 6, 8, 10]:
+        puzzles = []
+        for _ in range(3):
+            puzzle = random_puzzle(30, n_variables, rng)
+            puzzle.target += 1
+            puzzle.order = FIXED_ORDER
+            puzzles.append(puzzle)
+        times = []
+        for solver in [DfsSolver(), ReachableValueSolver()]:
+            if n_variables > 8 and isinstance(solver, DfsSolver):
+                # it takes over ten minutes
+                times.append(None)
+                continue
+            start = perf_counter()
+            paths = [solver.solve(puzzle) for puzzle in puzzles]
+            times.append(perf_counter() - start)
+        solvable = sum(bool(path) for path in paths)
+        print(f'{n_variables:>9} {solvable:>9} ' + ' '.join(
+            f'{"-":>10}' if elapsed is None else f'{elapsed:>9.3f}s'
+            for elapsed in times[:1]) + f' {times[1]:>20.3f}s')
+
+
+def bench_count() -> None:
+    """
+    Compare the time ExpressionTreePuzzle.count_solutions takes to count the
+    solutions of puzzles with 8 to 12 variables, and the time to count them
+    by listing them all with DfsSolver.iter_solutions.
+    """
+    rng = Random(25)
+    print(f'{"variables":>9} {"solutions":>10} {"enumerate":>10} '
+          f'{"count_solutions":>16}')
+    for n_variables in [8, 10, 12]:
+        puzzles = []
+        for _ in range(3):
+            puzzle = random_puzzle(30, n_variables, rng)
+            puzzle.order = FIXED_ORDER
+            puzzles.append(puzzle)
+        enumerated = None
+        if n_variables <= 8:
+            # beyond 8 variables it takes too long
+            start = perf_counter()
+            for puzzle in puzzles:
+                sum(1 for _ in DfsSolver().iter_solutions(puzzle))
+            enumerated = perf_counter() - start
+        start = perf_counter()
+        counts = [puzzle.count_solutions() for puzzle in puzzles]
+        elapsed = perf_counter() - start
+        print(f'{n_variables:>9} {sum(counts):>10} ' + (
+            f'{"-":>10}' if enumerated is None else f'{enumerated:>9.3f}s')
+            + f' {elapsed:>15.3f}s')
+
+
+def bench_iter_solutions() -> None:
+    """
+    Compare the time to get the first solutions of puzzles from
+    DfsSolver.iter_solutions, and from the default Solver.iter_solutions,
+    which solves the puzzle again for each one.
+    """
+    rng = Random(24)
+    puzzles = []
+    for _ in range(3):
+        puzzle = random_puzzle(20, 5, rng)
+        puzzle.order = FIXED_ORDER
+        puzzles.append(puzzle)
+    print(f'{"solutions":>9} {"found":>6} {"resolving":>10} {"generator":>10}')
+    for n_solutions in [2, 10, 50]:
+        times = []
+        for iter_solutions in [Solver.iter_solutions,
+                               DfsSolver.iter_solutions]:
+            start = perf_counter()
+            found = sum(len(list(islice(iter_solutions(DfsSolver(), puzzle),
+                                        n_solutions)))
+                        for puzzle in puzzles)
+            times.append(perf_counter() - start)
+        print(f'{n_solutions:>9} {found:>6} {times[0]:>9.3f}s '
+              f'{times[1]:>9.3f}s')
+
+
+BENCHMARKS = {
+    'compile': bench_compile,
+    'eval_batch': bench_eval_batch,
+    'eq': bench_eq,
+    'incremental': bench_incremental,
+    'extensions': bench_extensions,
+    'flat': bench_flat,
+    'eval': bench_eval,
+    'traversal': bench_traversal,
+    'simplify': bench_simplify,
+    'dag': bench_dag,
+    'polynomial': bench_polynomial,
+    'index': bench_index,
+    'build': bench_build,
+    'parse': bench_parse,
+    'corpus': bench_corpus,
+    'pruning': bench_pruning,
+    'fail_fast': bench_fail_fast,
+    'state_key': bench_state_key,
+    'bfs': bench_bfs,
+    'dfs': bench_dfs,
+    'order': bench_order,
+    'best_first': bench_best_first,
+    'parallel': bench_parallel,
+    'values': bench_values,
+    'iter_solutions': bench_iter_solutions,
+    'count': bench_count,
+}
+
+
+def main(names: List[str]) -> None:
+    """
+    Run the benchmarks named in <names>, or all of them if it is empty.
+    """
+    for name in names or list(BENCHMARKS):
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
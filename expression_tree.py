@@ -1,16 +1,51 @@
 from __future__ import annotations
 
-from typing import List, Dict, Optional, Tuple, Union
+import gc
+import itertools
+import re
+from array import array
+from bisect import bisect_right
+from collections import deque
+from contextlib import contextmanager
+from math import prod
+from operator import add, mul
+from typing import Any, Callable, Iterable, Iterator, List, Dict, Optional, \
+    Sequence, Set, Tuple, Union
 
 # for the provided tree visualization code
 import matplotlib.pyplot as plt
 import networkx as nx
 
+# numpy is optional: ExprTree.eval_batch uses it when it is installed
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 # constants for the supported operators
 OP_MULTIPLY = '*'
 OP_ADD = '+'
 OPERATORS = [OP_ADD, OP_MULTIPLY]
 
+# opcodes for the postfix programs produced by ExprTree._postfix_program
+PUSH_CONST = 0
+PUSH_VAR = 1
+APPLY_ADD = 2
+APPLY_MULTIPLY = 3
+# and for a subtree that several nodes of a FrozenExprTree share, which is
+# only computed once: keep the value on top of the stack in a numbered
+# store, and push the value of a store (4 is EMPTY in flat_expression_tree)
+SAVE_SHARED = 5
+LOAD_SHARED = 6
+
+# the largest value eval_batch may store in a 64-bit integer column
+INT64_MAX = 2 ** 63 - 1
+
+# the tokens of the text produced by ExprTree.__str__: parentheses, and runs
+# of other non-whitespace characters, which are values or operators
+_TOKEN = re.compile(r'[()]|[^\s()]+')
+_INTEGER = re.compile(r'-?[0-9]+')
+
 
 class ExprTree:
     """
@@ -18,9 +53,35 @@ class ExprTree:
 
     This class supports operators(+ and *), variables, and integer constants.
 
+    Each node keeps a reference to its one parent, through which mutating
+    a subtree clears the cached values of the trees above it. So a node
+    must not be a subtree of two trees, or appear twice in one tree: only
+    its last parent would see it change. Use copy to reuse a subtree, or
+    freeze the tree to share identical subtrees safely.
+
     === Private Attributes ===
     _root: The item stored at this tree's root, or None if the tree is empty.
     _subtrees: The list of all subtrees of this expression tree.
+    _compiled: The cached evaluator built by compile, or None if the tree
+               has not been compiled since it was last mutated.
+    _hash: The cached structural hash of this tree, or None if it has not
+           been computed since the tree was last mutated.
+    _parent: The tree this tree is a subtree of, or None if it is a root.
+    _value: The value of this tree computed by incremental evaluation, or
+            None if it is not known to be up to date.
+    _lookup: The variable values used by the last call to eval_incremental
+             on this tree, or None if it has never been called.
+    _occurrences: The leaves of this tree for each variable and constant,
+                  with the items in the order of their first leaf in a
+                  preorder, or None if they have not been found since the
+                  tree was last mutated. They are kept up to date by
+                  substitute and append on this tree itself.
+    _frozen: The cached frozen copy of this tree made by freeze, or None if
+             the tree has been mutated since it was last frozen.
+    _program: The cached result of _postfix_program, or None if the tree
+              has been mutated since it was last computed.
+    _propagator: The cached _BoundsPropagator used by narrow_domains, or
+                 None if the tree has been mutated since it was last made.
 
     === Representation Invariants ===
     - If self._root is None then self._subtrees is an empty list.
@@ -42,6 +103,19 @@ class ExprTree:
     """
     _root: Optional[Union[str, int]]
     _subtrees: List[ExprTree]
+    # The attributes below default to None at the class level, so that a
+    # node only stores the ones that have been set on it. This keeps each
+    # node small and cheap to create.
+    _compiled: Optional[Callable[[Dict[str, int]], int]] = None
+    _hash: Optional[int] = None
+    _parent: Optional[ExprTree] = None
+    _value: Optional[int] = None
+    _lookup: Optional[Dict[str, int]] = None
+    _occurrences: Optional[Dict[Union[str, int], List[ExprTree]]] = None
+    _frozen: Optional[FrozenExprTree] = None
+    _program: Optional[Tuple[List[Tuple[int, Union[int, str]]],
+                             List[str]]] = None
+    _propagator: Optional[_BoundsPropagator] = None
 
     def __init__(self, root: Optional[Union[str, int]],
                  subtrees: List[ExprTree]) -> None:
@@ -55,9 +129,26 @@ class ExprTree:
           an int (1-9), or a variable (a-z).
         - if <root> is an operator, then subtrees has at least two children.
         - if <root> is not an operator, subtrees is an empty list.
+        - no tree in <subtrees> is a subtree of another tree, or appears
+          twice in <subtrees>.
+
+        A FrozenExprTree in <subtrees> is replaced by a thawed copy, since
+        it can not be changed by mutating this tree.
+
+        >>> frozen = ExprTree('+', [ExprTree('b', []), \
+                                    ExprTree(4, [])]).freeze()
+        >>> exp_t = ExprTree('*', [frozen, ExprTree(2, [])])
+        >>> exp_t.substitute({'+': '*', 'b': 5})
+        >>> print(exp_t, frozen)
+        ((5 * 4) * 2) (b + 4)
         """
         self._root = root
         self._subtrees = subtrees
+        for i, subtree in enumerate(subtrees):
+            if subtree is not None:
+                if isinstance(subtree, FrozenExprTree):
+                    subtree = subtrees[i] = subtree.thaw()
+                subtree._parent = self
 
     def is_empty(self) -> bool:
         """Return whether this expression tree is empty.
@@ -71,10 +162,59 @@ class ExprTree:
         """
         return self._root is None
 
+    def preorder(self) -> Iterator[ExprTree]:
+        """
+        Yield every node of this expression tree, each before its subtrees,
+        and the subtrees of a node from left to right.
+
+        The traversal uses an explicit stack instead of recursion, so it
+        works on trees of any depth.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])])])
+        >>> [node._root for node in exp_t.preorder()]
+        ['+', 3, '*', 'x', 'y']
+        """
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            yield node
+            if node._subtrees:
+                to_visit.extend(reversed(node._subtrees))
+
+    def postorder(self) -> Iterator[ExprTree]:
+        """
+        Yield every node of this expression tree, each after its subtrees,
+        and the subtrees of a node from left to right.
+
+        The traversal uses an explicit stack instead of recursion, so it
+        works on trees of any depth.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])])])
+        >>> [node._root for node in exp_t.postorder()]
+        [3, 'x', 'y', '*', '+']
+        """
+        # a preorder that visits subtrees from right to left is exactly the
+        # reverse of this postorder, and needs no per-node bookkeeping
+        order = []
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            order.append(node)
+            to_visit.extend(node._subtrees)
+        yield from reversed(order)
+
     def eval(self, lookup: Dict[str, int]) -> int:
         """
         Evaluate this expression tree and return the result.
 
+        The first evaluation builds the postfix program of the tree, which
+        is cached until the tree is mutated, so that each later one runs
+        through a flat list of instructions instead of walking the tree.
+
         Precondition:
         lookup contains all of the variables necessary to evaluate
         this expression tree.
@@ -92,24 +232,538 @@ class ExprTree:
         >>> exp_t.eval(look_up)
         31
         """
-        if self.is_empty():
-            return 0
-        elif self._root == OP_ADD:
-            exp = 0
+        program, variables = self._postfix_program()
+        slots = [lookup.get(name) for name in variables]
+        values = []
+        push = values.append
+        for opcode, arg in program:
+            if opcode == PUSH_VAR:
+                push(slots[arg])
+            elif opcode == PUSH_CONST:
+                push(arg)
+            elif arg == 2:
+                # most operators have two subtrees
+                other = values.pop()
+                if opcode == APPLY_ADD:
+                    values[-1] += other
+                else:
+                    values[-1] *= other
+            else:
+                operands = values[len(values) - arg:]
+                del values[len(values) - arg:]
+                push(sum(operands) if opcode == APPLY_ADD else prod(operands))
+        return values[-1]
+
+    def eval_incremental(self, lookup: Dict[str, int]) -> int:
+        """
+        Evaluate this expression tree and return the result, like eval.
+
+        The value of every subtree is cached, along with a copy of
+        <lookup>, so that update_variable can later re-evaluate the tree
+        after one variable changes.
+
+        Precondition:
+        lookup contains all of the variables necessary to evaluate
+        this expression tree.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> exp_t.eval_incremental({'x': 7, 'y': 3})
+        31
+        """
+        to_visit = [(self, False)]
+        while to_visit:
+            node, expanded = to_visit.pop()
+            if node.is_empty():
+                node._value = 0
+            elif node._root in OPERATORS:
+                if expanded:
+                    node._recompute()
+                else:
+                    to_visit.append((node, True))
+                    for child in node._subtrees:
+                        if child is not None:
+                            to_visit.append((child, False))
+            elif isinstance(node._root, str):
+                node._value = lookup.get(node._root)
+            else:
+                node._value = node._root
+        self._lookup = dict(lookup)
+        # the trees above this one no longer match the values cached here
+        ancestor = self._parent
+        while ancestor is not None:
+            ancestor._value = None
+            ancestor = ancestor._parent
+        return self._value
+
+    def update_variable(self, variable: str, value: int) -> int:
+        """
+        Change <variable> to <value> in the lookup used by the last call to
+        eval_incremental, and return the new value of this expression tree.
+
+        Only the operator nodes on the paths from the leaves of <variable>
+        up to this tree are re-evaluated, which takes O(depth * occurrences)
+        time rather than O(n). If the tree has been mutated since it was
+        last evaluated, it is first evaluated again in full.
+
+        Raise a ValueError if eval_incremental has never been called on
+        this tree.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> exp_t.eval_incremental({'x': 7, 'y': 3})
+        31
+        >>> exp_t.update_variable('y', 1)
+        17
+        >>> exp_t.append(ExprTree('y', []))
+        >>> exp_t.update_variable('x', 1)
+        6
+        """
+        if self._lookup is None:
+            raise ValueError('eval_incremental has not been called')
+        self._lookup[variable] = value
+        if self._value is None:
+            return self.eval_incremental(self._lookup)
+        leaves = self._leaf_index().get(variable, [])
+        for leaf in leaves:
+            leaf._value = value
+        for leaf in leaves:
+            node = leaf
+            while node is not self:
+                node = node._parent
+                old_value = node._value
+                node._recompute()
+                # nothing above node changes if its own value did not
+                if node._value == old_value:
+                    break
+        return self._value
+
+    def _recompute(self) -> None:
+        """
+        Set the cached value of this operator node from the cached values of
+        its subtrees.
+        """
+        if self._root == OP_ADD:
+            value = 0
             for subtree in self._subtrees:
                 if subtree is not None:
-                    exp += subtree.eval(lookup)
-            return exp
-        elif self._root == OP_MULTIPLY:
-            exp = 1
+                    value += subtree._value
+        else:
+            value = 1
             for subtree in self._subtrees:
                 if subtree is not None:
-                    exp *= subtree.eval(lookup)
-            return exp
-        elif isinstance(self._root, str):
-            return lookup.get(self._root)
-        else:
-            return self._root
+                    value *= subtree._value
+        self._value = value
+
+    def compile(self) -> Callable[[Dict[str, int]], int]:
+        """
+        Return a function that evaluates this expression tree for a lookup,
+        giving the same result as self.eval(lookup).
+
+        The function is generated as flat, straight-line Python code from
+        the postfix program of the simplified tree, so calling it does no
+        recursion and no dispatch on node types, and does not redo the
+        arithmetic on constants. Identical subtrees of the simplified tree
+        are computed once. The function is cached and reused by later calls
+        until the tree is mutated through substitute, append or
+        append_multi.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> evaluate = exp_t.compile()
+        >>> evaluate({'x': 7, 'y': 3})
+        31
+        >>> exp_t.compile() is evaluate
+        True
+        >>> exp_t.substitute({'*': '+'})
+        >>> exp_t.compile()({'x': 7, 'y': 3})
+        20
+        """
+        if self._compiled is None:
+            self._compiled = _generate_evaluator(
+                *_share(self.simplify())._shared_program())
+        return self._compiled
+
+    def eval_batch(self, columns: Dict[str, Sequence[int]]) -> Any:
+        """
+        Evaluate this expression tree once for each row of <columns>, and
+        return the results as an array with one entry per row.
+
+        <columns> maps each variable to a column of its values, given as a
+        NumPy array, an array.array or any other sequence of ints. Each
+        operator node is applied to whole columns at once.
+
+        Like eval, the results are exact: they are computed with 64-bit
+        integers only when a bound on the tree's value shows that they can
+        not overflow, and with Python ints otherwise. The result is a NumPy
+        array if NumPy is installed, and otherwise an array.array of 64-bit
+        integers, or a list when the results may not fit in one.
+
+        Precondition:
+        <columns> contains all of the variables necessary to evaluate
+        this expression tree, and its columns all have the same length.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> [int(v) for v in exp_t.eval_batch({'x': [7, 1, 0], \
+                                               'y': [3, 2, 9]})]
+        [31, 6, 3]
+        >>> big = ExprTree('*', [ExprTree('x', []), ExprTree('x', []), \
+                                 ExprTree('x', [])])
+        >>> [int(v) for v in big.eval_batch({'x': [2 ** 30, 2]})]
+        [1237940039285380274899124224, 8]
+        """
+        program, variables = self._shared_program()
+        sizes = {len(column) for column in columns.values()}
+        if len(sizes) > 1:
+            raise ValueError('eval_batch needs columns of equal length')
+        n_rows = sizes.pop() if sizes else 1
+        if np is not None:
+            slots = [np.asarray(columns[name]) for name in variables]
+            maxima = [max(abs(int(slot.min())), abs(int(slot.max())))
+                      if len(slot) else 0 for slot in slots]
+            dtype = np.int64 if _postfix_bound(program, maxima) <= INT64_MAX \
+                else object
+            slots = [slot.astype(dtype, copy=False) for slot in slots]
+            return _batch_numpy(program, slots, n_rows, dtype)
+        slots = [list(columns[name]) for name in variables]
+        maxima = [max((abs(v) for v in slot), default=0) for slot in slots]
+        results = _batch_python(program, slots, n_rows)
+        if _postfix_bound(program, maxima) <= INT64_MAX:
+            return array('q', results)
+        return results
+
+    def _postfix_program(self) -> Tuple[List[Tuple[int, Union[int, str]]],
+                                        List[str]]:
+        """
+        Return the postfix program for this expression tree and the names of
+        the variables it reads, in slot order.
+
+        Each instruction is an (opcode, argument) pair:
+        - (PUSH_CONST, value) pushes a constant,
+        - (PUSH_VAR, slot) pushes the value of variable number <slot>,
+        - (APPLY_ADD, n) and (APPLY_MULTIPLY, n) replace the top n values
+          with their sum or product.
+
+        Non-operator nodes are treated exactly as eval treats them.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> program, variables = exp_t._postfix_program()
+        >>> program
+        [(0, 3), (1, 0), (1, 1), (3, 2), (1, 0), (2, 3)]
+        >>> variables
+        ['x', 'y']
+        """
+        if self._program is None:
+            self._program = _emit_program(self, set())
+        return self._program
+
+    def _shared_program(self) -> Tuple[List[Tuple[int, Union[int, str]]],
+                                       List[str]]:
+        """
+        Return the postfix program for this expression tree and the names of
+        the variables it reads, computing a subtree shared by several nodes
+        only once.
+
+        The nodes of an ExprTree are never shared, so this is the same as
+        _postfix_program.
+        """
+        return self._postfix_program()
+
+    def simplify(self) -> ExprTree:
+        """
+        Return a new expression tree with the same value as this one for
+        every lookup, with its constants folded and its operators flattened.
+
+        The operands of a + or * node that are the same operator are merged
+        into it, and its constant operands are replaced by their sum or
+        product, which is left out if it is 1 for a *. A node left with a
+        single operand is replaced by it. The operands are then put in a
+        normal order: the variables by name, then the operators, then the
+        constant, so that trees that only differ in the grouping or order of
+        operands simplify to equal trees.
+
+        The folded constants may be greater than 9. The tree returned is a
+        FrozenExprTree if this tree is one, and a node this tree shares is
+        only simplified once.
+
+        >>> exp_t = ExprTree('+', [ExprTree('a', []), \
+                                   ExprTree('+', [ExprTree('b', []), \
+                                                  ExprTree(3, [])])])
+        >>> print(exp_t.simplify())
+        (a + b + 3)
+        >>> exp_t = ExprTree('*', [ExprTree('+', [ExprTree(4, []), \
+                                                  ExprTree(5, [])]), \
+                                   ExprTree('+', [ExprTree('b', []), \
+                                                  ExprTree('a', [])]), \
+                                   ExprTree(2, [])])
+        >>> print(exp_t.simplify())
+        ((a + b) * 18)
+        >>> exp_t = ExprTree('*', [ExprTree(1, []), ExprTree('c', [])])
+        >>> print(exp_t.simplify())
+        c
+        """
+        cls = FrozenExprTree if isinstance(self, FrozenExprTree) \
+            else ExprTree
+        # the sort key of each simplified tree, by its id
+        keys = {}
+        # the simplified tree of each node, by its id
+        done = {}
+        results = []
+        to_visit = [(self, False)]
+        while to_visit:
+            node, expanded = to_visit.pop()
+            children = [child for child in node._subtrees if child is not None]
+            if expanded:
+                operands = results[len(results) - len(children):]
+                del results[len(results) - len(children):]
+                done[id(node)] = _fold(node._root, operands, keys, cls)
+                results.append(done[id(node)])
+            elif id(node) in done:
+                results.append(done[id(node)])
+            elif children and node._root in OPERATORS:
+                to_visit.append((node, True))
+                for child in reversed(children):
+                    to_visit.append((child, False))
+            else:
+                leaf = cls(node._root, [])
+                keys[id(leaf)] = (2, node._root) \
+                    if isinstance(node._root, int) else (0, str(node._root))
+                done[id(node)] = leaf
+                results.append(leaf)
+        # the result may have been an operand of a node that was merged away
+        results[0]._parent = None
+        return results[0]
+
+    def to_polynomial(self, max_terms: Optional[int] = None) \
+            -> Dict[Tuple[Tuple[str, int], ...], int]:
+        """
+        Return the polynomial this expression tree computes, as a map from
+        each of its monomials to its coefficient.
+
+        A monomial is a tuple of (variable, exponent) pairs sorted by
+        variable, and the constant term has the monomial (). Terms whose
+        coefficient is 0 are left out, and the terms are in order of their
+        monomials. Two trees have the same value for every lookup if and
+        only if they have equal polynomials.
+
+        Expanding products can make the polynomial much larger than the
+        tree, so a PolynomialTooLargeError is raised as soon as the
+        polynomial of a subtree has more than <max_terms> terms, by default
+        the number of distinct nodes of this tree. As the constants are
+        positive, no terms cancel out, and the polynomial of a tree has at
+        least as many terms as that of any of its subtrees. A node this
+        tree shares is only expanded once.
+
+        >>> exp_t = ExprTree('*', [ExprTree('+', [ExprTree('a', []), \
+                                                  ExprTree(2, [])]), \
+                                   ExprTree('+', [ExprTree('a', []), \
+                                                  ExprTree('b', [])])])
+        >>> exp_t.to_polynomial()
+        {(('a', 1),): 2, (('a', 1), ('b', 1)): 1, (('a', 2),): 1, \
+(('b', 1),): 2}
+        >>> exp_t.to_polynomial(3)
+        Traceback (most recent call last):
+        ...
+        expression_tree.PolynomialTooLargeError: The polynomial of the \
+expression tree has more than 3 terms.
+        """
+        nodes = _distinct_postorder(self)
+        if max_terms is None:
+            max_terms = len(nodes)
+        # the number of nodes each node is a subtree of and that are still
+        # to be expanded, by its id, so that its polynomial can be dropped
+        uses = {}
+        for node in nodes:
+            for child in node._subtrees:
+                if child is not None:
+                    uses[id(child)] = uses.get(id(child), 0) + 1
+        # the polynomial of each node, by its id
+        polynomials = {}
+        for node in nodes:
+            subtrees = [child for child in node._subtrees if child is not None]
+            children = [polynomials[id(child)] for child in subtrees]
+            for child in subtrees:
+                uses[id(child)] -= 1
+                if not uses[id(child)]:
+                    del polynomials[id(child)]
+            if children and node._root == OP_ADD:
+                polynomial = _add_polynomials(children)
+            elif children and node._root == OP_MULTIPLY:
+                polynomial = children[0]
+                for other in children[1:]:
+                    polynomial = _multiply_polynomials(polynomial, other,
+                                                       max_terms)
+            elif node._root is None or node._root == OP_ADD:
+                polynomial = {}
+            elif node._root == OP_MULTIPLY:
+                polynomial = {(): 1}
+            elif isinstance(node._root, int):
+                polynomial = {(): node._root} if node._root else {}
+            else:
+                polynomial = {((str(node._root), 1),): 1}
+            if len(polynomial) > max_terms:
+                raise PolynomialTooLargeError(max_terms)
+            polynomials[id(node)] = polynomial
+        return dict(sorted(polynomials[id(self)].items()))
+
+    def is_equivalent(self, other: ExprTree,
+                      max_terms: Optional[int] = None) -> bool:
+        """
+        Return whether this expression tree and <other> have the same value
+        for every lookup, by comparing their polynomials.
+
+        A PolynomialTooLargeError is raised if either polynomial is too
+        large, as in to_polynomial.
+
+        >>> exp_t = ExprTree('*', [ExprTree('a', []), \
+                                   ExprTree('+', [ExprTree('b', []), \
+                                                  ExprTree(2, [])])])
+        >>> other = ExprTree('+', [ExprTree('*', [ExprTree('b', []), \
+                                                  ExprTree('a', [])]), \
+                                   ExprTree('+', [ExprTree('a', []), \
+                                                  ExprTree('a', [])])])
+        >>> exp_t.is_equivalent(other)
+        True
+        >>> exp_t.is_equivalent(ExprTree('+', [ExprTree('a', []), \
+                                               ExprTree('b', [])]))
+        False
+        """
+        return self.to_polynomial(max_terms) == other.to_polynomial(max_terms)
+
+    def narrow_domains(self, domains: Dict[str, Tuple[int, int]],
+                       target: int) -> Optional[Dict[str, Tuple[int, int]]]:
+        """
+        Return the narrowest ranges within <domains> that the variables of
+        this expression tree can take if it is to evaluate to <target>, or
+        None if no values in <domains> make it evaluate to <target>.
+
+        <domains> maps each variable to an inclusive (low, high) range of
+        the values it may take. Variables that are not in this tree keep
+        their ranges, and a variable of this tree that is not in <domains>
+        makes it impossible to evaluate, so None is returned.
+
+        The range of every subtree is computed from those of its subtrees,
+        bottom up, and then the range each subtree has to be in for the
+        whole tree to evaluate to <target> is pushed top down to the
+        variables, until no range changes. Each occurrence of a variable is
+        bounded on its own, so the ranges may still include values that do
+        not work, but never leave out one that does.
+
+        >>> exp_t = ExprTree('+', [ExprTree('*', [ExprTree('a', []), \
+                                                  ExprTree(7, [])]), \
+                                   ExprTree('b', [])])
+        >>> exp_t.narrow_domains({'a': (1, 9), 'b': (1, 9)}, 40)
+        {'a': (5, 5), 'b': (5, 5)}
+        >>> exp_t.narrow_domains({'a': (1, 9), 'b': (1, 9)}, 20)
+        {'a': (2, 2), 'b': (6, 6)}
+        >>> exp_t.narrow_domains({'a': (1, 9), 'b': (1, 9)}, 7) is None
+        True
+        """
+        program, variables = self._shared_program()
+        if self._propagator is None:
+            self._propagator = _BoundsPropagator(program)
+        lows = []
+        highs = []
+        for name in variables:
+            if name not in domains:
+                return None
+            low, high = domains[name]
+            lows.append(low)
+            highs.append(high)
+        if not self._propagator.narrow(lows, highs, target):
+            return None
+        narrowed = dict(domains)
+        for name, low, high in zip(variables, lows, highs):
+            narrowed[name] = (low, high)
+        return narrowed
+
+    def find_assignment(self, domains: Dict[str, Tuple[int, int]],
+                        target: int) -> Optional[Dict[str, int]]:
+        """
+        Return values within <domains> for the variables of this expression
+        tree that make it evaluate to <target>, or None if there are none.
+
+        <domains> maps each variable to an inclusive (low, high) range of
+        the values it may take, as for narrow_domains.
+
+        The set of values each subtree can reach, up to <target>, is found
+        bottom up: the values of a + node are the sums of values of its
+        subtrees, and those of a * node their products. This is only exact
+        when the subtrees of a node share no variables, so at a node whose
+        subtrees do, each assignment of the shared variables is tried in
+        turn. The values of the variables are then read back top down from
+        <target>, by splitting the value wanted of each node between its
+        subtrees.
+
+        Raise a ValueError if a subtree may have a value less than 1, that
+        is if the tree is empty, or has a constant less than 1, an operator
+        without subtrees or a variable whose range reaches below 1, since a
+        value above <target> could then lead back down to it.
+
+        >>> exp_t = ExprTree('+', [ExprTree('*', [ExprTree('a', []), \
+                                                  ExprTree('b', [])]), \
+                                   ExprTree('*', [ExprTree('a', []), \
+                                                  ExprTree(7, [])])])
+        >>> domains = {'a': (1, 9), 'b': (1, 9)}
+        >>> exp_t.find_assignment(domains, 45)
+        {'a': 3, 'b': 8}
+        >>> exp_t.find_assignment(domains, 46) is None
+        True
+        """
+        value_sets = _ValueSets(self, domains)
+        if value_sets.variables[id(self)] - domains.keys():
+            return None
+        assignment = {}
+        if not value_sets.assign(self, target, {}, assignment):
+            return None
+        return assignment
+
+    def count_assignments(self, domains: Dict[str, Tuple[int, int]],
+                          target: int) -> int:
+        """
+        Return the number of assignments of values within <domains> to the
+        variables of this expression tree that make it evaluate to
+        <target>.
+
+        Like find_assignment, the values each subtree can reach are found
+        bottom up, but with the number of assignments that reach each of
+        them: the counts of a sum of subtrees with no variables in common
+        are the convolution of their counts, and those of a product the
+        same with products in place of sums. At a node whose subtrees share
+        variables, the counts for each assignment of the shared variables
+        are added up.
+
+        Raise a ValueError in the same cases as find_assignment.
+
+        >>> exp_t = ExprTree('+', [ExprTree('*', [ExprTree('a', []), \
+                                                  ExprTree('b', [])]), \
+                                   ExprTree('*', [ExprTree('a', []), \
+                                                  ExprTree(7, [])])])
+        >>> domains = {'a': (1, 9), 'b': (1, 9)}
+        >>> exp_t.count_assignments(domains, 45)
+        2
+        >>> exp_t.count_assignments(domains, 46)
+        0
+        >>> ExprTree('+', [ExprTree('a', []), \
+                           ExprTree('b', [])]).count_assignments(domains, 10)
+        9
+        """
+        value_counts = _ValueCounts(self, domains)
+        if value_counts.variables[id(self)] - domains.keys():
+            return 0
+        return value_counts.count(self, target, {})
 
     def __str__(self) -> str:
         """
@@ -141,15 +795,7 @@ class ExprTree:
         >>> print(exp_t)
         (3 + (x * y) + x)
         """
-        if self.is_empty():
-            return '()'
-        elif self._root in OPERATORS:
-            exp = '('
-            for subtree in self._subtrees:
-                exp += str(subtree) + ' ' + self._root + ' '
-            return exp[:-3] + ')'
-        else:
-            return str(self._root)
+        return _text(self, set())
 
     def __eq__(self, other: ExprTree) -> bool:
         """
@@ -167,7 +813,78 @@ class ExprTree:
         >>> t2 == ExprTree('*', [])
         False
         """
-        return str(self) == str(other)
+        if self is other:
+            return True
+        if not isinstance(other, ExprTree):
+            return NotImplemented
+        # trees with different hashes are never equal, so the structure only
+        # has to be compared when the hashes match
+        if hash(self) != hash(other):
+            return False
+        pairs = [(self, other)]
+        while pairs:
+            t1, t2 = pairs.pop()
+            if t1 is t2:
+                continue
+            if t1._root != t2._root or \
+                    len(t1._subtrees) != len(t2._subtrees):
+                return False
+            pairs.extend(zip(t1._subtrees, t2._subtrees))
+        return True
+
+    def __hash__(self) -> int:
+        """
+        Return a hash of this ExprTree, consistent with __eq__.
+
+        The hash is computed bottom-up and cached in each node, so it costs
+        O(n) the first time and O(1) afterwards, until the tree is mutated.
+        A tree that is used as a set element or dict key must not be mutated
+        while it is stored there.
+
+        >>> t1 = ExprTree('*', [ExprTree(5, []), ExprTree('a', [])])
+        >>> hash(t1) == hash(ExprTree('*', [ExprTree(5, []), \
+                                            ExprTree('a', [])]))
+        True
+        >>> len({t1, t1.copy(), ExprTree('+', [ExprTree(5, []), \
+                                               ExprTree('a', [])])})
+        2
+        """
+        if self._hash is None:
+            # only the nodes without a cached hash are visited
+            to_visit = [(self, False)]
+            while to_visit:
+                node, expanded = to_visit.pop()
+                if expanded:
+                    node._hash = hash((node._root, tuple(
+                        subtree._hash for subtree in node._subtrees)))
+                elif node._hash is None:
+                    to_visit.append((node, True))
+                    for subtree in node._subtrees:
+                        if subtree._hash is None:
+                            to_visit.append((subtree, False))
+        return self._hash
+
+    def _invalidate(self) -> None:
+        """
+        Discard the values cached in this node and in the trees it is a
+        subtree of, because this node has been mutated.
+        """
+        node = self
+        while node is not None:
+            node._clear_caches()
+            node = node._parent
+
+    def _clear_caches(self) -> None:
+        """
+        Discard the values cached in this node only.
+        """
+        self._compiled = None
+        self._hash = None
+        self._value = None
+        self._occurrences = None
+        self._frozen = None
+        self._program = None
+        self._propagator = None
 
     def substitute(self, from_to: Dict[Union[str, int],
                                        Union[str, int]]) -> None:
@@ -175,6 +892,10 @@ class ExprTree:
         Replace each value in this expression tree that is a key in <from_to>
         with the value associated with it in <from_to>.
 
+        Unless a key is an operator, only the leaves that hold a key, found
+        from the cached leaves of the tree, and the nodes above them are
+        visited.
+
         Precondition:
         the key-value pairs in <from_to> will result
         in this expression tree still being a valid expression tree.
@@ -192,18 +913,53 @@ class ExprTree:
         """
         if self.is_empty():
             return None
-        elif self._root in from_to:
-            self._root = from_to.get(self._root)
-        for subtree in self._subtrees:
-            subtree.substitute(from_to)
+        if any(key in OPERATORS for key in from_to):
+            # operators are not leaves, so every node is visited
+            self._invalidate()
+            self._substitute_below(from_to)
+            return None
+        # only the leaves holding a key are replaced, and only the nodes on
+        # the paths from them up to this tree, and the trees above, change
+        index = self._leaf_index()
+        self._invalidate()
+        cleared = {id(self)}
+        for key in from_to:
+            for leaf in index.get(key, []):
+                node = leaf
+                while id(node) not in cleared:
+                    node._clear_caches()
+                    cleared.add(id(node))
+                    node = node._parent
+                leaf._root = from_to[key]
+        # an item replaced by one already in the tree merges with it, and
+        # comes first where its first leaf does
+        renamed = {}
+        for key, leaves in index.items():
+            key = from_to[key] if key in from_to else key
+            renamed[key] = renamed[key] + leaves if key in renamed else leaves
+        self._occurrences = renamed
         return None
 
+    def _substitute_below(self, from_to: Dict[Union[str, int],
+                                              Union[str, int]]) -> None:
+        """
+        Helper for substitute: substitute <from_to> in this tree, discarding
+        the values cached in each of its nodes.
+        """
+        for node in self.preorder():
+            node._clear_caches()
+            if not node.is_empty() and node._root in from_to:
+                node._root = from_to.get(node._root)
+
     def populate_lookup(self, lookup: Dict[str, int]) -> None:
         """
         Add entries to <lookup> so it contains a key for all variables
         appearing in this expression tree. Assign a value
         of 0 to each variable.
 
+        The variables are added in the order of their first leaf in a
+        preorder, and are found from the cached leaves of the tree.
+
         >>> expr_t = ExprTree('a', [])
         >>> look_up = {}
         >>> expr_t.populate_lookup(look_up)
@@ -211,20 +967,45 @@ class ExprTree:
         True
         >>> len(look_up) == 1
         True
+        >>> exp_t = ExprTree('*', [ExprTree('b', []), ExprTree('a', []), \
+                                   ExprTree('c', [])])
+        >>> exp_t.substitute({'c': 'b'})
+        >>> look_up = {}
+        >>> exp_t.freeze().populate_lookup(look_up)
+        >>> exp_t.populate_lookup(look_up)
+        >>> look_up
+        {'b': 0, 'a': 0}
         """
-        if self.is_empty():
-            return None
-        elif str(self._root).isalpha():
-            lookup[self._root] = 0
-        else:
-            for subtree in self._subtrees:
-                subtree.populate_lookup(lookup)
-        return None
+        for item in self._leaf_index():
+            if str(item).isalpha():
+                lookup[item] = 0
+
+    def _leaf_index(self) -> Dict[Union[str, int], List[ExprTree]]:
+        """
+        Return the leaves of this tree for each variable and constant, in
+        the order of their first leaf in a preorder.
+
+        The leaves are found once and cached, so populate_lookup and
+        substitute take time proportional to the number of distinct leaves
+        and of the leaves they replace, rather than to the tree size.
+        """
+        if self._occurrences is None:
+            index = {}
+            for node in self.preorder():
+                if not node._subtrees and not node.is_empty():
+                    index.setdefault(node._root, []).append(node)
+            self._occurrences = index
+        return self._occurrences
 
     def append(self, child: ExprTree) -> None:
         """Append child to this ExprTree's list of subtrees.
 
-        Precondition: self is not an empty tree.
+        A FrozenExprTree <child> is appended as a thawed copy, as in
+        __init__.
+
+        Preconditions:
+        - self is not an empty tree.
+        - child is not a subtree of any tree.
 
         >>> exp_t = ExprTree('+', [ExprTree('a', []), ExprTree(3, [])])
         >>> print(exp_t)
@@ -233,7 +1014,17 @@ class ExprTree:
         >>> print(exp_t)
         (a + 3 + 5)
         """
+        if isinstance(child, FrozenExprTree):
+            child = child.thaw()
+        index = self._occurrences
+        self._invalidate()
         self._subtrees.append(child)
+        child._parent = self
+        if index is not None:
+            # the leaves of child come after all those already in this tree
+            for item, leaves in child._leaf_index().items():
+                index.setdefault(item, []).extend(leaves)
+            self._occurrences = index
 
     def append_multi(self, subtrees: List[Union[str, int, ExprTree]]) -> None:
         """Append a list of subtrees to this ExprTree's list of subtrees.
@@ -245,12 +1036,67 @@ class ExprTree:
         """
         Return a copy of this ExprTree
         """
-        if self.is_empty():
-            return ExprTree(None, [])
-        node = ExprTree(self._root, [])
-        for c in self._subtrees:
-            node._subtrees.append(c.copy())
-        return node
+        copied = ExprTree(self._root, [])
+        index = self._occurrences
+        # the copy of each leaf, by the id of the leaf, to copy the index
+        leaf_copies = {id(self): copied}
+        # each entry is a node whose subtrees are still to be copied, and
+        # its copy
+        to_copy = [(self, copied)]
+        while to_copy:
+            node, node_copy = to_copy.pop()
+            for subtree in node._subtrees:
+                subtree_copy = ExprTree(subtree._root, [])
+                subtree_copy._parent = node_copy
+                node_copy._subtrees.append(subtree_copy)
+                to_copy.append((subtree, subtree_copy))
+                if index is not None and not subtree._subtrees:
+                    leaf_copies[id(subtree)] = subtree_copy
+        if index is not None:
+            copied._occurrences = {
+                item: [leaf_copies[id(leaf)] for leaf in leaves]
+                for item, leaves in index.items()}
+        # the copy has the same structure, so it can share the evaluator,
+        # the hash and the frozen copy; its values are evaluated again from
+        # the same lookup the first time update_variable is called on it
+        copied._compiled = self._compiled
+        copied._hash = self._hash
+        copied._frozen = self._frozen
+        copied._program = self._program
+        copied._propagator = self._propagator
+        if self._lookup is not None:
+            copied._lookup = dict(self._lookup)
+        return copied
+
+    def freeze(self) -> FrozenExprTree:
+        """
+        Return an immutable copy of this ExprTree.
+
+        Identical subtrees are made into one node of the frozen copy, which
+        they share, so it takes memory proportional to the number of
+        distinct subtrees. The frozen copy is cached, so freezing a tree
+        again before it is mutated takes O(1) time and returns the same
+        FrozenExprTree.
+
+        >>> exp_t = ExprTree('+', [ExprTree('a', []), ExprTree(3, [])])
+        >>> frozen = exp_t.freeze()
+        >>> frozen == exp_t
+        True
+        >>> exp_t.freeze() is frozen
+        True
+        >>> exp_t.substitute({'a': 1})
+        >>> print(frozen, exp_t.freeze())
+        (a + 3) (1 + 3)
+        >>> frozen = ExprTree('*', [ExprTree('+', [ExprTree('a', []), \
+                                                   ExprTree(6, [])]), \
+                                    ExprTree('+', [ExprTree('a', []), \
+                                                   ExprTree(6, [])])]).freeze()
+        >>> frozen._subtrees[0] is frozen._subtrees[1]
+        True
+        """
+        if self._frozen is None:
+            self._frozen = _share(self)
+        return self._frozen
 
     # Provided visualization code - see an example usage at the bottom
     # of this file in the __main__ block.
@@ -266,21 +1112,354 @@ class ExprTree:
         label_map, at_depth = maps
         # record all nodes at each depth and create
         # nodes (with unique names) and edges in the networkx graph g.
-        if depth not in at_depth:
-            at_depth[depth] = []
-        node_label = path + str(depth) + str(self._root)
-        at_depth[depth].append(node_label)
-        label_map[node_label] = str(self._root)
-        g.add_node(node_label)
-        i = 0
-        for c in self._subtrees:
-            # recursively call visualize on each subtree
-            c.visualize(g, (label_map, at_depth),
-                        path + str(i), depth + 1)
-            # connect self to each of its children in the graph
-            g.add_edge(node_label,
-                       path + str(i) + str(depth + 1) + str(c._root))
-            i += 1
+        # each entry holds a node, its path and depth, and its parent's label
+        to_visit = [(self, path, depth, None)]
+        while to_visit:
+            node, node_path, node_depth, parent_label = to_visit.pop()
+            if node_depth not in at_depth:
+                at_depth[node_depth] = []
+            node_label = node_path + str(node_depth) + str(node._root)
+            at_depth[node_depth].append(node_label)
+            label_map[node_label] = str(node._root)
+            g.add_node(node_label)
+            if parent_label is not None:
+                # connect the parent to this node in the graph
+                g.add_edge(parent_label, node_label)
+            for i in range(len(node._subtrees) - 1, -1, -1):
+                to_visit.append((node._subtrees[i], node_path + str(i),
+                                 node_depth + 1, node_label))
+
+
+class FrozenExprTree(ExprTree):
+    """
+    An immutable expression tree.
+
+    A FrozenExprTree supports every non-mutating ExprTree method. Since it
+    can never change, it is safely shared instead of copied: copy returns
+    the tree itself, and several puzzle states (or several frozen trees)
+    can reference the same nodes. Calling a mutating method raises a
+    FrozenExprTreeError; use substituted to get a new frozen tree, or thaw
+    to get a mutable copy.
+
+    A tree made by freeze is hash-consed: identical subtrees are one node,
+    so the tree is a directed acyclic graph with one node per distinct
+    subtree. eval and the evaluators built by compile and eval_batch
+    compute each distinct subtree once.
+
+    === Private Attributes ===
+    _nodes: The distinct nodes of this tree, each after its subtrees, or
+            None if they have not been found.
+    _shared: The cached result of _shared_program, or None if it has not
+             been computed.
+
+    === Representation Invariants ===
+    - _subtrees is a tuple of FrozenExprTrees.
+    """
+    _nodes: Optional[List[FrozenExprTree]] = None
+    _shared: Optional[Tuple[List[Tuple[int, Union[int, str]]],
+                            List[str]]] = None
+
+    def __init__(self, root: Optional[Union[str, int]],
+                 subtrees: List[FrozenExprTree]) -> None:
+        """Initialize a new FrozenExprTree with the given root value
+        and frozen subtrees.
+
+        The subtrees may be shared with other frozen trees, so they are not
+        given a parent.
+        """
+        ExprTree.__init__(self, root, [])
+        self._subtrees = tuple(subtrees)
+
+    def eval(self, lookup: Dict[str, int]) -> int:
+        """
+        Evaluate this expression tree and return the result, like
+        ExprTree.eval, but computing the value of each distinct node once,
+        however many nodes share it.
+
+        >>> shared = ExprTree('+', [ExprTree('a', []), ExprTree(6, [])])
+        >>> exp_t = ExprTree('*', [shared, shared.copy(), shared.copy()])
+        >>> exp_t.freeze().eval({'a': 1})
+        343
+        """
+        values = {}
+        for node in self._distinct_nodes():
+            root = node._root
+            if node._subtrees and root == OP_ADD:
+                value = sum(values[id(child)] for child in node._subtrees)
+            elif node._subtrees and root == OP_MULTIPLY:
+                value = prod(values[id(child)] for child in node._subtrees)
+            elif root is None:
+                value = 0
+            elif isinstance(root, str):
+                # an operator without subtrees evaluates to its identity
+                value = 0 if root == OP_ADD else 1 if root == OP_MULTIPLY \
+                    else lookup.get(root)
+            else:
+                value = root
+            values[id(node)] = value
+        return values[id(self)]
+
+    def preorder(self) -> Iterator[FrozenExprTree]:
+        """
+        Yield every distinct node of this tree, each before its subtrees,
+        like ExprTree.preorder, but a node shared by several nodes only
+        where it is first reached.
+
+        >>> shared = ExprTree('+', [ExprTree('a', []), ExprTree(6, [])])
+        >>> frozen = ExprTree('*', [shared, shared.copy()]).freeze()
+        >>> [node._root for node in frozen.preorder()]
+        ['*', '+', 'a', 6]
+        """
+        visited = set()
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            if id(node) not in visited:
+                visited.add(id(node))
+                yield node
+                to_visit.extend(reversed(node._subtrees))
+
+    def postorder(self) -> Iterator[FrozenExprTree]:
+        """
+        Yield every distinct node of this tree, each after its subtrees,
+        like ExprTree.postorder, but a node shared by several nodes only
+        where it is first reached.
+        """
+        yield from self._distinct_nodes()
+
+    def __str__(self) -> str:
+        """
+        Return a string representation of this expression tree, like
+        ExprTree.__str__, but printing a subtree shared by several nodes
+        only once and copying its text wherever else it appears.
+
+        >>> shared = ExprTree('+', [ExprTree('a', []), ExprTree(6, [])])
+        >>> print(ExprTree('*', [shared, shared.copy()]).freeze())
+        ((a + 6) * (a + 6))
+        """
+        return _text(self, self._shared_ids())
+
+    def _distinct_nodes(self) -> List[FrozenExprTree]:
+        """
+        Return the distinct nodes of this tree, each after its subtrees.
+        """
+        if self._nodes is None:
+            self._nodes = _distinct_postorder(self)
+        return self._nodes
+
+    def _shared_ids(self) -> Set[int]:
+        """
+        Return the ids of the nodes of this tree that are a subtree of
+        several of its nodes.
+        """
+        references = {}
+        for node in self._distinct_nodes():
+            for child in node._subtrees:
+                references[id(child)] = references.get(id(child), 0) + 1
+        return {node_id for node_id, count in references.items()
+                if count > 1}
+
+    def _shared_program(self) -> Tuple[List[Tuple[int, Union[int, str]]],
+                                       List[str]]:
+        """
+        Return the postfix program for this expression tree and the names of
+        the variables it reads, computing a subtree shared by several nodes
+        only once.
+
+        >>> frozen = ExprTree('*', [ExprTree('+', [ExprTree('a', []), \
+                                                   ExprTree(6, [])]), \
+                                    ExprTree('+', [ExprTree('a', []), \
+                                                   ExprTree(6, [])])]).freeze()
+        >>> frozen._shared_program()
+        ([(1, 0), (0, 6), (2, 2), (5, 0), (6, 0), (3, 2)], ['a'])
+        """
+        if self._shared is None:
+            self._shared = _emit_program(self, self._shared_ids())
+        return self._shared
+
+    def substitute(self, from_to: Dict[Union[str, int],
+                                       Union[str, int]]) -> None:
+        """
+        Raise a FrozenExprTreeError, since a frozen tree can not be changed.
+        """
+        raise FrozenExprTreeError
+
+    def append(self, child: ExprTree) -> None:
+        """
+        Raise a FrozenExprTreeError, since a frozen tree can not be changed.
+        """
+        raise FrozenExprTreeError
+
+    def eval_incremental(self, lookup: Dict[str, int]) -> int:
+        """
+        Raise a FrozenExprTreeError: incremental evaluation keeps state in
+        each node, which a shared frozen tree can not hold.
+        """
+        raise FrozenExprTreeError
+
+    def update_variable(self, variable: str, value: int) -> int:
+        """
+        Raise a FrozenExprTreeError: incremental evaluation keeps state in
+        each node, which a shared frozen tree can not hold.
+        """
+        raise FrozenExprTreeError
+
+    def copy(self) -> FrozenExprTree:
+        """
+        Return this FrozenExprTree, which is immutable and so can be shared.
+        """
+        return self
+
+    def freeze(self) -> FrozenExprTree:
+        """
+        Return this FrozenExprTree, which is already immutable.
+        """
+        return self
+
+    def thaw(self) -> ExprTree:
+        """
+        Return a mutable copy of this FrozenExprTree.
+
+        >>> exp_t = ExprTree('+', [ExprTree('a', []), ExprTree(3, [])])
+        >>> thawed = exp_t.freeze().thaw()
+        >>> thawed.append(ExprTree(5, []))
+        >>> print(exp_t, thawed)
+        (a + 3) (a + 3 + 5)
+        """
+        thawed = _rebuild(self, ExprTree)
+        thawed._frozen = self
+        return thawed
+
+    def substituted(self, from_to: Dict[Union[str, int],
+                                        Union[str, int]]) -> FrozenExprTree:
+        """
+        Return a FrozenExprTree equal to this tree after substituting
+        <from_to> into it, as ExprTree.substitute would.
+
+        Only the nodes on the paths from the replaced values up to the root
+        are copied: every subtree in which nothing is replaced is shared
+        with this tree.
+
+        >>> frozen = ExprTree('+', [ExprTree('a', []), \
+                                    ExprTree('*', [ExprTree('b', []), \
+                                                   ExprTree(3, [])])]).freeze()
+        >>> changed = frozen.substituted({'a': 2})
+        >>> print(frozen, changed)
+        (a + (b * 3)) (2 + (b * 3))
+        >>> changed._subtrees[1] is frozen._subtrees[1]
+        True
+        """
+        # frozen subtrees may be shared, so each is only rebuilt once
+        done = {}
+        results = []
+        to_visit = [(self, False)]
+        while to_visit:
+            node, expanded = to_visit.pop()
+            if id(node) in done:
+                results.append(done[id(node)])
+                continue
+            if node._subtrees and not expanded:
+                to_visit.append((node, True))
+                for child in reversed(node._subtrees):
+                    to_visit.append((child, False))
+                continue
+            subtrees = results[len(results) - len(node._subtrees):]
+            del results[len(results) - len(node._subtrees):]
+            if not node.is_empty() and node._root in from_to:
+                new_node = FrozenExprTree(from_to.get(node._root), subtrees)
+            elif any(new is not old
+                     for new, old in zip(subtrees, node._subtrees)):
+                new_node = FrozenExprTree(node._root, subtrees)
+            else:
+                new_node = node
+            done[id(node)] = new_node
+            results.append(new_node)
+        return results[0]
+
+
+class FrozenExprTreeError(Exception):
+    """Exception raised when trying to mutate a FrozenExprTree."""
+
+    def __str__(self) -> str:
+        """Return a string representation of this error."""
+        return 'You tried to mutate a frozen expression tree.'
+
+
+class PolynomialTooLargeError(Exception):
+    """Exception raised when the polynomial of an expression tree has more
+    terms than allowed.
+
+    === Attributes ===
+    max_terms: The number of terms allowed.
+    """
+    max_terms: int
+
+    def __init__(self, max_terms: int) -> None:
+        """Initialize a new PolynomialTooLargeError."""
+        super().__init__(max_terms)
+        self.max_terms = max_terms
+
+    def __str__(self) -> str:
+        """Return a string representation of this error."""
+        return 'The polynomial of the expression tree has more than ' \
+               f'{self.max_terms} terms.'
+
+
+def _share(tree: ExprTree) -> FrozenExprTree:
+    """
+    Return a frozen copy of <tree> in which identical subtrees are one node,
+    shared by every node they are a subtree of.
+
+    A node of <tree> that is already shared is only copied once, so this
+    takes time proportional to the number of distinct nodes of <tree>.
+    """
+    # the node made for each distinct subtree, by its root and the ids of
+    # the nodes made for its subtrees
+    made = {}
+    # the node made for each node of tree, by its id
+    copies = {}
+    for node in _distinct_postorder(tree):
+        subtrees = [copies[id(child)] for child in node._subtrees]
+        key = (node._root, tuple(id(subtree) for subtree in subtrees))
+        if key not in made:
+            made[key] = FrozenExprTree(node._root, subtrees)
+        copies[id(node)] = made[key]
+    return copies[id(tree)]
+
+
+def _distinct_postorder(tree: ExprTree) -> List[ExprTree]:
+    """
+    Return the nodes of <tree>, each after its subtrees, with each node
+    that is a subtree of several nodes only listed once.
+    """
+    nodes = []
+    visited = set()
+    to_visit = [(tree, False)]
+    while to_visit:
+        node, expanded = to_visit.pop()
+        if expanded:
+            nodes.append(node)
+        elif id(node) not in visited:
+            visited.add(id(node))
+            to_visit.append((node, True))
+            for child in reversed(node._subtrees):
+                to_visit.append((child, False))
+    return nodes
+
+
+def _rebuild(tree: ExprTree, cls: type) -> ExprTree:
+    """
+    Return a copy of <tree> made of new nodes of class <cls>, which is
+    ExprTree or FrozenExprTree.
+    """
+    results = []
+    # every node of a FrozenExprTree, with a shared node once per reference
+    for node in ExprTree.postorder(tree):
+        count = len(node._subtrees)
+        subtrees = results[len(results) - count:]
+        del results[len(results) - count:]
+        results.append(cls(node._root, subtrees))
+    return results[0]
 
 
 def construct_from_list(values: List[List[Union[str, int]]]) -> ExprTree:
@@ -293,6 +1472,8 @@ def construct_from_list(values: List[List[Union[str, int]]]) -> ExprTree:
     Hint: We have provided you with the helper method ExprTree.append
           You will likely want to use this method.
 
+    <values> is not modified.
+
     Precondition:
     <values> encodes a valid expression tree
 
@@ -310,21 +1491,1153 @@ def construct_from_list(values: List[List[Union[str, int]]]) -> ExprTree:
     >>> subtrees = [ExprTree(3, []), ExprTree('a', [])]
     >>> exp_t == ExprTree('+', subtrees)
     True
+    >>> example
+    [['+'], [3, 'a']]
+    """
+    return build_from_rows(values)
+
+
+def build_from_rows(rows: Iterable[List[Union[str, int]]]) -> ExprTree:
     """
-    if not values:
+    Construct an expression tree from <rows>, in the encoding used by
+    construct_from_list.
+
+    The first row holds the root, and each later row holds the subtrees of
+    the next operator in level order, i.e. of the operators of the earlier
+    rows from top to bottom and left to right. <rows> may be any iterable,
+    such as a generator reading rows from a file: it is consumed once, in
+    O(n) time, and apart from the tree itself only the operators still
+    waiting for their subtrees are kept, so the extra memory is bounded by
+    the widest level of the tree.
+
+    Raise a ValueError if there are more rows than operators.
+
+    Precondition:
+    <rows> encodes a valid expression tree
+
+    >>> rows = iter([['+'], [3, '*', 'a', '+'], ['a', 'b'], [5, 'c']])
+    >>> print(build_from_rows(rows))
+    (3 + (a * b) + a + (5 + c))
+    >>> print(build_from_rows([]))
+    ()
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if not first:
         return ExprTree(None, [])
-    elif len(values) == 1:
-        return ExprTree(values[0][0], [])
-    for i in range(len(values) - 1, -1, -1):
-        for j in range(len(values[i]) - 1, -1, -1):
-            if values[i][j] in OPERATORS:
-                new_subtrees = values.pop()
-                new_tree = ExprTree(values[i][j], [])
-                new_tree.append_multi(new_subtrees)
-                values[i][j] = new_tree
+    root = ExprTree(first[0], [])
+    # the operators whose row of subtrees has not been read yet
+    waiting = deque()
+    if root._root in OPERATORS:
+        waiting.append(root)
+    with _gc_paused():
+        for i, row in enumerate(rows, 1):
+            if not waiting:
+                raise ValueError(f'row {i} has no operator to belong to')
+            parent = waiting.popleft()
+            for value in row:
+                child = ExprTree(value, [])
+                # parent is new, so it has no cached values to invalidate
+                child._parent = parent
+                parent._subtrees.append(child)
+                if value in OPERATORS:
+                    waiting.append(child)
+    return root
+
+
+def parse_expr(text: str) -> ExprTree:
+    """
+    Return the expression tree whose string representation is <text>, so
+    that parse_expr(str(tree)) == tree.
+
+    A token made of digits, with an optional leading '-', is read as an int
+    and any other value as a variable. Since a single subtree in parentheses
+    does not show its operator, it is read as a sum, which has the same
+    value. The text is read in one pass without recursion, so there is no
+    limit on how deeply it may be nested.
+
+    Raise an ExprParseError, giving the position of the offending character,
+    if <text> is not the string representation of an expression tree,
+    including when an operator is not one of OPERATORS, or one of them is
+    where a value should be.
+
+    Precondition:
+    No operator in the tree of <text> has an empty list of subtrees, and no
+    value contains whitespace or parentheses.
+
+    >>> print(parse_expr('((7 * (6 + 6)) + 5)'))
+    ((7 * (6 + 6)) + 5)
+    >>> parse_expr('(x + -3)') == ExprTree('+', [ExprTree('x', []), \
+                                                 ExprTree(-3, [])])
+    True
+    >>> parse_expr('()').is_empty()
+    True
+    >>> parse_expr('(3 + (a * 2)')
+    Traceback (most recent call last):
+    ...
+    expression_tree.ExprParseError: unexpected end of text at position 12
+    >>> parse_expr('(1 - 2)')
+    Traceback (most recent call last):
+    ...
+    expression_tree.ExprParseError: expected an operator, not '-' at \
+position 3
+    """
+    # the operator and subtrees of each group whose ')' is not yet read,
+    # with the innermost one in group; an operator is None until it is read
+    groups = []
+    group = None
+    tree = None
+    expect_value = True
+    error = None
+    # the root of the leaf node for each token read so far
+    leaves = {}
+    # splitting on whitespace is much faster than matching _TOKEN, so the
+    # position of a token is only worked out if it is an error
+    tokens = text.replace('(', ' ( ').replace(')', ' ) ').split()
+    with _gc_paused():
+        for i, token in enumerate(tokens):
+            if tree is not None:
+                error = f'unexpected {token!r} after the end of the expression'
+            elif expect_value:
+                if token == '(':
+                    groups.append(group)
+                    group = [None, []]
+                    continue
+                elif token in OPERATORS:
+                    error = f'expected a value, not {token!r}'
+                elif token != ')':
+                    if token not in leaves:
+                        leaves[token] = int(token) \
+                            if _INTEGER.fullmatch(token) else token
+                    node = ExprTree(leaves[token], [])
+                elif group is not None and group[0] is None and not group[1]:
+                    group = groups.pop()
+                    node = ExprTree(None, [])
+                else:
+                    error = "expected a value, not ')'"
+            elif token == ')':
+                node = ExprTree(group[0] or OP_ADD, group[1])
+                group = groups.pop()
+            elif token not in OPERATORS:
+                error = f'expected an operator, not {token!r}'
+            elif group[0] is None or group[0] == token:
+                group[0] = token
+                expect_value = True
+                continue
+            else:
+                error = f'expected {group[0]!r}, not {token!r}'
+            if error is not None:
+                raise ExprParseError(error, _token_position(text, i))
+            if group is not None:
+                group[1].append(node)
+                expect_value = False
+            else:
+                tree = node
+    if tree is None:
+        raise ExprParseError('unexpected end of text', len(text))
+    return tree
+
+
+def _token_position(text: str, index: int) -> int:
+    """
+    Return the position in <text> of the token at <index> in the list of
+    its tokens.
+    """
+    for i, match in enumerate(_TOKEN.finditer(text)):
+        if i == index:
+            return match.start()
+    return len(text)
+
+
+def parse_many(lines: Iterable[str]) -> Iterator[ExprTree]:
+    """
+    Yield the expression tree parsed from each line of <lines> that is not
+    blank, in order.
+
+    <lines> may be an open text file, which is then read one line at a time
+    as the trees are consumed, rather than all at once.
+
+    Raise an ExprParseError, giving the line number as well as the position
+    in that line, on the first line that parse_expr cannot parse.
+
+    >>> [str(tree) for tree in parse_many(['(a + 1)\\n', '\\n', '5\\n'])]
+    ['(a + 1)', '5']
+    """
+    for line_number, line in enumerate(lines, 1):
+        if line.isspace() or not line:
+            continue
+        try:
+            yield parse_expr(line)
+        except ExprParseError as error:
+            raise ExprParseError(error.message, error.position,
+                                 line_number) from None
+
+
+class ExprParseError(Exception):
+    """Exception raised when parsing text that does not represent an
+    expression tree.
+
+    === Attributes ===
+    message: What was wrong with the text.
+    position: The index in the text where the problem was found.
+    line: The number of the line of the text, counting from 1, or None if
+        the text was a single expression.
+    """
+    message: str
+    position: int
+    line: Optional[int]
+
+    def __init__(self, message: str, position: int,
+                 line: Optional[int] = None) -> None:
+        """Initialize a new ExprParseError."""
+        super().__init__(message, position, line)
+        self.message = message
+        self.position = position
+        self.line = line
+
+    def __str__(self) -> str:
+        """Return a string representation of this error."""
+        if self.line is None:
+            return f'{self.message} at position {self.position}'
+        return f'{self.message} at line {self.line}, position ' \
+               f'{self.position}'
+
+
+def from_polynomial(polynomial: Dict[Tuple[Tuple[str, int], ...], int],
+                    horner: bool = False) -> ExprTree:
+    """
+    Return an expression tree that computes <polynomial>, a map from
+    monomials to coefficients as returned by ExprTree.to_polynomial.
+
+    The tree is the sum of the terms in order of their monomials, with the
+    constant term last, and each term is the product of its variables, each
+    repeated as many times as its exponent, and then its coefficient unless
+    it is 1. The tree only depends on the polynomial, so trees with the
+    same value for every lookup give equal trees.
+
+    If <horner>, the tree is in Horner form instead: with x the first
+    variable by name, it is P0 + x * (P1 + x * (P2 + ...)), where each Pk is
+    the polynomial, in Horner form itself, multiplying x to the power k.
+    This multiplies by each variable far fewer times than the sum of terms.
+
+    The coefficients may be greater than 9, and the zero polynomial gives
+    an empty tree.
+
+    >>> polynomial = {(('a', 1),): 2, (('a', 1), ('b', 1)): 1, \
+(('a', 2),): 1, (('b', 1),): 2, (): 3}
+    >>> print(from_polynomial(polynomial))
+    ((a * 2) + (a * b) + (a * a) + (b * 2) + 3)
+    >>> print(from_polynomial(polynomial, True))
+    (3 + (b * 2) + (a * (2 + b + a)))
+    """
+    if not polynomial:
+        return ExprTree(None, [])
+    if horner:
+        return _horner(polynomial)
+    terms = []
+    for monomial in sorted(polynomial, key=lambda item: (not item, item)):
+        factors = [ExprTree(variable, [])
+                   for variable, exponent in monomial
+                   for _ in range(exponent)]
+        if polynomial[monomial] != 1 or not factors:
+            factors.append(ExprTree(polynomial[monomial], []))
+        terms.append(_join(OP_MULTIPLY, factors))
+    return _join(OP_ADD, terms)
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    """
+    Pause the cyclic garbage collector for the body of the with statement.
+
+    Every ExprTree node is part of a reference cycle through its parent, so
+    while a large tree is being built the collector would rescan all of its
+    nodes every few hundred new ones, although none of them can be garbage
+    yet.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def _emit_program(tree: ExprTree, shared: Set[int]) \
+        -> Tuple[List[Tuple[int, Union[int, str]]], List[str]]:
+    """
+    Helper for ExprTree._postfix_program and FrozenExprTree._shared_program.
+
+    Return the postfix program for <tree> and the names of the variables it
+    reads, in slot order. An operator node whose id is in <shared> is
+    computed where it is first reached and its value kept with SAVE_SHARED,
+    and it is pushed with LOAD_SHARED wherever it is reached again.
+    """
+    program = []
+    emit = program.append
+    slots = {}
+    # the number of the store of each shared node computed so far, by its id
+    stores = {}
+    # explicit stack of (node, number of subtrees emitted or None) pairs, so
+    # that very deep trees can be compiled too
+    to_visit = [(tree, None)]
+    visit = to_visit.append
+    while to_visit:
+        node, count = to_visit.pop()
+        root = node._root
+        if count is not None:
+            emit((APPLY_ADD if root == OP_ADD else APPLY_MULTIPLY, count))
+            if shared and id(node) in shared:
+                stores[id(node)] = len(stores)
+                emit((SAVE_SHARED, stores[id(node)]))
+        elif root is None:
+            emit((PUSH_CONST, 0))
+        elif stores and id(node) in stores:
+            emit((LOAD_SHARED, stores[id(node)]))
+        elif root == OP_ADD or root == OP_MULTIPLY:
+            children = [c for c in reversed(node._subtrees) if c is not None]
+            visit((node, len(children)))
+            for child in children:
+                visit((child, None))
+        elif isinstance(root, str):
+            if root not in slots:
+                slots[root] = len(slots)
+            emit((PUSH_VAR, slots[root]))
+        else:
+            emit((PUSH_CONST, root))
+    return program, list(slots)
+
+
+def _text(tree: ExprTree, shared: Set[int]) -> str:
+    """
+    Helper for ExprTree.__str__ and FrozenExprTree.__str__.
+
+    Return the string representation of <tree>. The text of an operator
+    node whose id is in <shared> is kept where it is first printed, and
+    reused wherever the node is reached again.
+    """
+    pieces = []
+    # the text of each shared node printed so far, by its id
+    texts = {}
+    # holds the subtrees still to print, the text between them, and the
+    # (id, index in pieces) of each shared node whose text ends there
+    to_print = [tree]
+    while to_print:
+        item = to_print.pop()
+        if isinstance(item, str):
+            pieces.append(item)
+        elif isinstance(item, tuple):
+            node_id, start = item
+            texts[node_id] = ''.join(pieces[start:])
+            pieces[start:] = [texts[node_id]]
+        elif id(item) in texts:
+            pieces.append(texts[id(item)])
+        elif item.is_empty():
+            pieces.append('()')
+        elif item._root not in OPERATORS:
+            pieces.append(str(item._root))
+        elif not item._subtrees:
+            pieces.append(')')
+        else:
+            if id(item) in shared:
+                to_print.append((id(item), len(pieces)))
+            separator = ' ' + item._root + ' '
+            to_print.append(')')
+            for subtree in reversed(item._subtrees):
+                to_print.append(subtree)
+                to_print.append(separator)
+            # the first subtree is preceded by '(', not a separator
+            to_print[-1] = '('
+    return ''.join(pieces)
+
+
+def _postfix_bound(program: List[Tuple[int, Union[int, str]]],
+                   maxima: List[int]) -> int:
+    """
+    Helper for ExprTree.eval_batch.
+
+    Return an upper bound on the absolute value of postfix <program>, given
+    that the absolute value of the variable in each slot is at most the
+    corresponding entry of <maxima>.
+
+    >>> _postfix_bound([(1, 0), (0, -2), (3, 2)], [5])
+    10
+    """
+    stack = []
+    stores = {}
+    for opcode, arg in program:
+        if opcode == PUSH_CONST:
+            stack.append(abs(arg))
+        elif opcode == PUSH_VAR:
+            stack.append(maxima[arg])
+        elif opcode == SAVE_SHARED:
+            stores[arg] = stack[-1]
+        elif opcode == LOAD_SHARED:
+            stack.append(stores[arg])
+        else:
+            operands = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            bound = 0 if opcode == APPLY_ADD else 1
+            for operand in operands:
+                bound = bound + operand if opcode == APPLY_ADD \
+                    else bound * operand
+            stack.append(bound)
+    return stack[-1]
+
+
+class _BoundsPropagator:
+    """
+    The bounds propagation of ExprTree.narrow_domains over one postfix
+    program.
+
+    The shape of the program is worked out once, and the lists of ranges
+    are reused by every call of narrow, so a call allocates nothing that
+    grows with the size of the tree. A subtree that the program stores and
+    loads again is one instruction, which is an operand of each instruction
+    it is loaded for, and must be in the range each of them wants.
+
+    === Attributes ===
+    opcodes: The opcode of each instruction of the program, leaving out
+             those that store and load shared subtrees.
+    args: The argument of each instruction.
+    children: The indices of the instructions that compute the operands of
+              each instruction, which are empty for non-operators.
+    lows, highs: The range of values of the subtree of each instruction.
+    want_lows, want_highs: The range that the value of the subtree of each
+                           instruction must be in to reach the target.
+    """
+    opcodes: List[int]
+    args: List[Union[int, str]]
+    children: List[Tuple[int, ...]]
+    lows: List[int]
+    highs: List[int]
+    want_lows: List[int]
+    want_highs: List[int]
+
+    def __init__(self, program: List[Tuple[int, Union[int, str]]]) -> None:
+        """Initialize a new _BoundsPropagator for <program>."""
+        self.opcodes = []
+        self.args = []
+        self.children = []
+        pending = []
+        # the instruction kept in each store
+        stores = {}
+        for opcode, arg in program:
+            if opcode == SAVE_SHARED:
+                stores[arg] = pending[-1]
+                continue
+            if opcode == LOAD_SHARED:
+                pending.append(stores[arg])
+                continue
+            if opcode in (APPLY_ADD, APPLY_MULTIPLY) and arg:
+                self.children.append(tuple(pending[len(pending) - arg:]))
+                del pending[len(pending) - arg:]
+            else:
+                self.children.append(())
+            pending.append(len(self.opcodes))
+            self.opcodes.append(opcode)
+            self.args.append(arg)
+        n = len(self.opcodes)
+        self.lows = [0] * n
+        self.highs = [0] * n
+        self.want_lows = [0] * n
+        self.want_highs = [0] * n
+
+    def narrow(self, domain_lows: List[int], domain_highs: List[int],
+               target: int) -> bool:
+        """
+        Narrow the range [domain_lows[slot], domain_highs[slot]] of each
+        variable slot of the program, in place, to the values that may make
+        it evaluate to <target>. Return whether every range is still
+        non-empty.
+        """
+        opcodes = self.opcodes
+        args = self.args
+        children = self.children
+        lows = self.lows
+        highs = self.highs
+        want_lows = self.want_lows
+        want_highs = self.want_highs
+        n = len(opcodes)
+        while True:
+            # bottom up: the range of values of each subtree
+            for i in range(n):
+                opcode = opcodes[i]
+                if opcode == PUSH_CONST:
+                    lows[i] = highs[i] = args[i]
+                elif opcode == PUSH_VAR:
+                    lows[i] = domain_lows[args[i]]
+                    highs[i] = domain_highs[args[i]]
+                elif opcode == APPLY_ADD:
+                    low = high = 0
+                    for c in children[i]:
+                        low += lows[c]
+                        high += highs[c]
+                    lows[i] = low
+                    highs[i] = high
+                else:
+                    low = high = 1
+                    for c in children[i]:
+                        products = (low * lows[c], low * highs[c],
+                                    high * lows[c], high * highs[c])
+                        low = min(products)
+                        high = max(products)
+                    lows[i] = low
+                    highs[i] = high
+
+            # top down: the range each subtree must be in to reach the target,
+            # within that of each node it is an operand of
+            want_lows[:] = lows
+            want_highs[:] = highs
+            want_lows[-1] = want_highs[-1] = target
+            changed = False
+            for i in range(n - 1, -1, -1):
+                low = max(want_lows[i], lows[i])
+                high = min(want_highs[i], highs[i])
+                if low > high:
+                    return False
+                opcode = opcodes[i]
+                if opcode == PUSH_VAR:
+                    slot = args[i]
+                    if low > domain_lows[slot] or high < domain_highs[slot]:
+                        domain_lows[slot] = max(domain_lows[slot], low)
+                        domain_highs[slot] = min(domain_highs[slot], high)
+                        if domain_lows[slot] > domain_highs[slot]:
+                            return False
+                        changed = True
+                elif opcode == APPLY_ADD:
+                    for c in children[i]:
+                        # the other children add up to between
+                        # lows[i] - lows[c] and highs[i] - highs[c]
+                        want_lows[c] = max(want_lows[c],
+                                           low - (highs[i] - highs[c]))
+                        want_highs[c] = min(want_highs[c],
+                                            high - (lows[i] - lows[c]))
+                elif opcode == APPLY_MULTIPLY:
+                    positive = True
+                    for c in children[i]:
+                        if lows[c] < 1:
+                            positive = False
+                    for c in children[i]:
+                        if positive:
+                            # the other children multiply to between
+                            # lows[i] // lows[c] and highs[i] // highs[c]
+                            want_lows[c] = max(
+                                want_lows[c],
+                                -(-low // (highs[i] // highs[c])))
+                            want_highs[c] = min(
+                                want_highs[c], high // (lows[i] // lows[c]))
+            if not changed:
+                return True
+
+
+class _ValueSets:
+    """
+    The sets of values that the subtrees of an expression tree can reach,
+    for ExprTree.find_assignment.
+
+    Only the values up to a limit are kept in a set. The limit of a subtree
+    is lowered by the smallest values its siblings can take, since every
+    value is at least 1 and so a sum or product only grows with each of its
+    operands.
+
+    === Attributes ===
+    domains: The range of values of each variable.
+    variables: The variables of each subtree, by the id of the subtree.
+    lowest: The smallest value of each subtree, by the id of the subtree.
+    known: The sets of values already found, by the id of the subtree, the
+           values of its variables that were fixed and the limit.
+    """
+    domains: Dict[str, Tuple[int, int]]
+    variables: Dict[int, frozenset]
+    lowest: Dict[int, int]
+    known: Dict[Tuple[int, Tuple[Tuple[str, int], ...], int], Set[int]]
+
+    def __init__(self, tree: ExprTree,
+                 domains: Dict[str, Tuple[int, int]]) -> None:
+        """
+        Initialize the value sets of the subtrees of <tree>, for variables
+        in <domains>.
+
+        Raise a ValueError if a subtree may have a value less than 1.
+        """
+        self.domains = domains
+        self.variables = {}
+        self.lowest = {}
+        self.known = {}
+        if tree.is_empty():
+            raise ValueError('an empty tree has the value 0')
+        for node in tree.postorder():
+            root = node._root
+            if _is_operator(node):
+                children = [id(child) for child in node._subtrees]
+                self.variables[id(node)] = frozenset().union(
+                    *[self.variables[child] for child in children])
+                lowest = [self.lowest[child] for child in children]
+                self.lowest[id(node)] = sum(lowest) if root == OP_ADD \
+                    else prod(lowest)
+            elif root in OPERATORS:
+                raise ValueError(f'operator {root} has no subtrees')
+            elif isinstance(root, str):
+                low = domains[root][0] if root in domains else 1
+                if low < 1:
+                    raise ValueError(f'the range of {root} reaches below 1')
+                self.variables[id(node)] = frozenset((root,))
+                self.lowest[id(node)] = low
+            elif root < 1:
+                raise ValueError(f'constant {root} is less than 1')
+            else:
+                self.variables[id(node)] = frozenset()
+                self.lowest[id(node)] = root
+
+    def values(self, node: ExprTree, fixed: Dict[str, int],
+               limit: int) -> Set[int]:
+        """
+        Return the set of values up to <limit> that <node> can reach, where
+        the variables in <fixed> take the values it gives them.
+        """
+        if not _is_operator(node):
+            root = node._root
+            if not isinstance(root, str):
+                return {root} if root <= limit else set()
+            elif root in fixed:
+                return {fixed[root]} if fixed[root] <= limit else set()
+            low, high = self.domains[root]
+            return set(range(low, min(high, limit) + 1))
+        # the set only depends on the fixed values of variables of node
+        key = (id(node), tuple(sorted(
+            (name, value) for name, value in fixed.items()
+            if name in self.variables[id(node)])), limit)
+        if key not in self.known:
+            reachable = set()
+            for shared in self._shared_assignments(node, fixed, limit):
+                child_sets, prefixes = self._combine(node, shared, limit)
+                reachable |= _apply(node._root, prefixes[-1], child_sets[-1],
+                                    limit)
+            self.known[key] = reachable
+        return self.known[key]
+
+    def assign(self, node: ExprTree, value: int, fixed: Dict[str, int],
+               assignment: Dict[str, int]) -> bool:
+        """
+        Add to <assignment> values for the variables of <node> that are not
+        in <fixed>, which make <node> evaluate to <value>, and return True,
+        or return False if <node> cannot reach <value>.
+        """
+        if not _is_operator(node):
+            if value not in self.values(node, fixed, value):
+                return False
+            if isinstance(node._root, str) and node._root not in fixed:
+                assignment[node._root] = value
+            return True
+        for shared in self._shared_assignments(node, fixed, value):
+            child_sets, prefixes = self._combine(node, shared, value, True)
+            # split value between each child, from the last, and the ones
+            # before it
+            values = []
+            for i in range(len(child_sets) - 1, -1, -1):
+                for child_value in sorted(child_sets[i]):
+                    rest = _unapply(node._root, value, child_value)
+                    if rest is not None and rest in prefixes[i]:
+                        break
+                else:
+                    break
+                values.append(child_value)
+                value = rest
+            else:
+                assignment.update(shared)
+                for child, child_value in zip(reversed(node._subtrees),
+                                              values):
+                    self.assign(child, child_value, shared, assignment)
+                return True
+        return False
+
+    def _shared_assignments(self, node: ExprTree, fixed: Dict[str, int],
+                            limit: int) -> Iterator[Dict[str, int]]:
+        """
+        Yield <fixed> extended with each assignment of values up to <limit>
+        to the variables not in <fixed> that more than one subtree of <node>
+        has.
+        """
+        seen = set()
+        shared = set()
+        for child in node._subtrees:
+            variables = self.variables[id(child)]
+            shared |= seen & variables
+            seen |= variables
+        shared = sorted(shared - fixed.keys())
+        ranges = [range(self.domains[name][0],
+                        min(self.domains[name][1], limit) + 1)
+                  for name in shared]
+        for values in itertools.product(*ranges):
+            extended = dict(fixed)
+            extended.update(zip(shared, values))
+            yield extended
+
+    def _combine(self, node: ExprTree, fixed: Dict[str, int], limit: int,
+                 exact: bool = False) -> Tuple[List[Set[int]], List[Set[int]]]:
+        """
+        Return the sets of values up to <limit> of the subtrees of operator
+        <node>, where the variables in <fixed> take the values it gives them
+        and the subtrees share no other variables, and the sets of values of
+        the first 0, 1, 2, ... of them but the last combined by the
+        operator.
+
+        If <exact>, the sets only keep the values that may combine to
+        exactly <limit>, which for a * node are the divisors of <limit>.
+        """
+        child_sets = [self.values(child, fixed, child_limit)
+                      for child, child_limit in zip(node._subtrees,
+                                                    self._limits(node, limit))]
+        divisors = exact and node._root == OP_MULTIPLY
+        if divisors:
+            child_sets = [{value for value in child_set if not limit % value}
+                          for child_set in child_sets]
+        prefixes = [{0 if node._root == OP_ADD else 1}]
+        for child_set in child_sets[:-1]:
+            prefix = _apply(node._root, prefixes[-1], child_set, limit)
+            if divisors:
+                prefix = {value for value in prefix if not limit % value}
+            prefixes.append(prefix)
+        return child_sets, prefixes
+
+    def _limits(self, node: ExprTree, limit: int) -> List[int]:
+        """
+        Return the limit of each subtree of operator <node>, for a value of
+        <node> up to <limit>.
+        """
+        lowest = [self.lowest[id(child)] for child in node._subtrees]
+        if node._root == OP_ADD:
+            total = sum(lowest)
+            return [limit - total + low for low in lowest]
+        total = prod(lowest)
+        return [limit // (total // low) for low in lowest]
+
+
+class _ValueCounts(_ValueSets):
+    """
+    The number of ways that the subtrees of an expression tree can reach
+    each of their values, for ExprTree.count_assignments.
+
+    The counts of a subtree are kept in a histogram, a dict from each value
+    up to a limit to the number of assignments of values to the variables
+    of the subtree that make it evaluate to that value.
+
+    === Attributes ===
+    counted: The histograms already found, by the id of the subtree, the
+             values of its variables that were fixed and the limit.
+    """
+    counted: Dict[Tuple[int, Tuple[Tuple[str, int], ...], int],
+                  Dict[int, int]]
+
+    def __init__(self, tree: ExprTree,
+                 domains: Dict[str, Tuple[int, int]]) -> None:
+        """
+        Initialize the histograms of the subtrees of <tree>, for variables
+        in <domains>.
+
+        Raise a ValueError if a subtree may have a value less than 1.
+        """
+        _ValueSets.__init__(self, tree, domains)
+        self.counted = {}
+
+    def counts(self, node: ExprTree, fixed: Dict[str, int],
+               limit: int) -> Dict[int, int]:
+        """
+        Return the histogram of the values up to <limit> that <node> can
+        reach, counting the assignments of values to its variables that are
+        not in <fixed>, where those in <fixed> take the values it gives
+        them.
+        """
+        if not _is_operator(node):
+            return dict.fromkeys(self.values(node, fixed, limit), 1)
+        # the histogram only depends on the fixed values of variables of node
+        key = (id(node), tuple(sorted(
+            (name, value) for name, value in fixed.items()
+            if name in self.variables[id(node)])), limit)
+        if key not in self.counted:
+            histogram = {}
+            for shared in self._shared_assignments(node, fixed, limit):
+                combined = {0 if node._root == OP_ADD else 1: 1}
+                for child, child_limit in zip(node._subtrees,
+                                              self._limits(node, limit)):
+                    combined = _convolve(node._root, combined,
+                                         self.counts(child, shared,
+                                                     child_limit), limit)
+                for value, count in combined.items():
+                    histogram[value] = histogram.get(value, 0) + count
+            self.counted[key] = histogram
+        return self.counted[key]
+
+    def count(self, node: ExprTree, value: int,
+              fixed: Dict[str, int]) -> int:
+        """
+        Return the number of assignments of values to the variables of
+        <node> that are not in <fixed> which make <node> evaluate to
+        <value>, where those in <fixed> take the values it gives them.
+        """
+        if not _is_operator(node):
+            return self.counts(node, fixed, value).get(value, 0)
+        divisors = node._root == OP_MULTIPLY
+        total = 0
+        for shared in self._shared_assignments(node, fixed, value):
+            histograms = [self.counts(child, shared, child_limit)
+                          for child, child_limit in zip(
+                              node._subtrees, self._limits(node, value))]
+            if divisors:
+                histograms = [{child_value: count for child_value, count
+                               in histogram.items() if not value % child_value}
+                              for histogram in histograms]
+            prefix = {0 if node._root == OP_ADD else 1: 1}
+            for histogram in histograms[:-1]:
+                prefix = _convolve(node._root, prefix, histogram, value)
+            # only the values of the last child that complete a prefix to
+            # exactly value are counted
+            for child_value, count in histograms[-1].items():
+                rest = _unapply(node._root, value, child_value)
+                if rest is not None and rest in prefix:
+                    total += count * prefix[rest]
+        return total
+
+
+def _apply(operator: str, values: Set[int], others: Set[int],
+           limit: int) -> Set[int]:
+    """
+    Return the sums, if <operator> is OP_ADD, or else the products, of a
+    value in <values> and one in <others>, up to <limit>.
+
+    >>> sorted(_apply(OP_MULTIPLY, {1, 2, 3}, {4, 5}, 10))
+    [4, 5, 8, 10]
+    """
+    combined = set()
+    others = sorted(others)
+    for value in values:
+        if operator == OP_ADD:
+            end = bisect_right(others, limit - value)
+            combined.update([value + other for other in others[:end]])
+        else:
+            end = bisect_right(others, limit // value)
+            combined.update([value * other for other in others[:end]])
+    return combined
+
+
+def _fold(operator: str, operands: List[ExprTree], keys: Dict[int, tuple],
+          cls: type) -> ExprTree:
+    """
+    Helper for ExprTree.simplify.
+
+    Return the simplified tree, made of nodes of class <cls>, for
+    <operator> applied to the simplified trees <operands>, whose sort keys
+    are in <keys> by their ids, and add the key of the tree returned to
+    <keys>.
+    """
+    others = []
+    identity = 0 if operator == OP_ADD else 1
+    constant = identity
+    for operand in operands:
+        merged = operand._subtrees \
+            if operand._subtrees and operand._root == operator else [operand]
+        for item in merged:
+            if item._subtrees or not isinstance(item._root, int):
+                others.append(item)
+            elif operator == OP_ADD:
+                constant += item._root
+            else:
+                constant *= item._root
+    others.sort(key=lambda item: keys[id(item)])
+    if constant != identity or not others:
+        others.append(cls(constant, []))
+        keys[id(others[-1])] = (2, constant)
+    if len(others) == 1:
+        return others[0]
+    tree = cls(operator, others)
+    keys[id(tree)] = (1, operator, tuple(keys[id(item)] for item in others))
+    return tree
+
+
+def _add_polynomials(polynomials: List[Dict[Tuple[Tuple[str, int], ...],
+                                            int]]) \
+        -> Dict[Tuple[Tuple[str, int], ...], int]:
+    """
+    Return the sum of <polynomials>, as maps from monomials to coefficients.
+
+    >>> _add_polynomials([{(('a', 1),): 1, (): 2}, {(): 3}])
+    {(('a', 1),): 1, (): 5}
+    """
+    total = {}
+    for polynomial in polynomials:
+        for monomial, coefficient in polynomial.items():
+            total[monomial] = total.get(monomial, 0) + coefficient
+    return {monomial: coefficient for monomial, coefficient in total.items()
+            if coefficient}
+
+
+def _multiply_polynomials(polynomial: Dict[Tuple[Tuple[str, int], ...], int],
+                          other: Dict[Tuple[Tuple[str, int], ...], int],
+                          max_terms: int) \
+        -> Dict[Tuple[Tuple[str, int], ...], int]:
+    """
+    Return the product of <polynomial> and <other>, as maps from monomials
+    to coefficients, raising a PolynomialTooLargeError as soon as it has
+    more than <max_terms> terms.
+
+    >>> _multiply_polynomials({(('a', 1),): 1, (): 2}, \
+                              {(('a', 1),): 1, (('b', 1),): 3}, 10)
+    {(('a', 2),): 1, (('a', 1), ('b', 1)): 3, (('a', 1),): 2, (('b', 1),): 6}
+    """
+    product = {}
+    for monomial, coefficient in polynomial.items():
+        for other_monomial, other_coefficient in other.items():
+            if not monomial:
+                key = other_monomial
+            elif not other_monomial:
+                key = monomial
+            else:
+                powers = dict(monomial)
+                for variable, exponent in other_monomial:
+                    powers[variable] = powers.get(variable, 0) + exponent
+                key = tuple(sorted(powers.items()))
+            product[key] = product.get(key, 0) + coefficient \
+                * other_coefficient
+        if len(product) > max_terms:
+            raise PolynomialTooLargeError(max_terms)
+    return {monomial: coefficient
+            for monomial, coefficient in product.items() if coefficient}
+
+
+def _horner(polynomial: Dict[Tuple[Tuple[str, int], ...], int]) -> ExprTree:
+    """
+    Helper for from_polynomial.
+
+    Return the tree in Horner form for the non-zero <polynomial>.
+    """
+    variables = [monomial[0][0] for monomial in polynomial if monomial]
+    if not variables:
+        return ExprTree(polynomial[()], [])
+    variable = min(variables)
+    # the polynomial multiplying variable to each power
+    parts = {}
+    for monomial in sorted(polynomial, key=lambda item: (not item, item)):
+        exponent = monomial[0][1] if monomial and monomial[0][0] == variable \
+            else 0
+        rest = monomial[1:] if exponent else monomial
+        parts.setdefault(exponent, {})[rest] = polynomial[monomial]
+    degree = max(parts)
+    tree = _horner(parts[degree])
+    for exponent in range(degree - 1, -1, -1):
+        if tree._subtrees or tree._root != 1:
+            tree = _join(OP_MULTIPLY, [ExprTree(variable, []), tree])
+        else:
+            tree = ExprTree(variable, [])
+        if exponent in parts:
+            tree = _join(OP_ADD, [_horner(parts[exponent]), tree])
+    return tree
+
+
+def _join(operator: str, operands: List[ExprTree]) -> ExprTree:
+    """
+    Return the tree for <operator> applied to <operands>, merging the
+    operands that are the same operator into it, or the only operand.
+    """
+    merged = []
+    for operand in operands:
+        if operand._subtrees and operand._root == operator:
+            merged.extend(operand._subtrees)
+        else:
+            merged.append(operand)
+    if len(merged) == 1:
+        return merged[0]
+    return ExprTree(operator, merged)
+
+
+def _convolve(operator: str, counts: Dict[int, int],
+              others: Dict[int, int], limit: int) -> Dict[int, int]:
+    """
+    Return the histogram of the sums, if <operator> is OP_ADD, or else the
+    products, up to <limit>, of a value counted in <counts> and one counted
+    in <others>.
+
+    >>> _convolve(OP_ADD, {1: 1, 2: 1}, {1: 2, 2: 3}, 10)
+    {2: 2, 3: 5, 4: 3}
+    >>> _convolve(OP_MULTIPLY, {1: 1, 2: 1}, {3: 1, 6: 4}, 10)
+    {3: 1, 6: 5}
+    """
+    combined = {}
+    others = sorted(others.items())
+    keys = [other for other, _ in others]
+    for value, count in counts.items():
+        if operator == OP_ADD:
+            end = bisect_right(keys, limit - value)
+        else:
+            end = bisect_right(keys, limit // value)
+        for other, other_count in others[:end]:
+            key = value + other if operator == OP_ADD else value * other
+            combined[key] = combined.get(key, 0) + count * other_count
+    return combined
+
+
+def _unapply(operator: str, value: int, operand: int) -> Optional[int]:
+    """
+    Return the value that <operand> combines with by <operator> to make
+    <value>, or None if there is none.
+    """
+    if operator == OP_ADD:
+        return value - operand if value >= operand else None
+    return value // operand if not value % operand else None
+
+
+def _is_operator(node: ExprTree) -> bool:
+    """Return whether <node> is an operator with subtrees."""
+    return bool(node._subtrees) and node._root in OPERATORS
+
+
+def _batch_numpy(program: List[Tuple[int, Union[int, str]]],
+                 slots: List[Any], n_rows: int, dtype: Any) -> Any:
+    """
+    Helper for ExprTree.eval_batch.
+
+    Return the value of postfix <program> for each of the <n_rows> rows of
+    the NumPy arrays in <slots>, as an array of <dtype>. Constants stay
+    scalars until they are combined with a column.
+    """
+    stack = []
+    stores = {}
+    for opcode, arg in program:
+        if opcode == PUSH_CONST:
+            stack.append(arg)
+        elif opcode == PUSH_VAR:
+            stack.append(slots[arg])
+        elif opcode == SAVE_SHARED:
+            # a value is only updated in place before it is saved
+            stores[arg] = stack[-1]
+        elif opcode == LOAD_SHARED:
+            stack.append(stores[arg])
+        else:
+            operands = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            if not operands:
+                stack.append(0 if opcode == APPLY_ADD else 1)
+                continue
+            value = operands[0]
+            owned = False
+            for operand in operands[1:]:
+                if owned and opcode == APPLY_ADD:
+                    value += operand
+                elif owned:
+                    value *= operand
+                else:
+                    value = value + operand if opcode == APPLY_ADD \
+                        else value * operand
+                    # a fresh array can be updated in place from now on
+                    owned = isinstance(value, np.ndarray)
+            stack.append(value)
+    result = np.empty(n_rows, dtype=dtype)
+    result[:] = stack[-1]
+    return result
+
+
+def _batch_python(program: List[Tuple[int, Union[int, str]]],
+                  slots: List[List[int]], n_rows: int) -> List[int]:
+    """
+    Helper for ExprTree.eval_batch when NumPy is not installed.
+
+    Return the value of postfix <program> for each of the <n_rows> rows of
+    the lists in <slots>.
+
+    >>> _batch_python([(1, 0), (0, 2), (3, 2)], [[1, 2, 3]], 3)
+    [2, 4, 6]
+    """
+    stack = []
+    stores = {}
+    for opcode, arg in program:
+        if opcode == PUSH_CONST:
+            stack.append(arg)
+        elif opcode == PUSH_VAR:
+            stack.append(slots[arg])
+        elif opcode == SAVE_SHARED:
+            stores[arg] = stack[-1]
+        elif opcode == LOAD_SHARED:
+            stack.append(stores[arg])
+        else:
+            operands = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            func = add if opcode == APPLY_ADD else mul
+            if not operands:
+                stack.append(0 if opcode == APPLY_ADD else 1)
+                continue
+            value = operands[0]
+            for operand in operands[1:]:
+                if isinstance(value, list) and isinstance(operand, list):
+                    value = [func(x, y) for x, y in zip(value, operand)]
+                elif isinstance(value, list):
+                    value = [func(x, operand) for x in value]
+                elif isinstance(operand, list):
+                    value = [func(value, y) for y in operand]
+                else:
+                    value = func(value, operand)
+            stack.append(value)
+    if isinstance(stack[-1], list):
+        return stack[-1]
+    return [stack[-1]] * n_rows
+
+
+def _generate_evaluator(program: List[Tuple[int, Union[int, str]]],
+                        variables: List[str]) \
+        -> Callable[[Dict[str, int]], int]:
+    """
+    Helper for ExprTree.compile.
+
+    Return a function evaluating the postfix <program> over a lookup, where
+    <variables> names the variable in each slot. The generated code binds
+    each variable once, then computes one temporary per operator node.
+    Temporaries are named after their position on the postfix stack, so
+    their number is bounded by the stack depth rather than the tree size,
+    and each store of a shared subtree gets one more variable. Constants
+    too long to write out, which folding or expanding a tree can make, are
+    passed in the namespace of the function instead.
+
+    >>> evaluate = _generate_evaluator([(1, 0), (0, 2), (3, 2)], ['a'])
+    >>> evaluate({'a': 5})
+    10
+    >>> evaluate = _generate_evaluator([(1, 0), (0, 2), (2, 2), (5, 0), \
+                                        (6, 0), (3, 2)], ['a'])
+    >>> evaluate({'a': 5})
+    49
+    """
+    lines = ['def evaluate(lookup):', '    get = lookup.get']
+    namespace = {}
+    for slot, name in enumerate(variables):
+        lines.append(f'    v{slot} = get({name!r})')
+    stack = []
+    for opcode, arg in program:
+        if opcode == PUSH_CONST and abs(arg) < 10 ** 100:
+            stack.append(repr(arg))
+        elif opcode == PUSH_CONST:
+            stack.append(f'c{len(namespace)}')
+            namespace[stack[-1]] = arg
+        elif opcode == PUSH_VAR:
+            stack.append(f'v{arg}')
+        elif opcode == SAVE_SHARED:
+            lines.append(f'    s{arg} = {stack[-1]}')
+            stack[-1] = f's{arg}'
+        elif opcode == LOAD_SHARED:
+            stack.append(f's{arg}')
+        else:
+            operands = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            if not operands:
+                expression = '0' if opcode == APPLY_ADD else '1'
+            elif opcode == APPLY_ADD:
+                expression = ' + '.join(operands)
             else:
-                values[i][j] = ExprTree(values[i][j], [])
-    return values[0][0]
+                expression = ' * '.join(operands)
+            temp = f't{len(stack)}'
+            lines.append(f'    {temp} = {expression}')
+            stack.append(temp)
+    lines.append(f'    return {stack[-1]}')
+    exec('\n'.join(lines), namespace)  # pylint: disable=exec-used
+    return namespace['evaluate']
 
 
 # Provided visualization code - see an example usage at the bottom
@@ -428,6 +2741,16 @@ if __name__ == "__main__":
                                                            'matplotlib.pyplot',
                                                            'random',
                                                            'networkx',
+                                                           'array',
+                                                           'bisect',
+                                                           'collections',
+                                                           'contextlib',
+                                                           'gc',
+                                                           'itertools',
+                                                           'math',
+                                                           'operator',
+                                                           're',
+                                                           'numpy',
                                                            'adts'],
                                 'disable': ['E1136'],
                                 'max-attributes': 15}
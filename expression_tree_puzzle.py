@@ -1,10 +1,26 @@
 from __future__ import annotations
 
-from typing import List, Dict
+import math
+import struct
+from array import array
+from typing import Hashable, List, Dict, Optional, Tuple
 
-from expression_tree import ExprTree
+from expression_tree import ExprTree, FrozenExprTree
+from flat_expression_tree import FlatExprTree
 from puzzle import Puzzle
 
+# the target, the number of variables and the index of the order in
+# _ORDERS at the start of ExpressionTreePuzzle.to_bytes
+_HEADER = struct.Struct('<qIB')
+
+# the orders in which ExpressionTreePuzzle.extensions assigns variables:
+# any unassigned variable next, the first unassigned one, or the unassigned
+# one with the fewest values left in its range
+ANY_ORDER = 'any'
+FIXED_ORDER = 'fixed'
+CONSTRAINED_ORDER = 'constrained'
+_ORDERS = (ANY_ORDER, FIXED_ORDER, CONSTRAINED_ORDER)
+
 
 class ExpressionTreePuzzle(Puzzle):
     """"
@@ -15,24 +31,46 @@ class ExpressionTreePuzzle(Puzzle):
                A variable is considered "unassigned" unless it has a
                non-zero value.
     target: the target value for the expression tree to evaluate to
+    order: the order in which extensions assigns variables, one of
+           ANY_ORDER, FIXED_ORDER and CONSTRAINED_ORDER
 
     === Private Attributes ===
-    _tree: the expression tree
+    _tree: the expression tree, which is a FrozenExprTree shared with other
+           puzzles when this puzzle was made by extensions
+    _checked: the frozen copy of _tree that fail_fast last checked for
+              characters other than alphanumerics, brackets, operators and
+              spaces, and whether it had none, or None if it never checked
+    _bounds: the frozen copy of _tree, the target, the variables and the
+             ranges that variable_domains last found for them, shared with
+             the extensions of this puzzle, or None if it has not been
+             called
 
     === Representation Invariants ===
     - variables contains a key for each variable appearing in _tree
 
     - all values stored in variables are single digit integers (0-9).
+
+    - order is one of ANY_ORDER, FIXED_ORDER and CONSTRAINED_ORDER.
     """
     _tree: ExprTree
     variables: Dict[str, int]
     target: int
+    order: str
+    # these caches default to None at the class level, like those of ExprTree
+    _checked: Optional[Tuple[FrozenExprTree, bool]] = None
+    _bounds: Optional[Tuple[FrozenExprTree, int, Dict[str, int],
+                            Optional[Dict[str, Tuple[int, int]]]]] = None
 
-    def __init__(self, tree: ExprTree, target: int) -> None:
+    def __init__(self, tree: ExprTree, target: int,
+                 order: str = ANY_ORDER) -> None:
         """
         Create a new expression tree puzzle given the provided
         expression tree and the target value. The variables are initialized
-        using the tree's populate_lookup method.
+        using the tree's populate_lookup method, and extensions assigns them
+        in <order>.
+
+        Raise a ValueError if <order> is not one of ANY_ORDER, FIXED_ORDER
+        and CONSTRAINED_ORDER.
 
         >>> puz = ExpressionTreePuzzle(ExprTree('a', []), 4)
         >>> puz.variables == {'a': 0}
@@ -41,10 +79,13 @@ class ExpressionTreePuzzle(Puzzle):
         4
         """
 
+        if order not in _ORDERS:
+            raise ValueError(f'unknown order of variables: {order!r}')
         self.variables = {}
         tree.populate_lookup(self.variables)
         self._tree = tree
         self.target = target
+        self.order = order
 
     def is_solved(self) -> bool:
         """
@@ -68,7 +109,7 @@ class ExpressionTreePuzzle(Puzzle):
         for value in self.variables.values():
             if not value:
                 return False
-        return self._tree.eval(self.variables) == self.target
+        return self._tree.compile()(self.variables) == self.target
 
     def __str__(self) -> str:
         """
@@ -103,8 +144,18 @@ class ExpressionTreePuzzle(Puzzle):
 
         A variable is "unassigned" if it has a value of 0.
 
-        A copy of the expression tree and variables dictionary should be
-        used in each extension made, so as to avoid unintended aliasing.
+        With ANY_ORDER, every unassigned variable may be assigned, so a
+        puzzle with n unassigned variables reaches each full assignment
+        along n! paths. With FIXED_ORDER, only the first unassigned variable
+        in self.variables is assigned, and with CONSTRAINED_ORDER only the
+        one with the fewest values left in its variable_domains range, and
+        only values in that range. Either way each full assignment is
+        reached along a single path.
+
+        A copy of the variables dictionary is used in each extension made,
+        so as to avoid unintended aliasing. The expression tree is never
+        changed by an extension, so all extensions share one frozen copy of
+        it instead of each copying the whole tree.
 
         >>> exp_t = ExprTree('a', [])
         >>> puz = ExpressionTreePuzzle(exp_t, 7)
@@ -119,18 +170,300 @@ class ExpressionTreePuzzle(Puzzle):
         >>> exts_of_puz = puz.extensions()
         >>> len(exts_of_puz) == 18
         True
+        >>> exts_of_puz[0]._tree is exts_of_puz[17]._tree
+        True
+        >>> puz = ExpressionTreePuzzle(exp_t, 8, FIXED_ORDER)
+        >>> [ext.variables['a'] for ext in puz.extensions()]
+        [1, 2, 3, 4, 5, 6, 7, 8, 9]
+        >>> exp_t = ExprTree('+', [ExprTree('a', []), \
+                                   ExprTree('*', [ExprTree('b', []), \
+                                                  ExprTree(9, [])]), \
+                                   ExprTree('c', [])])
+        >>> puz = ExpressionTreePuzzle(exp_t, 40, CONSTRAINED_ORDER)
+        >>> [ext.variables['b'] for ext in puz.extensions()]
+        [3, 4]
         """
+        choices = self._choices()
         extensions = []
-        for variable, value in self.variables.items():
-            if not value:
-                for new_value in range(1, 10):
-                    new_tree = self._tree.copy()
-                    new_puzzle = ExpressionTreePuzzle(new_tree, self.target)
-                    new_puzzle.variables = self.variables.copy()
-                    new_puzzle.variables[variable] = new_value
-                    extensions.append(new_puzzle)
+        tree = self._tree.freeze()
+        for variable, new_values in choices:
+            for new_value in new_values:
+                new_puzzle = ExpressionTreePuzzle(tree, self.target,
+                                                  self.order)
+                new_puzzle.variables = self.variables.copy()
+                new_puzzle.variables[variable] = new_value
+                new_puzzle._checked = self._checked
+                new_puzzle._bounds = self._bounds
+                extensions.append(new_puzzle)
         return extensions
 
+    def _choices(self) -> List[Tuple[str, range]]:
+        """
+        Return the unassigned variables that extensions may assign, in
+        order, each with the values it may assign them, as self.order
+        says.
+        """
+        unassigned = [variable for variable, value in self.variables.items()
+                      if not value]
+        if not unassigned:
+            return []
+        elif self.order == ANY_ORDER:
+            return [(variable, range(1, 10)) for variable in unassigned]
+        elif self.order == FIXED_ORDER:
+            return [(unassigned[0], range(1, 10))]
+        domains = self.variable_domains()
+        if domains is None:
+            return []
+        # the first of the variables with the fewest values left
+        variable = min(unassigned,
+                       key=lambda name: domains[name][1] - domains[name][0])
+        low, high = domains[variable]
+        return [(variable, range(low, high + 1))]
+
+    def state_key(self) -> Hashable:
+        """
+        Return a hashable value that identifies the state of this
+        ExpressionTreePuzzle among the puzzles met while solving it.
+
+        Those puzzles all share the tree, the target and the order of the
+        variables, so only the values of the variables are in the key. They
+        are packed into an int, 4 bits per variable, in the order of
+        self.variables. A puzzle with a value outside the range 0-15 falls
+        back to the string key.
+
+        >>> exp_t = ExprTree('+', [ExprTree('a', []), ExprTree('b', [])])
+        >>> puz = ExpressionTreePuzzle(exp_t, 8)
+        >>> puz.variables['b'] = 5
+        >>> puz.state_key()
+        5
+        >>> puz.extensions()[2].state_key() == 3 * 16 + 5
+        True
+        """
+        key = 0
+        for value in self.variables.values():
+            if not 0 <= value <= 15:
+                return str(self)
+            key = key << 4 | value
+        return key
+
+    def heuristic(self) -> float:
+        """
+        Return an estimate of how far this ExpressionTreePuzzle is from a
+        solution: 0 if it is solved, and otherwise one less than the number
+        of unassigned variables, plus a fraction that grows from 1/2 towards
+        1 with the gap between the target and the value of the tree when
+        each unassigned variable takes the middle of its variable_domains
+        range. Return math.inf if the ranges show there is no solution.
+
+        So the more variables are assigned, the closer the puzzle is, and
+        among puzzles with as many assigned, the one whose middle value is
+        closest to the target is closest. Since a solution is exactly one
+        move per unassigned variable away, the estimate is never more than
+        the number of moves left, as AStarSolver needs.
+
+        >>> exp_t = ExprTree('+', [ExprTree('a', []), \
+                                   ExprTree('*', [ExprTree('b', []), \
+                                                  ExprTree('c', [])])])
+        >>> puz = ExpressionTreePuzzle(exp_t, 20)
+        >>> puz.variables['a'] = 2
+        >>> puz.variable_domains()
+        {'a': (2, 2), 'b': (2, 9), 'c': (2, 9)}
+        >>> round(puz.heuristic(), 3)
+        1.63
+        >>> puz.variables['b'] = 6
+        >>> puz.heuristic()
+        0.5
+        >>> puz.variables['c'] = 3
+        >>> puz.heuristic()
+        0
+        >>> puz.variables['b'] = 7
+        >>> puz.heuristic()
+        inf
+        """
+        domains = self.variable_domains()
+        if domains is None:
+            return math.inf
+        lookup = {}
+        unassigned = 0
+        for variable, value in self.variables.items():
+            if value:
+                lookup[variable] = value
+            else:
+                low, high = domains[variable]
+                lookup[variable] = (low + high) // 2
+                unassigned += 1
+        if not unassigned:
+            return 0
+        gap = abs(self._tree.compile()(lookup) - self.target)
+        fraction = gap / (gap + max(abs(self.target), 1))
+        return unassigned - 1 + (1 + fraction) / 2
+
+    def to_bytes(self) -> bytes:
+        """
+        Return a compact binary encoding of this ExpressionTreePuzzle, which
+        from_bytes decodes.
+
+        The tree is stored as FlatExprTree.to_bytes stores it, and the
+        values of the variables in the order populate_lookup gives them.
+        The order of extensions is kept too, but not the caches.
+
+        >>> exp_t = ExprTree('+', [ExprTree('a', []), ExprTree('b', [])])
+        >>> puz = ExpressionTreePuzzle(exp_t, 8, FIXED_ORDER)
+        >>> puz.variables['b'] = 5
+        >>> copy = ExpressionTreePuzzle.from_bytes(puz.to_bytes())
+        >>> print(copy)
+        {'a': 0, 'b': 5}
+        (a + b) = 8
+        >>> copy.order == FIXED_ORDER
+        True
+        """
+        return b''.join([_HEADER.pack(self.target, len(self.variables),
+                                      _ORDERS.index(self.order)),
+                         array('b', self.variables.values()).tobytes(),
+                         FlatExprTree.from_expr_tree(self._tree).to_bytes()])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> ExpressionTreePuzzle:
+        """
+        Return the ExpressionTreePuzzle encoded in <data> by to_bytes.
+
+        <data> may be any bytes-like object, such as a slice of a
+        memory-mapped file. Raise a ValueError if the number of variables
+        stored does not match the tree, or the order is unknown.
+        """
+        target, n_variables, order = _HEADER.unpack_from(data)
+        if order >= len(_ORDERS):
+            raise ValueError(f'unknown order of variables: {order}')
+        start = _HEADER.size + n_variables
+        tree = FlatExprTree.from_bytes(data[start:]).to_expr_tree()
+        puzzle = cls(tree, target, _ORDERS[order])
+        if len(puzzle.variables) != n_variables:
+            raise ValueError(f'expected {len(puzzle.variables)} variables, '
+                             f'not {n_variables}')
+        for variable, value in zip(list(puzzle.variables),
+                                   data[_HEADER.size:start]):
+            puzzle.variables[variable] = value
+        return puzzle
+
+    def variable_domains(self) -> Optional[Dict[str, Tuple[int, int]]]:
+        """
+        Return the inclusive (low, high) range of values that each variable
+        may take in a solution of this puzzle, or None if the ranges show
+        that there is no solution.
+
+        An assigned variable can only keep its value and an unassigned one
+        can take any value in the range 1-9, and these ranges are narrowed
+        by ExprTree.narrow_domains. A range may still include values that
+        lead to no solution.
+
+        The ranges are kept for the extensions of this puzzle, which start
+        from them instead of from 1-9, as long as they only assign more of
+        the variables.
+
+        >>> exp_t = ExprTree('+', [ExprTree('*', [ExprTree('a', []), \
+                                                  ExprTree(7, [])]), \
+                                   ExprTree('b', [])])
+        >>> puz = ExpressionTreePuzzle(exp_t, 40)
+        >>> puz.variable_domains()
+        {'a': (5, 5), 'b': (5, 5)}
+        >>> puz.variables['b'] = 4
+        >>> puz.variable_domains() is None
+        True
+        """
+        tree = self._tree.freeze()
+        known = self._known_domains(tree)
+        domains = {}
+        for variable, value in self.variables.items():
+            if known is None:
+                domains[variable] = (value, value) if value else (1, 9)
+            elif not value:
+                domains[variable] = known[variable]
+            elif known[variable][0] <= value <= known[variable][1]:
+                domains[variable] = (value, value)
+            else:
+                return None
+        narrowed = tree.narrow_domains(domains, self.target)
+        self._bounds = (tree, self.target, self.variables.copy(), narrowed)
+        return narrowed
+
+    def solution_values(self) -> Optional[Dict[str, int]]:
+        """
+        Return values for the variables of this ExpressionTreePuzzle that
+        solve it, keeping those already assigned, or None if it has no
+        solution.
+
+        The values are found by ExprTree.find_assignment within the ranges
+        of variable_domains, and a ValueError is raised if that cannot be
+        used on the tree.
+
+        >>> exp_t = ExprTree('*', [ExprTree('+', [ExprTree('a', []), \
+                                                  ExprTree('b', [])]), \
+                                   ExprTree('c', [])])
+        >>> puz = ExpressionTreePuzzle(exp_t, 40)
+        >>> puz.variables['a'] = 1
+        >>> puz.solution_values()
+        {'a': 1, 'b': 9, 'c': 4}
+        >>> puz.target = 11
+        >>> puz.solution_values() is None
+        True
+        """
+        domains = self.variable_domains()
+        if domains is None:
+            return None
+        values = self._tree.find_assignment(domains, self.target)
+        if values is None:
+            return None
+        return {variable: values[variable] for variable in self.variables}
+
+    def count_solutions(self) -> int:
+        """
+        Return the number of ways to assign values 1-9 to the unassigned
+        variables of this ExpressionTreePuzzle that solve it, without
+        listing them.
+
+        The solutions are counted by ExprTree.count_assignments within the
+        ranges of variable_domains, which only leave out values that are in
+        no solution, and a ValueError is raised if that cannot be used on
+        the tree.
+
+        >>> exp_t = ExprTree('*', [ExprTree('+', [ExprTree('a', []), \
+                                                  ExprTree('b', [])]), \
+                                   ExprTree('c', [])])
+        >>> puz = ExpressionTreePuzzle(exp_t, 40)
+        >>> puz.count_solutions()
+        20
+        >>> puz.variables['c'] = 8
+        >>> puz.count_solutions()
+        4
+        >>> puz.target = 11
+        >>> puz.count_solutions()
+        0
+        """
+        domains = self.variable_domains()
+        if domains is None:
+            return 0
+        return self._tree.count_assignments(domains, self.target)
+
+    def _known_domains(self, tree: FrozenExprTree) \
+            -> Optional[Dict[str, Tuple[int, int]]]:
+        """
+        Return the ranges in _bounds, if they were found for <tree>, for the
+        target of this puzzle and for variables that are all still assigned
+        the same values in this puzzle, or None otherwise.
+        """
+        if self._bounds is None:
+            return None
+        bounds_tree, target, variables, domains = self._bounds
+        if bounds_tree is not tree or target != self.target or domains is None:
+            return None
+        for variable, value in variables.items():
+            if value and self.variables.get(variable) != value:
+                return None
+        for variable in self.variables:
+            if variable not in domains:
+                return None
+        return domains
+
     #
     # The specifics of how you implement this are up to you.
     # Hint 1: remember that a puzzle can only be extended by assigning a value
@@ -142,21 +475,45 @@ class ExpressionTreePuzzle(Puzzle):
         Return True if this ExpressionTreePuzzle can be quickly determined to
         have no solution, False otherwise.
 
+        Besides the simple checks, the ranges of values of the subtrees are
+        propagated through the tree, as variable_domains does, so a puzzle
+        whose target is out of reach of its unassigned variables fails fast.
+
+        No tree or string is built: the tree is only evaluated when every
+        variable is assigned, its characters are checked once for all the
+        puzzles that share it, and the ranges start from those found for
+        the puzzle this one extends.
+
+        >>> exp_t = ExprTree('*', [ExprTree('a', []), ExprTree('b', [])])
+        >>> ExpressionTreePuzzle(exp_t, 81).fail_fast()
+        False
+        >>> ExpressionTreePuzzle(exp_t, 82).fail_fast()
+        True
         """
-        if self.is_solved():
-            return False
-        if not self.extensions() and self.variables:
-            return True
+        unassigned = 0
+        for value in self.variables.values():
+            if not value:
+                unassigned += 1
+        if not unassigned:
+            # this is when the puzzle may be solved, or has no extensions
+            if self._tree.compile()(self.variables) == self.target:
+                return False
+            if self.variables:
+                return True
         if self.target < 0:
             return True
         for value in self.variables.values():
             if value > self.target:
                 return True
-        valid = set('()+* ')
-        for char in str(self._tree):
-            if not char.isalnum() and char not in valid:
-                return True
-        return False
+        tree = self._tree.freeze()
+        if self._checked is None or self._checked[0] is not tree:
+            valid = set('()+* ')
+            self._checked = (tree, all(char.isalnum() or char in valid
+                                       for char in str(tree)))
+        if not self._checked[1]:
+            return True
+        # a puzzle without variables can only fail the checks above
+        return bool(self.variables) and self.variable_domains() is None
 
 
 if __name__ == "__main__":
@@ -166,14 +523,13 @@ if __name__ == "__main__":
 
     import python_ta
 
-    python_ta.check_all(config={'pyta-reporter': 'ColorReporter',
-                                'allowed-io': [],
-                                'allowed-import-modules': ['doctest',
-                                                           'python_ta',
-                                                           'typing',
-                                                           '__future__',
-                                                           'expression_tree',
-                                                           'puzzle'],
-                                'disable': ['E1136'],
-                                'max-attributes': 15}
-                        )
+    python_ta.check_all(config={
+        'pyta-reporter': 'ColorReporter',
+        'allowed-io': [],
+        'allowed-import-modules': ['doctest', 'python_ta', 'typing',
+                                   '__future__', 'array', 'math', 'struct',
+                                   'expression_tree', 'flat_expression_tree',
+                                   'puzzle'],
+        'disable': ['E1136'],
+        'max-attributes': 15}
+    )
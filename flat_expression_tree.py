@@ -0,0 +1,440 @@
+from __future__ import annotations
+
+import struct
+import sys
+from array import array
+from typing import Dict, List, Optional, Tuple, Union
+
+from expression_tree import ExprTree, OP_ADD, OP_MULTIPLY, OPERATORS, \
+    PUSH_CONST, PUSH_VAR, APPLY_ADD, APPLY_MULTIPLY, _gc_paused
+
+# opcode for an empty tree, in addition to the postfix program opcodes
+EMPTY = 4
+
+# the root of an ExprTree node for each operator opcode
+_OPERATOR_ROOTS = {APPLY_ADD: OP_ADD, APPLY_MULTIPLY: OP_MULTIPLY}
+
+# the number of nodes and of variables at the start of FlatExprTree.to_bytes
+_HEADER = struct.Struct('<II')
+
+# the typecodes _pack_ints may store an array of integers with, narrowest
+# first
+_INT_TYPECODES = 'bhiq'
+
+
+class FlatExprTree:
+    """
+    An expression tree stored as parallel typed arrays, one entry per node,
+    with the nodes in postorder.
+
+    Each node takes a few dozen bytes instead of a full Python object and
+    list, and every operation is an iterative loop over the arrays, so very
+    large trees are both smaller and faster to traverse than an ExprTree.
+
+    === Private Attributes ===
+    _opcodes: The kind of each node: PUSH_CONST, PUSH_VAR, APPLY_ADD,
+              APPLY_MULTIPLY or EMPTY.
+    _values: The constant stored at each PUSH_CONST node, or the slot of
+             the variable stored at each PUSH_VAR node.
+    _starts: The index of the first node of each node's subtree.
+    _counts: The number of children of each node.
+    _variables: The name of the variable in each slot.
+
+    === Representation Invariants ===
+    - _opcodes, _values, _starts and _counts all have the same length.
+    - The subtree of node i is made of the nodes _starts[i] to i.
+    - The last child of node i is node i - 1, and the child before child c
+      is node _starts[c] - 1.
+    - An EMPTY node is the only node of its tree.
+    """
+    _opcodes: array
+    _values: array
+    _starts: array
+    _counts: array
+    _variables: List[str]
+
+    def __init__(self) -> None:
+        """Initialize a new, empty FlatExprTree.
+        """
+        self._opcodes = array('b', [EMPTY])
+        self._values = array('q', [0])
+        self._starts = array('l', [0])
+        self._counts = array('l', [0])
+        self._variables = []
+
+    @classmethod
+    def from_expr_tree(cls, tree: ExprTree) -> FlatExprTree:
+        """
+        Return a FlatExprTree equal to <tree>.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> flat = FlatExprTree.from_expr_tree(exp_t)
+        >>> list(flat._opcodes)
+        [0, 1, 1, 3, 1, 2]
+        >>> list(flat._starts)
+        [0, 1, 2, 1, 4, 0]
+        """
+        flat = cls()
+        if tree.is_empty():
+            return flat
+        opcodes = array('b')
+        values = array('q')
+        starts = array('l')
+        counts = array('l')
+        slots = {}
+        # the start index of each emitted subtree whose parent is pending
+        pending_starts = []
+        to_visit = [(tree, False)]
+        while to_visit:
+            node, expanded = to_visit.pop()
+            if node._subtrees and not expanded:
+                to_visit.append((node, True))
+                for child in reversed(node._subtrees):
+                    to_visit.append((child, False))
+                continue
+            count = len(node._subtrees)
+            if count:
+                start = pending_starts[len(pending_starts) - count]
+                del pending_starts[len(pending_starts) - count:]
+            else:
+                start = len(opcodes)
+            pending_starts.append(start)
+            opcode, value = _encode_root(node._root, slots)
+            opcodes.append(opcode)
+            values.append(value)
+            starts.append(start)
+            counts.append(count)
+        flat._opcodes = opcodes
+        flat._values = values
+        flat._starts = starts
+        flat._counts = counts
+        flat._variables = list(slots)
+        return flat
+
+    def to_expr_tree(self) -> ExprTree:
+        """
+        Return an ExprTree equal to this FlatExprTree.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> FlatExprTree.from_expr_tree(exp_t).to_expr_tree() == exp_t
+        True
+        """
+        variables = self._variables
+        results = []
+        with _gc_paused():
+            for opcode, value, count in zip(self._opcodes, self._values,
+                                            self._counts):
+                if opcode == PUSH_CONST:
+                    root = value
+                elif opcode == PUSH_VAR:
+                    root = variables[value]
+                else:
+                    root = _OPERATOR_ROOTS.get(opcode)
+                if count:
+                    subtrees = results[len(results) - count:]
+                    del results[len(results) - count:]
+                else:
+                    subtrees = []
+                results.append(ExprTree(root, subtrees))
+        return results[0]
+
+    def to_bytes(self) -> bytes:
+        """
+        Return a compact binary encoding of this FlatExprTree, which
+        from_bytes decodes.
+
+        Each array is stored with the narrowest integer type that holds all
+        of its values, so a small tree takes only a few bytes per node.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> data = FlatExprTree.from_expr_tree(exp_t).to_bytes()
+        >>> len(data)
+        40
+        >>> print(FlatExprTree.from_bytes(data))
+        (3 + (x * y) + x)
+        """
+        names = [name.encode('utf-8') for name in self._variables]
+        return b''.join([_HEADER.pack(len(self._opcodes), len(names)),
+                         _pack_ints(array('q', map(len, names))),
+                         b''.join(names),
+                         self._opcodes.tobytes(),
+                         _pack_ints(self._values),
+                         _pack_ints(self._starts),
+                         _pack_ints(self._counts)])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> FlatExprTree:
+        """
+        Return the FlatExprTree encoded in <data> by to_bytes.
+
+        <data> may be any bytes-like object, such as a slice of a
+        memory-mapped file.
+        """
+        n_nodes, n_names = _HEADER.unpack_from(data)
+        lengths, offset = _unpack_ints(data, _HEADER.size, n_names, 'q')
+        variables = []
+        for length in lengths:
+            variables.append(str(data[offset:offset + length], 'utf-8'))
+            offset += length
+        flat = cls()
+        flat._variables = variables
+        flat._opcodes = array('b')
+        flat._opcodes.frombytes(data[offset:offset + n_nodes])
+        offset += n_nodes
+        flat._values, offset = _unpack_ints(data, offset, n_nodes, 'q')
+        flat._starts, offset = _unpack_ints(data, offset, n_nodes, 'l')
+        flat._counts, offset = _unpack_ints(data, offset, n_nodes, 'l')
+        return flat
+
+    def __len__(self) -> int:
+        """
+        Return the number of nodes in this FlatExprTree, counting an empty
+        tree as one node.
+        """
+        return len(self._opcodes)
+
+    def is_empty(self) -> bool:
+        """Return whether this expression tree is empty.
+
+        >>> FlatExprTree().is_empty()
+        True
+        """
+        return self._opcodes[-1] == EMPTY
+
+    def eval(self, lookup: Dict[str, int]) -> int:
+        """
+        Evaluate this expression tree and return the result, as
+        ExprTree.eval does.
+
+        Precondition:
+        lookup contains all of the variables necessary to evaluate
+        this expression tree.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> FlatExprTree.from_expr_tree(exp_t).eval({'x': 7, 'y': 3})
+        31
+        """
+        slot_values = [lookup.get(name) for name in self._variables]
+        values = self._values
+        counts = self._counts
+        stack = []
+        for i, opcode in enumerate(self._opcodes):
+            count = counts[i]
+            if opcode == APPLY_ADD:
+                result = 0
+                for operand in stack[len(stack) - count:]:
+                    result += operand
+            elif opcode == APPLY_MULTIPLY:
+                result = 1
+                for operand in stack[len(stack) - count:]:
+                    result *= operand
+            elif opcode == PUSH_VAR:
+                result = slot_values[values[i]]
+            elif opcode == PUSH_CONST:
+                result = values[i]
+            else:
+                result = 0
+            if count:
+                del stack[len(stack) - count:]
+            stack.append(result)
+        return stack[-1]
+
+    def __str__(self) -> str:
+        """
+        Return a string representation of this expression tree, the same as
+        that of the equal ExprTree.
+
+        >>> exp_t = ExprTree('+', [ExprTree('*', [ExprTree(7, []), \
+                                                  ExprTree('+', \
+                                                           [ExprTree(6, []), \
+                                                           ExprTree(6, [])] \
+                                                          )]), \
+                                   ExprTree(5, [])])
+        >>> print(FlatExprTree.from_expr_tree(exp_t))
+        ((7 * (6 + 6)) + 5)
+        >>> print(FlatExprTree())
+        ()
+        """
+        if self.is_empty():
+            return '()'
+        pieces = []
+        # holds node indices, and the strings between them as-is
+        to_emit = [len(self._opcodes) - 1]
+        while to_emit:
+            item = to_emit.pop()
+            if isinstance(item, str):
+                pieces.append(item)
+                continue
+            root = self._root_at(item)
+            if root not in OPERATORS:
+                pieces.append(str(root))
+                continue
+            if not self._counts[item]:
+                # ExprTree prints an operator without children this way
+                pieces.append(')')
+                continue
+            separator = ' ' + root + ' '
+            to_emit.append(')')
+            child = item - 1
+            for _ in range(self._counts[item]):
+                to_emit.append(child)
+                child = self._starts[child] - 1
+                to_emit.append(separator)
+            # the first child is not preceded by a separator
+            to_emit[-1] = '('
+        return ''.join(pieces)
+
+    def substitute(self, from_to: Dict[Union[str, int],
+                                       Union[str, int]]) -> None:
+        """
+        Replace each value in this expression tree that is a key in <from_to>
+        with the value associated with it in <from_to>, as
+        ExprTree.substitute does.
+
+        >>> exp_t = ExprTree('*',[ExprTree('a', []), \
+                                 ExprTree('*', [ExprTree('a', []),\
+                                                ExprTree(1, [])])])
+        >>> flat = FlatExprTree.from_expr_tree(exp_t)
+        >>> flat.substitute({'a': 2, '*': '+'})
+        >>> print(flat)
+        (2 + (2 + 1))
+        """
+        if self.is_empty():
+            return
+        slots = {name: slot for slot, name in enumerate(self._variables)}
+        for i in range(len(self._opcodes)):
+            root = self._root_at(i)
+            if root in from_to:
+                opcode, value = _encode_root(from_to.get(root), slots)
+                self._opcodes[i] = opcode
+                self._values[i] = value
+        self._variables = list(slots)
+
+    def populate_lookup(self, lookup: Dict[str, int]) -> None:
+        """
+        Add entries to <lookup> so it contains a key for all variables
+        appearing in this expression tree. Assign a value
+        of 0 to each variable.
+
+        >>> exp_t = ExprTree('+', [ExprTree(3, []), \
+                                   ExprTree('*', [ExprTree('x', []), \
+                                                  ExprTree('y', [])]), \
+                                   ExprTree('x', [])])
+        >>> look_up = {}
+        >>> FlatExprTree.from_expr_tree(exp_t).populate_lookup(look_up)
+        >>> look_up
+        {'x': 0, 'y': 0}
+        """
+        variables = self._variables
+        values = self._values
+        for i, opcode in enumerate(self._opcodes):
+            if opcode == PUSH_VAR:
+                name = variables[values[i]]
+                if name.isalpha():
+                    lookup[name] = 0
+
+    def _root_at(self, i: int) -> Optional[Union[str, int]]:
+        """
+        Return the value that ExprTree stores at the root of node <i>.
+        """
+        opcode = self._opcodes[i]
+        if opcode == APPLY_ADD:
+            return OP_ADD
+        elif opcode == APPLY_MULTIPLY:
+            return OP_MULTIPLY
+        elif opcode == PUSH_VAR:
+            return self._variables[self._values[i]]
+        elif opcode == PUSH_CONST:
+            return self._values[i]
+        return None
+
+
+def _encode_root(root: Optional[Union[str, int]],
+                 slots: Dict[str, int]) -> Tuple[int, int]:
+    """
+    Return the (opcode, value) pair for a node with the given <root>,
+    adding a new slot to <slots> for a variable that has none yet.
+    """
+    if root is None:
+        return EMPTY, 0
+    elif root == OP_ADD:
+        return APPLY_ADD, 0
+    elif root == OP_MULTIPLY:
+        return APPLY_MULTIPLY, 0
+    elif isinstance(root, str):
+        if root not in slots:
+            slots[root] = len(slots)
+        return PUSH_VAR, slots[root]
+    return PUSH_CONST, root
+
+
+def _pack_ints(values: array) -> bytes:
+    """
+    Return <values> as a typecode from _INT_TYPECODES followed by the
+    little-endian items of an array of that type, choosing the narrowest
+    type that holds all of <values>.
+    """
+    low = min(values, default=0)
+    high = max(values, default=0)
+    for typecode in _INT_TYPECODES:
+        limit = 1 << (8 * array(typecode).itemsize - 1)
+        if -limit <= low and high < limit:
+            break
+    if typecode == values.typecode and sys.byteorder == 'little':
+        packed = values
+    else:
+        packed = array(typecode, values)
+        if sys.byteorder == 'big':  # pragma: no cover
+            packed.byteswap()
+    return typecode.encode('ascii') + packed.tobytes()
+
+
+def _unpack_ints(data: bytes, offset: int, count: int,
+                 typecode: str) -> Tuple[array, int]:
+    """
+    Return an array with typecode <typecode> of the <count> integers that
+    _pack_ints stored in <data> at <offset>, and the offset just past them.
+    """
+    packed = array(chr(data[offset]))
+    offset += 1
+    end = offset + count * packed.itemsize
+    packed.frombytes(data[offset:end])
+    if sys.byteorder == 'big':  # pragma: no cover
+        packed.byteswap()
+    if packed.typecode != typecode:
+        packed = array(typecode, packed)
+    return packed, end
+
+
+if __name__ == "__main__":
+    import doctest
+
+    doctest.testmod()
+
+    import python_ta
+
+    python_ta.check_all(config={'pyta-reporter': 'ColorReporter',
+                                'allowed-io': [],
+                                'allowed-import-modules': ['doctest',
+                                                           'python_ta',
+                                                           'typing',
+                                                           '__future__',
+                                                           'array',
+                                                           'struct',
+                                                           'sys',
+                                                           'expression_tree'],
+                                'disable': ['E1136'],
+                                'max-attributes': 15}
+                        )
@@ -143,13 +143,14 @@ class ExpressionTreePuzzleGUI:
         GUI's dropdown menus.
         """
         for i in range(len(self._variable_name)):
-            self._puzzle.variables[
-                self._variable_name[i].text] = int(
-                    self._variable_map[i].selected_option)
+            name = self._variable_name[i].text
+            value = int(self._variable_map[i].selected_option)
+            self._puzzle.variables[name] = value
+            # only the paths above this variable's leaves are re-evaluated
+            tree_evaluation = self._tree.update_variable(name, value)
             if self._puzzle.is_solved():
                 self._result_label.set_text("SOLVED!")
             else:
-                tree_evaluation = self._tree.eval(self._puzzle.variables)
                 self._result_label.set_text("Eval:"
                                             "" + str(tree_evaluation))
 
@@ -298,7 +299,7 @@ class ExpressionTreePuzzleGUI:
 
         rect = pygame.Rect((0, UI_ITEM_HEIGHT * (n_variables + 1)),
                            (UI_WIDTH, UI_ITEM_HEIGHT))
-        tree_evaluation = self._tree.eval(self._puzzle.variables)
+        tree_evaluation = self._tree.eval_incremental(self._puzzle.variables)
         self._result_label = UILabel(relative_rect=rect,
                                      text=f"Current:"
                                           f" {tree_evaluation}",
@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import List
+import pickle
+from typing import Hashable, List
 
 
 class Puzzle:
@@ -28,6 +29,47 @@ class Puzzle:
         """
         raise NotImplementedError
 
+    def state_key(self) -> Hashable:
+        """
+        Return a hashable value that identifies the state of this Puzzle,
+        which the solvers store in their set of seen states.
+
+        Two puzzles met in the same search have equal keys exactly when they
+        are in the same state. The key defaults to the string representation
+        of this Puzzle; override this in a subclass where a state has a
+        smaller key that is cheaper to compute.
+        """
+        return str(self)
+
+    def heuristic(self) -> float:
+        """
+        Return an estimate of how far this Puzzle is from a solution, which
+        BestFirstSolver and AStarSolver use to choose the state to extend
+        next. A lower estimate is closer, and math.inf means no solution.
+
+        The estimate defaults to 0, so that the states are extended in the
+        order they are met; override this in a subclass where there is a
+        better guide.
+        """
+        return 0
+
+    def to_bytes(self) -> bytes:
+        """
+        Return an encoding of this Puzzle as bytes, which from_bytes
+        decodes, for sending it to another process.
+
+        The encoding defaults to a pickle of this Puzzle; override this and
+        from_bytes in a subclass where there is a more compact one.
+        """
+        return pickle.dumps(self, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Puzzle:
+        """
+        Return the Puzzle encoded in <data> by to_bytes.
+        """
+        return pickle.loads(data)
+
     def extensions(self) -> List[Puzzle]:
         """
         Return a list of legal extensions of this Puzzle.
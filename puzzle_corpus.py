@@ -0,0 +1,177 @@
+"""
+A compact binary file format for corpora of expression trees and expression
+tree puzzles.
+
+A corpus file is laid out as:
+
+- a header: the magic bytes b'EXTC', the format version, the number of
+  records and the offset of the index,
+- the records, one after another: a byte giving the kind of the record,
+  TREE or PUZZLE, then the record's FlatExprTree.to_bytes or
+  ExpressionTreePuzzle.to_bytes encoding,
+- the index: the offset of each record and of the end of the last one, as
+  unsigned 64-bit integers.
+
+All integers are little-endian. A CorpusReader memory-maps the file and
+only reads and decodes a record when it is asked for, so opening a corpus
+of millions of puzzles is instant and needs no memory for the records.
+"""
+from __future__ import annotations
+
+import mmap
+import struct
+import sys
+from array import array
+from typing import BinaryIO, Iterable, Iterator, Union
+
+from expression_tree import ExprTree
+from expression_tree_puzzle import ExpressionTreePuzzle
+from flat_expression_tree import FlatExprTree
+
+MAGIC = b'EXTC'
+VERSION = 2
+
+# the kinds of records, stored as the first byte of each record
+TREE = 0
+PUZZLE = 1
+
+# the magic bytes, the version, the number of records and the index offset
+_HEADER = struct.Struct('<4sHQQ')
+# two consecutive entries of the index: the start and end of a record
+_SPAN = struct.Struct('<QQ')
+
+
+def write_corpus(path: str,
+                 records: Iterable[Union[ExprTree, ExpressionTreePuzzle]]) \
+        -> int:
+    """
+    Write <records> to a new corpus file at <path>, and return the number of
+    records written.
+
+    <records> may be a generator: only the index, of 8 bytes per record, is
+    kept in memory while the file is written.
+
+    Raise a TypeError if a record is neither an ExprTree nor an
+    ExpressionTreePuzzle.
+    """
+    offsets = array('Q')
+    with open(path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, 0, 0))
+        offset = _HEADER.size
+        for record in records:
+            offsets.append(offset)
+            data = _encode_record(record)
+            file.write(data)
+            offset += len(data)
+        offsets.append(offset)
+        if sys.byteorder == 'big':  # pragma: no cover
+            offsets.byteswap()
+        file.write(offsets.tobytes())
+        file.seek(0)
+        file.write(_HEADER.pack(MAGIC, VERSION, len(offsets) - 1, offset))
+    return len(offsets) - 1
+
+
+def _encode_record(record: Union[ExprTree, ExpressionTreePuzzle]) -> bytes:
+    """
+    Return the encoding of <record> in a corpus file, starting with its kind.
+    """
+    if isinstance(record, ExpressionTreePuzzle):
+        return bytes([PUZZLE]) + record.to_bytes()
+    elif isinstance(record, ExprTree):
+        return bytes([TREE]) + FlatExprTree.from_expr_tree(record).to_bytes()
+    raise TypeError(f'cannot store a {type(record).__name__} in a corpus')
+
+
+class CorpusReader:
+    """
+    A read-only view of a corpus file written by write_corpus, which decodes
+    records on demand.
+
+    Index a CorpusReader like a list to get its records, each as an ExprTree
+    or an ExpressionTreePuzzle, and close it, or use it in a with statement,
+    when done.
+
+    === Private Attributes ===
+    _file: The open corpus file.
+    _map: The memory map of _file.
+    _length: The number of records in the corpus.
+    _index_offset: The position of the index in _file.
+    """
+    _file: BinaryIO
+    _map: mmap.mmap
+    _length: int
+    _index_offset: int
+
+    def __init__(self, path: str) -> None:
+        """
+        Open the corpus file at <path>.
+
+        Raise a ValueError if the file is not a corpus file of this version.
+        """
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            magic, version, self._length, self._index_offset = \
+                _HEADER.unpack_from(self._map)
+        except (ValueError, struct.error):
+            self._file.close()
+            raise ValueError(f'{path} is not a corpus file') from None
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a version {VERSION} corpus file')
+
+    def __len__(self) -> int:
+        """Return the number of records in this corpus."""
+        return self._length
+
+    def __getitem__(self, index: int) -> Union[ExprTree, ExpressionTreePuzzle]:
+        """
+        Return a new copy of the record at <index> in this corpus.
+
+        Raise an IndexError if there is no such record.
+        """
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('corpus index out of range')
+        start, end = _SPAN.unpack_from(self._map,
+                                       self._index_offset + 8 * index)
+        data = memoryview(self._map[start:end])
+        if data[0] == PUZZLE:
+            return ExpressionTreePuzzle.from_bytes(data[1:])
+        return FlatExprTree.from_bytes(data[1:]).to_expr_tree()
+
+    def __iter__(self) -> Iterator[Union[ExprTree, ExpressionTreePuzzle]]:
+        """Yield the records of this corpus in order."""
+        for index in range(self._length):
+            yield self[index]
+
+    def close(self) -> None:
+        """Close the corpus file."""
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> CorpusReader:
+        """Return this CorpusReader, for use in a with statement."""
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        """Close the corpus file at the end of a with statement."""
+        self.close()
+
+
+if __name__ == "__main__":
+    import python_ta
+
+    python_ta.check_all(config={
+        'pyta-reporter': 'ColorReporter',
+        'allowed-io': ['write_corpus', 'CorpusReader.__init__'],
+        'allowed-import-modules': ['python_ta', 'typing', '__future__',
+                                   'array', 'mmap', 'struct', 'sys',
+                                   'expression_tree', 'expression_tree_puzzle',
+                                   'flat_expression_tree'],
+        'disable': ['E1136'],
+        'max-attributes': 15}
+    )
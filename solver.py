@@ -1,10 +1,17 @@
 from __future__ import annotations
 
-from typing import List, Optional, Set
+import heapq
+import math
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import count
+from typing import Any, Callable, FrozenSet, Hashable, Iterator, List, \
+    Optional, Set, Tuple
 
 # You may remove this import if you don't use it in your code.
 from adts import Queue
 
+from expression_tree_puzzle import ExpressionTreePuzzle
 from puzzle import Puzzle
 
 
@@ -20,7 +27,7 @@ class Solver:
     # to keep track of all puzzle states that you encounter during the
     # solution process.
     def solve(self, puzzle: Puzzle,
-              seen: Optional[Set[str]] = None) -> List[Puzzle]:
+              seen: Optional[Set[Hashable]] = None) -> List[Puzzle]:
         """
         Return a list of puzzle states representing a path to a solution of
         <puzzle>. The first element in the list should be <puzzle>, the
@@ -34,24 +41,65 @@ class Solver:
 
         Return an empty list if the puzzle has no solution.
 
-        <seen> is either None (default) or a set of puzzle states' string
-        representations, whose puzzle states can't be any part of the path to
-        the solution.
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the path to the solution.
         """
         raise NotImplementedError
 
+    def iter_solutions(self, puzzle: Puzzle,
+                       seen: Optional[Set[Hashable]] = None) \
+            -> Iterator[List[Puzzle]]:
+        """
+        Yield paths to the solutions of <puzzle>, like those solve returns,
+        one at a time, and each to a different solved state, until there
+        are no more.
+
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the paths. The keys of the solved states yielded are added to it.
+
+        This default solves <puzzle> again for each solution, with only the
+        solved states already yielded and those in <seen> excluded;
+        override it in a subclass whose search can go on where it stopped.
+        """
+        if seen is None:
+            seen = set()
+        while True:
+            path = self.solve(puzzle, set(seen))
+            if not path:
+                return
+            seen.add(path[-1].state_key())
+            yield path
+
 
-# Your solve method MUST be a recursive function (i.e. it must make
-# at least one recursive call to itself)
 # You may NOT change the interface to the solve method.
 class DfsSolver(Solver):
     """"
     A solver for full-information puzzles that uses
-    a depth first search strategy.
+    a depth first search strategy, and stops at the first solution it finds.
+
+    === Public Attributes ===
+    max_depth: the largest number of moves from the puzzle that a state may
+               be at to still be extended, or None for no limit
+    max_nodes: the largest number of states that may be extended before
+               giving up, or None for no limit
     """
+    max_depth: Optional[int]
+    max_nodes: Optional[int]
+
+    def __init__(self, max_depth: Optional[int] = None,
+                 max_nodes: Optional[int] = None) -> None:
+        """
+        Initialize a new DfsSolver which extends states at most <max_depth>
+        moves from the puzzle, and at most <max_nodes> states, where None
+        means no limit.
+        """
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
 
     def solve(self, puzzle: Puzzle,
-              seen: Optional[Set[str]] = None) -> List[Puzzle]:
+              seen: Optional[Set[Hashable]] = None) -> List[Puzzle]:
         """
         Return a list of puzzle states representing a path to a solution of
         <puzzle>. The first element in the list should be <puzzle>, the
@@ -63,31 +111,63 @@ class DfsSolver(Solver):
         the puzzle one step closer to a solution, which is represented by the
         last item in the list.
 
-        Return an empty list if the puzzle has no solution.
+        Return an empty list if the puzzle has no solution, or if none is
+        found within the limits of this solver. Since a state is only
+        extended once, a solution beyond max_depth along the first path found
+        to a state is not looked for along shorter paths to it.
 
-        <seen> is either None (default) or a set of puzzle states' string
-        representations, whose puzzle states can't be any part of the path to
-        the solution.
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the path to the solution.
         """
-        # solved case
-        if puzzle.is_solved() and not str(puzzle) in seen:
-            return [puzzle]
-        # dead end
-        elif puzzle.fail_fast() or seen is not None and str(puzzle) in seen:
-            return []
-        else:
-            solution_path = []
-            if seen is None:
-                seen = set()
-            # updating seen with current puzzle
-            seen.add(str(puzzle))
-            # iterate through each possible next step
-            for extension in puzzle.extensions():
-                solution_path.extend(self.solve(extension, seen))
-            # only string together if the solution is at the end
-            if solution_path:
-                return [puzzle] + solution_path
-            return solution_path
+        # stop at the first solution
+        return next(self.iter_solutions(puzzle, seen), [])
+
+    def iter_solutions(self, puzzle: Puzzle,
+                       seen: Optional[Set[Hashable]] = None) \
+            -> Iterator[List[Puzzle]]:
+        """
+        Yield paths to the solutions of <puzzle>, like those solve returns,
+        one at a time, and each to a different solved state, until there
+        are no more, or until the limits of this solver are reached.
+
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the paths. The keys of the states met, including the solved states
+        yielded, are added to it.
+
+        Only the stack of states still to visit is kept between solutions.
+        """
+        if seen is None:
+            seen = set()
+        # each entry is a (puzzle, entry of the state it extends, depth)
+        # triple, and extensions are pushed in reverse so that they are
+        # visited in the order extensions() gives them
+        stack = [(puzzle, None, 0)]
+        extended = 0
+
+        while stack:
+            entry = stack.pop()
+            current, _, depth = entry
+            key = current.state_key()
+            if key in seen:
+                continue
+            if current.is_solved():
+                seen.add(key)
+                yield _path_to(entry)
+                continue
+            # dead end
+            if current.fail_fast():
+                continue
+            seen.add(key)
+            if self.max_depth is not None and depth >= self.max_depth:
+                continue
+            if self.max_nodes is not None and extended >= self.max_nodes:
+                return
+            extended += 1
+            for extension in reversed(current.extensions()):
+                if extension.state_key() not in seen:
+                    stack.append((extension, entry, depth + 1))
 
 
 # Hint: You may find a Queue useful here.
@@ -98,7 +178,7 @@ class BfsSolver(Solver):
     """
 
     def solve(self, puzzle: Puzzle,
-              seen: Optional[Set[str]] = None) -> List[Puzzle]:
+              seen: Optional[Set[Hashable]] = None) -> List[Puzzle]:
         """
         Return a list of puzzle states representing a path to a solution of
         <puzzle>. The first element in the list should be <puzzle>, the
@@ -112,50 +192,435 @@ class BfsSolver(Solver):
 
         Return an empty list if the puzzle has no solution.
 
-        <seen> is either None (default) or a set of puzzle states' string
-        representations, whose puzzle states can't be any part of the path to
-        the solution.
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the path to the solution.
         """
         # if sudoku is already unable to be solved
         if puzzle.fail_fast():
             return []
 
+        # each state is stored once, as a (puzzle, entry of the state it
+        # extends) pair, so the path to it is only built once it is solved
         state = Queue()
-        state.enqueue([puzzle])
-        a_path = None
+        state.enqueue((puzzle, None))
         if seen is None:
             seen = set()
-        found_solution = False
 
         # loop while there are more board states available
         while not state.is_empty():
-            a_path = state.dequeue()
+            entry = state.dequeue()
+            current = entry[0]
+            key = current.state_key()
             # if we reach a solution, return the solution and add the leftover
             # states to seen
-            if a_path[-1].is_solved() and str(a_path[-1]) not in seen:
+            if current.is_solved() and key not in seen:
                 while not state.is_empty():
-                    seen.add(str(state.dequeue()[-1]))
-                found_solution = True
+                    seen.add(state.dequeue()[0].state_key())
+                return _path_to(entry)
             # if we haven't seen this board state before, add it to seen
-            elif str(a_path[-1]) not in seen:
-                seen.add(str(a_path[-1]))
-                for extension in a_path[-1].extensions():
+            elif key not in seen:
+                seen.add(key)
+                for extension in current.extensions():
                     # if the extension is valid enqueue it
-                    enqueue_if_not_fail_fast(extension, state, a_path)
-            # if there are no more states, the puzzle is unsolvable
-            if state.is_empty() and not found_solution:
-                return []
+                    if not extension.fail_fast():
+                        state.enqueue((extension, entry))
+        # if there are no more states, the puzzle is unsolvable
+        return []
 
-        return a_path
+    def iter_solutions(self, puzzle: Puzzle,
+                       seen: Optional[Set[Hashable]] = None) \
+            -> Iterator[List[Puzzle]]:
+        """
+        Yield paths to the solutions of <puzzle>, like those solve returns,
+        one at a time, and each to a different solved state, until there
+        are no more.
 
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the paths. The keys of the states met, including the solved states
+        yielded, are added to it.
+
+        Only the queue of states still to visit is kept between solutions,
+        so the paths come in order of length.
+        """
+        if puzzle.fail_fast():
+            return
+        if seen is None:
+            seen = set()
+        state = Queue()
+        state.enqueue((puzzle, None))
 
-def enqueue_if_not_fail_fast(extension: Puzzle, state: Queue,
-                             a_path: List[Puzzle]) -> None:
+        while not state.is_empty():
+            entry = state.dequeue()
+            current = entry[0]
+            key = current.state_key()
+            if key in seen:
+                continue
+            seen.add(key)
+            if current.is_solved():
+                yield _path_to(entry)
+            else:
+                for extension in current.extensions():
+                    if not extension.fail_fast():
+                        state.enqueue((extension, entry))
+
+
+class BestFirstSolver(Solver):
+    """"
+    A solver for full-information puzzles that always extends the state met
+    so far with the lowest heuristic estimate of its distance to a solution,
+    and stops at the first solution it finds.
+
+    === Public Attributes ===
+    heuristic: the estimate of the distance of a puzzle state to a
+               solution, where math.inf means it has none, or None to use
+               the heuristic method of the puzzle
     """
-    If <extension> does not fail fast, enqueue <a_path + [extension]> to <state>
+    heuristic: Optional[Callable[[Puzzle], float]]
+
+    def __init__(self,
+                 heuristic: Optional[Callable[[Puzzle], float]] = None) -> None:
+        """
+        Initialize a new solver which guides its search by <heuristic>, or
+        by Puzzle.heuristic if it is None.
+        """
+        self.heuristic = heuristic
+
+    def _priority(self, puzzle: Puzzle, depth: int) -> float:
+        """
+        Return the priority of extending <puzzle>, met <depth> moves from
+        the puzzle being solved, where the lowest is extended first.
+        """
+        if self.heuristic is None:
+            return puzzle.heuristic()
+        return self.heuristic(puzzle)
+
+    def solve(self, puzzle: Puzzle,
+              seen: Optional[Set[Hashable]] = None) -> List[Puzzle]:
+        """
+        Return a list of puzzle states representing a path to a solution of
+        <puzzle>. The first element in the list should be <puzzle>, the
+        second element should be a puzzle that is in <puzzle>.extensions(),
+        and so on. The last puzzle in the list should be such that it is in a
+        solved state.
+
+        In other words, each subsequent item of the returned list should take
+        the puzzle one step closer to a solution, which is represented by the
+        last item in the list.
+
+        Return an empty list if the puzzle has no solution.
+
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the path to the solution.
+        """
+        if seen is None:
+            seen = set()
+        # the open list is a heap of (priority, order met, entry) triples,
+        # where each entry is a (puzzle, entry of the state it extends,
+        # depth) triple; states of equal priority are extended in the order
+        # they were met
+        order = count()
+        frontier = [(self._priority(puzzle, 0), next(order), (puzzle, None, 0))]
+
+        while frontier:
+            priority, _, entry = heapq.heappop(frontier)
+            current, _, depth = entry
+            key = current.state_key()
+            if key in seen or priority == math.inf:
+                continue
+            # stop at the first solution
+            if current.is_solved():
+                return _path_to(entry)
+            # dead end
+            if current.fail_fast():
+                continue
+            seen.add(key)
+            for extension in current.extensions():
+                if extension.state_key() not in seen:
+                    heapq.heappush(frontier,
+                                   (self._priority(extension, depth + 1),
+                                    next(order),
+                                    (extension, entry, depth + 1)))
+        # if there are no more states, the puzzle is unsolvable
+        return []
+
+
+class AStarSolver(BestFirstSolver):
+    """"
+    A solver for full-information puzzles that always extends the state met
+    so far with the lowest sum of its number of moves from the puzzle and
+    the heuristic estimate of its distance to a solution.
+
+    With a heuristic that never overestimates the number of moves left, the
+    path found is a shortest one. Every path to a solution of an
+    ExpressionTreePuzzle is one move per variable long, so there the sum
+    is the same for every state apart from the fraction for the gap to the
+    target in ExpressionTreePuzzle.heuristic. This solver then extends the
+    states in order of that gap alone, at any depth, rather than finding a
+    shorter path.
     """
-    if not extension.fail_fast():
-        state.enqueue(a_path + [extension])
+
+    def _priority(self, puzzle: Puzzle, depth: int) -> float:
+        """
+        Return the priority of extending <puzzle>, met <depth> moves from
+        the puzzle being solved, where the lowest is extended first.
+        """
+        return depth + super()._priority(puzzle, depth)
+
+
+class ReachableValueSolver(Solver):
+    """"
+    A solver for expression tree puzzles that finds the values of the
+    variables from the sets of values each subtree can reach, with
+    ExprTree.find_assignment, instead of trying the values one by one.
+
+    This takes time polynomial in the target when no two subtrees of a node
+    share a variable. The path of extensions to the solution is then made
+    to follow the values found. Other puzzles, and puzzles whose path would
+    go through a state in seen, are solved by a DfsSolver.
+    """
+
+    def solve(self, puzzle: Puzzle,
+              seen: Optional[Set[Hashable]] = None) -> List[Puzzle]:
+        """
+        Return a list of puzzle states representing a path to a solution of
+        <puzzle>. The first element in the list should be <puzzle>, the
+        second element should be a puzzle that is in <puzzle>.extensions(),
+        and so on. The last puzzle in the list should be such that it is in a
+        solved state.
+
+        In other words, each subsequent item of the returned list should take
+        the puzzle one step closer to a solution, which is represented by the
+        last item in the list.
+
+        Return an empty list if the puzzle has no solution.
+
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the path to the solution.
+        """
+        if seen is None:
+            seen = set()
+        if not isinstance(puzzle, ExpressionTreePuzzle):
+            return DfsSolver().solve(puzzle, seen)
+        try:
+            assignment = puzzle.solution_values()
+        except ValueError:
+            return DfsSolver().solve(puzzle, seen)
+        if assignment is None:
+            return []
+
+        path = [puzzle]
+        while not path[-1].is_solved():
+            # the extension that assigns one more variable its value found
+            path.append(next(
+                extension for extension in path[-1].extensions()
+                if all(not value or value == assignment[variable]
+                       for variable, value in extension.variables.items())))
+        keys = [state.state_key() for state in path]
+        if any(key in seen for key in keys):
+            return DfsSolver().solve(puzzle, seen)
+        seen.update(keys)
+        return path
+
+
+class ParallelSolver(Solver):
+    """"
+    A solver for full-information puzzles that splits the search at the
+    first levels of extensions into subproblems, and solves them on several
+    processes at once.
+
+    The subproblems and the solutions are sent between processes as given
+    by Puzzle.to_bytes. The first solution reported is returned, once the
+    subproblems not yet started are cancelled and the workers have stopped
+    those they are solving.
+
+    === Public Attributes ===
+    solver: the solver that each worker process solves subproblems with
+    workers: the number of worker processes, or None for one per CPU
+    split_depth: the number of levels of extensions that the puzzle is
+                 extended by to make the subproblems
+    """
+    solver: Solver
+    workers: Optional[int]
+    split_depth: int
+
+    def __init__(self, solver: Optional[Solver] = None,
+                 workers: Optional[int] = None, split_depth: int = 1) -> None:
+        """
+        Initialize a new solver which solves the subproblems <split_depth>
+        levels of extensions below a puzzle with <solver>, or a DfsSolver if
+        it is None, on <workers> processes.
+        """
+        self.solver = DfsSolver() if solver is None else solver
+        self.workers = workers
+        self.split_depth = split_depth
+
+    def solve(self, puzzle: Puzzle,
+              seen: Optional[Set[Hashable]] = None) -> List[Puzzle]:
+        """
+        Return a list of puzzle states representing a path to a solution of
+        <puzzle>. The first element in the list should be <puzzle>, the
+        second element should be a puzzle that is in <puzzle>.extensions(),
+        and so on. The last puzzle in the list should be such that it is in a
+        solved state.
+
+        In other words, each subsequent item of the returned list should take
+        the puzzle one step closer to a solution, which is represented by the
+        last item in the list.
+
+        Return an empty list if the puzzle has no solution.
+
+        <seen> is either None (default) or a set of puzzle states' keys, as
+        given by Puzzle.state_key, whose puzzle states can't be any part of
+        the path to the solution. The states met by the subproblems that were
+        solved are added to it.
+        """
+        if seen is None:
+            seen = set()
+        # the states split_depth levels of extensions below the puzzle, as
+        # (puzzle, entry of the state it extends) entries
+        level = [(puzzle, None)]
+        depth = 0
+        while True:
+            parts = {}
+            for entry in level:
+                current = entry[0]
+                key = current.state_key()
+                if key in seen or key in parts:
+                    continue
+                # stop at the first solution
+                if current.is_solved():
+                    return _path_to(entry)
+                # dead end
+                if not current.fail_fast():
+                    parts[key] = entry
+            if depth == self.split_depth or not parts:
+                return self._solve_parts(list(parts.values()), seen)
+            seen.update(parts)
+            level = [(extension, entry) for entry in parts.values()
+                     for extension in entry[0].extensions()]
+            depth += 1
+
+    def _solve_parts(self, parts: List[Tuple[Puzzle, Optional[tuple]]],
+                     seen: Set[Hashable]) -> List[Puzzle]:
+        """
+        Return the path to the first solution found of the puzzles in
+        <parts>, solved on the worker processes, which is the path to its
+        entry followed by the path the worker found, or an empty list if
+        none has a solution.
+
+        The keys in <seen> are sent with each puzzle, so that the workers
+        do not go through the states they exclude either.
+        """
+        if not parts:
+            return []
+        excluded = frozenset(seen)
+        stop = multiprocessing.Event()
+        executor = ProcessPoolExecutor(self.workers,
+                                       initializer=_start_worker,
+                                       initargs=(stop,))
+        try:
+            pending = {executor.submit(_solve_part, self.solver,
+                                       type(entry[0]), entry[0].to_bytes(),
+                                       excluded):
+                       entry for entry in parts}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    entry = pending.pop(future)
+                    path, part_seen = future.result()
+                    seen.update(part_seen)
+                    if path:
+                        puzzle_type = type(entry[0])
+                        return _path_to(entry) + \
+                            [puzzle_type.from_bytes(data) for data in path]
+            return []
+        finally:
+            # the workers stop the subproblems they are solving, and skip
+            # those they have not started yet
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+
+
+# the event that ParallelSolver sets to tell the worker processes to stop,
+# in each worker process
+_stop_event: Optional[Any] = None
+
+
+def _start_worker(stop: Any) -> None:
+    """
+    Initialize a worker process of ParallelSolver, which stops taking on
+    subproblems once <stop> is set.
+    """
+    global _stop_event
+    _stop_event = stop
+
+
+def _solve_part(solver: Solver, puzzle_type: type, data: bytes,
+                excluded: FrozenSet[Hashable]) \
+        -> Tuple[List[bytes], Set[Hashable]]:
+    """
+    Solve the puzzle of <puzzle_type> encoded in <data> with <solver>, in a
+    worker process of ParallelSolver, without going through the states
+    whose keys are in <excluded>. Return the encodings of the states on the
+    path to the solution after the puzzle itself, or an empty list if there
+    is no solution, and the keys of the states met that were not excluded.
+    """
+    seen = _StoppableSet(excluded)
+    try:
+        seen.check()
+        path = solver.solve(puzzle_type.from_bytes(data), seen)
+    except _Stopped:
+        return [], set()
+    return [state.to_bytes() for state in path[1:]], \
+        set(seen).difference(excluded)
+
+
+class _Stopped(Exception):
+    """Raised in a worker process of ParallelSolver when it has to stop."""
+
+    def __str__(self) -> str:
+        """Return a string representation of this error."""
+        return 'the solver was stopped'
+
+
+class _StoppableSet(set):
+    """
+    The set of seen states' keys of a subproblem in a worker process of
+    ParallelSolver, which raises _Stopped when a key is added after the
+    stop event is set. The solvers add each state they extend to it, so
+    they stop soon after the event is set.
+    """
+
+    def add(self, key: Hashable) -> None:
+        """
+        Add <key> to this set, checking the stop event every 64 keys.
+        """
+        if not len(self) % 64:
+            self.check()
+        super().add(key)
+
+    def check(self) -> None:
+        """Raise _Stopped if the stop event is set."""
+        if _stop_event is not None and _stop_event.is_set():
+            raise _Stopped
+
+
+def _path_to(entry: Tuple[Puzzle, Optional[tuple], ...]) -> List[Puzzle]:
+    """
+    Return the path of puzzle states from the first one to the one in
+    <entry>, following the link in the second item of each entry to the
+    entry of the state it extends.
+    """
+    path = []
+    while entry is not None:
+        path.append(entry[0])
+        entry = entry[1]
+    path.reverse()
+    return path
 
 
 if __name__ == "__main__":
@@ -168,7 +633,15 @@ if __name__ == "__main__":
                                                            'typing',
                                                            '__future__',
                                                            'puzzle',
-                                                           'adts'],
+                                                           'expression_tree_'
+                                                           'puzzle',
+                                                           'adts',
+                                                           'heapq',
+                                                           'itertools',
+                                                           'math',
+                                                           'multiprocessing',
+                                                           'concurrent.'
+                                                           'futures'],
                                 'disable': ['E1136'],
                                 'max-attributes': 15}
                         )